@@ -0,0 +1,126 @@
+"""
+Benchmark de get_original_filename: recorrido lineal (implementación
+anterior) frente al índice inverso (user_id, file_type, stored_name).
+
+Mide la búsqueda aislada y la latencia completa de una petición
+/storage/<user_id>/downloads/<archivo> con el cliente de pruebas de Flask
+para usuarios con N archivos registrados.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_lookup.py
+    python benchmarks/bench_lookup.py --sizes 1000 10000 50000 --requests 500
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+USER_ID = "4242"
+
+
+def linear_original_filename(self, user_id, stored_filename, file_type="downloads"):
+    """Implementación anterior: recorre todos los archivos del usuario"""
+    user_key = f"{user_id}_{file_type}"
+    if user_key not in self.metadata:
+        return stored_filename
+
+    for file_data in self.metadata[user_key]["files"].values():
+        if file_data["stored_name"] == stored_filename:
+            return file_data["original_name"]
+
+    return stored_filename
+
+
+def populate(file_service, count):
+    """Registra count archivos en memoria (sin tocar el backend) y reconstruye los índices"""
+    files = {}
+    for number in range(1, count + 1):
+        files[str(number)] = {
+            "original_name": f"Archivo original {number}.bin",
+            "stored_name": f"archivo_{number}.bin",
+            "registered_at": time.time(),
+        }
+    file_service.metadata[f"{USER_ID}_downloads"] = {"next_number": count + 1, "files": files}
+    file_service.rebuild_stored_name_index()
+
+
+def time_lookups(lookup, names, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for name in names:
+            lookup(USER_ID, name, "downloads")
+    return (time.perf_counter() - start) / (rounds * len(names))
+
+
+def time_requests(client, url, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.get(url)
+        response.close()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="archivos registrados por usuario")
+    parser.add_argument("--requests", type=int, default=300, help="peticiones HTTP por caso")
+    parser.add_argument("--lookups", type=int, default=200, help="nombres distintos consultados por caso")
+    args = parser.parse_args()
+
+    # BASE_DIR y la metadata son rutas relativas: todo va a un directorio temporal
+    workdir = tempfile.mkdtemp(prefix="bench_lookup_")
+    os.chdir(workdir)
+
+    from flask_app import app
+    from file_service import file_service
+
+    download_dir = os.path.join("storage", USER_ID, "downloads")
+    os.makedirs(download_dir, exist_ok=True)
+    indexed = file_service.get_original_filename
+    linear = types.MethodType(linear_original_filename, file_service)
+    client = app.test_client()
+
+    print(f"{'archivos':>9} | {'lineal µs':>10} | {'índice µs':>10} | {'x':>7} | "
+          f"{'GET lineal p50/p99 ms':>22} | {'GET índice p50/p99 ms':>22}")
+    for count in args.sizes:
+        populate(file_service, count)
+        names = [f"archivo_{random.randint(1, count)}.bin" for _ in range(args.lookups)]
+        rounds = max(1, 20000 // (args.lookups * max(1, count // 1000)))
+
+        linear_s = time_lookups(linear, names, rounds)
+        indexed_s = time_lookups(indexed, names, rounds * 10)
+
+        # Peor caso del recorrido: el último archivo registrado (1 KB en disco)
+        stored_name = f"archivo_{count}.bin"
+        with open(os.path.join(download_dir, stored_name), "wb") as f:
+            f.write(os.urandom(1024))
+        url = f"/storage/{USER_ID}/downloads/{stored_name}"
+
+        file_service.get_original_filename = linear
+        linear_http = time_requests(client, url, args.requests)
+        file_service.get_original_filename = indexed
+        indexed_http = time_requests(client, url, args.requests)
+
+        print(f"{count:>9} | {linear_s * 1e6:>10.2f} | {indexed_s * 1e6:>10.3f} | "
+              f"{linear_s / indexed_s:>6.0f}x | "
+              f"{linear_http[0] * 1e3:>10.3f} / {linear_http[1] * 1e3:>9.3f} | "
+              f"{indexed_http[0] * 1e3:>10.3f} / {indexed_http[1] * 1e3:>9.3f}")
+
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
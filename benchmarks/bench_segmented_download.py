@@ -0,0 +1,115 @@
+"""
+Benchmark del descargador segmentado de FastDownloadService con un
+cliente simulado: cada bloque de 1 MiB de stream_media tarda una latencia
+fija (ida y vuelta a un DC de Telegram), así que una sola conexión queda
+limitada a 1 MiB por latencia y el throughput debería escalar con el
+número de segmentos hasta saturar disco o CPU.
+
+Uso (desde la raíz del repo, con las dependencias de requirements.txt):
+    python benchmarks/bench_segmented_download.py
+    python benchmarks/bench_segmented_download.py --size-mb 256 --latency-ms 40 --segments 1 2 4 8 16
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+CHUNK = 1024 * 1024
+
+
+def chunk_data(index):
+    """Contenido determinista del bloque index para verificar el ensamblado"""
+    return index.to_bytes(8, "big") * (CHUNK // 8)
+
+
+class StubClient:
+    """Imita Client.stream_media: bloques de 1 MiB con latencia inyectada"""
+
+    def __init__(self, total_chunks, last_chunk_size, latency):
+        self.total_chunks = total_chunks
+        self.last_chunk_size = last_chunk_size
+        self.latency = latency
+        self.streams = 0
+
+    async def stream_media(self, file_obj, offset=0, limit=0):
+        self.streams += 1
+        end = self.total_chunks if not limit else min(self.total_chunks, offset + limit)
+        for index in range(offset, end):
+            await asyncio.sleep(self.latency)
+            data = chunk_data(index)
+            yield data[:self.last_chunk_size] if index == self.total_chunks - 1 else data
+
+
+def make_message(size, run):
+    document = types.SimpleNamespace(file_name="bench.bin", file_size=size, file_unique_id=f"bench{run}")
+    return types.SimpleNamespace(
+        id=run, chat=types.SimpleNamespace(id=1), from_user=types.SimpleNamespace(id=1),
+        document=document, video=None, audio=None, photo=None,
+    )
+
+
+def verify(path, total_chunks, last_chunk_size):
+    with open(path, "rb") as f:
+        for index in range(total_chunks):
+            expected = chunk_data(index)
+            if index == total_chunks - 1:
+                expected = expected[:last_chunk_size]
+            if f.read(len(expected)) != expected:
+                return False
+        return f.read(1) == b""
+
+
+async def run(service, segments, size, latency, run_id):
+    total_chunks = (size + CHUNK - 1) // CHUNK
+    last_chunk_size = size - (total_chunks - 1) * CHUNK
+    client = StubClient(total_chunks, last_chunk_size, latency)
+    message = make_message(size, run_id)
+    path = os.path.join("downloads", f"bench_{run_id}.bin")
+
+    service.segments = segments
+    start = time.perf_counter()
+    success, downloaded = await service.download_file_fast(client, message, path)
+    elapsed = time.perf_counter() - start
+    if not success or downloaded != size or not verify(path, total_chunks, last_chunk_size):
+        raise RuntimeError(f"Descarga incorrecta con {segments} segmento(s)")
+    os.remove(path)
+    return size / elapsed / CHUNK, client.streams
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=128, help="tamaño del archivo simulado")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia por bloque de 1 MiB")
+    parser.add_argument("--segments", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    # Los checkpoints usan rutas relativas: todo va a un directorio temporal
+    workdir = tempfile.mkdtemp(prefix="bench_download_")
+    os.chdir(workdir)
+    try:
+        from download_service import fast_download_service
+
+        size = args.size_mb * CHUNK + 12345
+        latency = args.latency_ms / 1000
+        print(f"Archivo de {size / CHUNK:.1f} MB, {args.latency_ms:g} ms por bloque de 1 MiB "
+              f"(techo por conexión: {1 / latency:.0f} MB/s)")
+        print(f"{'segmentos':>9} | {'MB/s':>8} | {'x':>6} | {'streams':>7}")
+        baseline = None
+        for run_id, segments in enumerate(args.segments):
+            throughput, streams = asyncio.run(run(fast_download_service, segments, size, latency, run_id))
+            baseline = baseline or throughput
+            print(f"{segments:>9} | {throughput:>8.1f} | {throughput / baseline:>5.1f}x | {streams:>7}")
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark de throughput en loopback: descargas servidas por waitress
+(bucle de lectura/escritura en Python) frente al servidor sendfile
+(os.sendfile, zero-copy).
+
+Cada modo corre en un subproceso propio con la app de flask_app, así que
+además del MB/s se mide el tiempo de CPU que gasta el servidor por GB
+servido. El cliente abre una conexión nueva por descarga: el servidor
+sendfile habla HTTP/1.0 sin keep-alive.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_sendfile.py
+    python benchmarks/bench_sendfile.py --size-mb 512 --downloads 8 --clients 4
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+USER_ID = "4242"
+FILENAME = "bench.bin"
+MODES = ("waitress", "sendfile")
+
+
+def serve(mode, port):
+    """Proceso servidor: se ejecuta en el directorio de trabajo del benchmark"""
+    from flask_app import app
+    if mode == "sendfile":
+        from sendfile_server import serve_sendfile
+        serve_sendfile(app, host="127.0.0.1", port=port)
+    else:
+        from waitress import serve as waitress_serve
+        waitress_serve(app, host="127.0.0.1", port=port, _quiet=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_listening(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"El servidor no escucha en el puerto {port}")
+
+
+def download(port, expected):
+    """GET completo con un socket crudo; devuelve los bytes de cuerpo recibidos"""
+    request = (f"GET /storage/{USER_ID}/downloads/{FILENAME} HTTP/1.1\r\n"
+               f"Host: 127.0.0.1:{port}\r\nConnection: close\r\n\r\n").encode("ascii")
+    buffer = bytearray(1024 * 1024)
+    view = memoryview(buffer)
+    received = 0
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(request)
+        header = b""
+        while b"\r\n\r\n" not in header:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise RuntimeError("Conexión cerrada antes de las cabeceras")
+            header += chunk
+        head, _, body = header.partition(b"\r\n\r\n")
+        if b" 200 " not in head.split(b"\r\n", 1)[0]:
+            raise RuntimeError(head.split(b"\r\n", 1)[0].decode("latin-1"))
+        received = len(body)
+        while received < expected:
+            n = sock.recv_into(view)
+            if not n:
+                break
+            received += n
+    return received
+
+
+def run_mode(mode, workdir, size, downloads, clients):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port)],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_listening(port)
+        process = psutil.Process(server.pid)
+        download(port, size)  # calentamiento: imports perezosos y caché de página
+
+        cpu_before = process.cpu_times()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            received = sum(pool.map(lambda _: download(port, size), range(downloads)))
+        elapsed = time.perf_counter() - start
+        cpu_after = process.cpu_times()
+    finally:
+        server.terminate()
+        server.wait()
+
+    if received != size * downloads:
+        raise RuntimeError(f"{mode}: recibidos {received} de {size * downloads} bytes")
+    cpu = (cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system)
+    gigabytes = received / 1024 ** 3
+    return received / elapsed / 1024 ** 2, cpu / gigabytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=256, help="tamaño del archivo servido")
+    parser.add_argument("--downloads", type=int, default=8, help="descargas por modo")
+    parser.add_argument("--clients", type=int, default=1, help="descargas simultáneas")
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_sendfile_")
+    try:
+        download_dir = os.path.join(workdir, "storage", USER_ID, "downloads")
+        os.makedirs(download_dir)
+        size = args.size_mb * 1024 * 1024
+        block = os.urandom(1024 * 1024)
+        with open(os.path.join(download_dir, FILENAME), "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(block)
+
+        print(f"{args.downloads} descargas de {args.size_mb} MB, {args.clients} cliente(s) simultáneo(s)")
+        print(f"{'modo':>9} | {'MB/s':>9} | {'CPU servidor s/GB':>18}")
+        for mode in MODES:
+            throughput, cpu_per_gb = run_mode(mode, workdir, size, args.downloads, args.clients)
+            print(f"{mode:>9} | {throughput:>9.0f} | {cpu_per_gb:>18.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import hashlib
+import zlib
+import threading
+import time
+import logging
+from config import BLOB_STORE_DIR, BLOB_GC_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class BlobStore:
+    """
+    Almacén direccionado por contenido. Cada objeto se guarda una sola vez
+    como objects/<sha256[:2]>/<sha256> y los archivos de los usuarios son
+    hardlinks a ese objeto, así que el contador de enlaces del inode es el
+    contador de referencias. unique/<file_unique_id> guarda el sha256 (y el
+    CRC32) de cada medio de Telegram ya visto para poder enlazarlo sin
+    descargarlo.
+    """
+
+    def __init__(self, root=BLOB_STORE_DIR):
+        self.objects_dir = os.path.join(root, "objects")
+        self.unique_dir = os.path.join(root, "unique")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.unique_dir, exist_ok=True)
+        self.collector = None
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _unique_path(self, file_unique_id):
+        return os.path.join(self.unique_dir, file_unique_id)
+
+    def hash_file(self, path):
+        """sha256 y CRC32 del archivo en una sola lectura"""
+        digest = hashlib.sha256()
+        crc = 0
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                crc = zlib.crc32(block, crc)
+        return {"sha256": digest.hexdigest(), "crc32": crc}
+
+    def get_refcount(self, digest):
+        """Número de archivos de usuario que referencian el objeto"""
+        try:
+            return os.stat(self._object_path(digest)).st_nlink - 1
+        except OSError:
+            return 0
+
+    def lookup_unique(self, file_unique_id):
+        """{"sha256", "crc32"} de un medio ya almacenado, o None"""
+        if not file_unique_id:
+            return None
+        try:
+            with open(self._unique_path(file_unique_id), 'r', encoding='ascii') as f:
+                fields = f.read().split()
+        except OSError:
+            return None
+        if not fields or not os.path.exists(self._object_path(fields[0])):
+            return None
+        return {
+            "sha256": fields[0],
+            "crc32": int(fields[1], 16) if len(fields) > 1 else None
+        }
+
+    def link_existing(self, file_unique_id, target_path):
+        """
+        Si el medio ya está en el almacén, crea target_path como hardlink
+        al objeto y devuelve sus sumas: la descarga de Telegram no es
+        necesaria. Devuelve None si hay que descargarlo.
+        """
+        checksums = self.lookup_unique(file_unique_id)
+        if not checksums:
+            return None
+        digest = checksums["sha256"]
+        try:
+            os.link(self._object_path(digest), target_path)
+        except OSError as e:
+            logger.warning(f"No se pudo enlazar el objeto {digest[:12]}: {e}")
+            return None
+        logger.info(f"♻️ Medio duplicado enlazado sin descarga: {os.path.basename(target_path)} -> {digest[:12]}")
+        return checksums
+
+    def ingest(self, path, file_unique_id=None):
+        """
+        Incorpora un archivo recién descargado. Si su contenido ya existía,
+        el archivo se sustituye por un hardlink al objeto existente. Devuelve
+        {"sha256", "crc32"} (aunque no se pueda deduplicar) o None si el
+        archivo no se pudo leer.
+        """
+        try:
+            checksums = self.hash_file(path)
+        except OSError as e:
+            logger.warning(f"No se pudo leer {os.path.basename(path)}: {e}")
+            return None
+
+        digest = checksums["sha256"]
+        try:
+            object_path = self._object_path(digest)
+            if os.path.exists(object_path):
+                if not os.path.samefile(object_path, path):
+                    tmp_path = f"{path}.dedup"
+                    os.link(object_path, tmp_path)
+                    os.replace(tmp_path, path)
+                    logger.info(f"♻️ Contenido duplicado: {os.path.basename(path)} -> {digest[:12]}")
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.link(path, object_path)
+
+            if file_unique_id:
+                tmp_path = f"{self._unique_path(file_unique_id)}.tmp"
+                with open(tmp_path, 'w', encoding='ascii') as f:
+                    f.write(f"{digest} {checksums['crc32']:08x}")
+                os.replace(tmp_path, self._unique_path(file_unique_id))
+        except OSError as e:
+            logger.warning(f"No se pudo deduplicar {os.path.basename(path)}: {e}")
+        return checksums
+
+    def collect_garbage(self):
+        """Elimina los objetos sin referencias y los índices que apuntan a ellos"""
+        removed = 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                object_path = os.path.join(prefix_dir, digest)
+                try:
+                    if os.stat(object_path).st_nlink <= 1:
+                        os.remove(object_path)
+                        removed += 1
+                except OSError:
+                    continue
+
+        for file_unique_id in os.listdir(self.unique_dir):
+            if not self.lookup_unique(file_unique_id):
+                try:
+                    os.remove(self._unique_path(file_unique_id))
+                except OSError:
+                    pass
+
+        if removed:
+            logger.info(f"🧹 Objetos sin referencias eliminados: {removed}")
+        return removed
+
+    def start(self):
+        """Recolección periódica de objetos huérfanos en segundo plano"""
+        if self.collector:
+            return
+
+        def _run():
+            while True:
+                time.sleep(BLOB_GC_INTERVAL)
+                try:
+                    self.collect_garbage()
+                except Exception as e:
+                    logger.error(f"Error recolectando objetos huérfanos: {e}")
+
+        self.collector = threading.Thread(target=_run, name="blob-gc", daemon=True)
+        self.collector.start()
+
+blob_store = BlobStore()
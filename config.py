@@ -8,11 +8,33 @@ RENDER_DOMAIN = os.getenv("RENDER_DOMAIN", "https://nelson-file2link.onrender.co
 BASE_DIR = "storage"
 PORT = int(os.getenv("PORT", 8080))
 
+# 🗂️ Backend de metadata de archivos: "sqlite" (por defecto), "journal" o "json" (legado)
+METADATA_BACKEND = os.getenv("METADATA_BACKEND", "sqlite")
+METADATA_JSON_FILE = "file_metadata.json"
+METADATA_DB_FILE = "file_metadata.db"
+METADATA_SNAPSHOT_FILE = "file_metadata.snapshot.json"
+METADATA_JOURNAL_FILE = "file_metadata.journal"
+METADATA_JOURNAL_MAX_MB = 8
+METADATA_COMPACT_INTERVAL = 60
+
 # Configuración optimizada para CPU limitada
 MAX_PART_SIZE_MB = 500
+# Empaquetado comprimido (DEFLATE en paralelo por bloques independientes)
+PACK_COMPRESS_WORKERS = os.cpu_count() or 1
+PACK_DEFLATE_LEVEL = 6
+PACK_DEFLATE_BLOCK_MB = 8
+# Volúmenes ZIP independientes que se escriben a la vez en /pack N i
+PACK_VOLUME_WORKERS = 4
+# Tiempo máximo de un empaquetado una vez admitido (segundos)
 COMPRESSION_TIMEOUT = 600
 MAX_CONCURRENT_PROCESSES = 1
 CPU_USAGE_LIMIT = 80
+# Muestreo de carga en segundo plano (segundos) y suavizado exponencial (0-1)
+LOAD_SAMPLE_INTERVAL = 1.0
+LOAD_SMOOTHING = 0.5
+# Cola de admisión: coste relativo de cada tipo de trabajo y espera máxima (segundos)
+JOB_WEIGHTS = {"pack": 3, "youtube": 2, "upload": 1}
+ADMISSION_TIMEOUT = 900
 
 # ✅ Tamaño máximo de archivos configurable
 MAX_FILE_SIZE_MB = 2000
@@ -24,3 +46,37 @@ DOWNLOAD_THREADS = 2
 DOWNLOAD_TIMEOUT = 3600
 MAX_RETRIES = 3
 CHUNK_SIZE = 65536
+# Checkpoints para reanudar descargas interrumpidas (fuera de BASE_DIR)
+DOWNLOAD_CHECKPOINT_DIR = "download_checkpoints"
+DOWNLOAD_CHECKPOINT_INTERVAL = 2
+
+# 📥 Planificador global de subidas (reparto justo entre usuarios)
+UPLOAD_WORKERS = 4
+UPLOAD_MAX_PER_USER = 2
+UPLOAD_DRR_QUANTUM_MB = 64
+# Capacidad de bajada del servidor en MB/s; 0 = sin límite
+UPLOAD_BANDWIDTH_MB_S = float(os.getenv("UPLOAD_BANDWIDTH_MB_S", "0"))
+# Cola persistente: sobrevive a reinicios y redeploys
+UPLOAD_QUEUE_DB = "upload_queue.db"
+
+# 📝 Edición de mensajes de progreso (presupuesto frente a los límites de Telegram)
+PROGRESS_EDITS_PER_SECOND = 20
+PROGRESS_CHAT_EDIT_INTERVAL = 1.5
+# Estado de un mensaje de progreso sin actividad (nunca cerrado con finish_edit) que se descarta (segundos)
+PROGRESS_STATE_TTL = 600
+
+# ♻️ Almacén deduplicado por contenido (mismo sistema de archivos que BASE_DIR)
+BLOB_STORE_DIR = "blob_store"
+BLOB_GC_INTERVAL = 3600
+
+# 📊 Reconciliación periódica de la contabilidad de almacenamiento (segundos)
+STORAGE_RECONCILE_INTERVAL = 600
+
+# 🌐 Servidor de archivos (Range / 206)
+MAX_BYTE_RANGES = 16
+# "waitress" (por defecto) o "sendfile" (zero-copy con os.sendfile).
+# ⚠️ El servidor sendfile es wsgiref + ThreadingMixIn: solo HTTP/1.0, sin
+# keep-alive (una conexión por petición) y un hilo por conexión sin límite.
+# Pensado para pocas descargas grandes detrás de un proxy que mantenga las
+# conexiones con los clientes; comparar con benchmarks/bench_sendfile.py
+FILE_SERVING_MODE = os.getenv("FILE_SERVING_MODE", "waitress")
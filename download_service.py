@@ -1,16 +1,222 @@
 import asyncio
 import os
+import json
 import time
 import logging
 import aiofiles
 from pyrogram.errors import FloodWait
-from config import DOWNLOAD_BUFFER_SIZE, DOWNLOAD_TIMEOUT, MAX_RETRIES, CHUNK_SIZE
+from config import (
+    DOWNLOAD_BUFFER_SIZE, DOWNLOAD_TIMEOUT, MAX_RETRIES, CHUNK_SIZE, DOWNLOAD_THREADS,
+    DOWNLOAD_CHECKPOINT_DIR, DOWNLOAD_CHECKPOINT_INTERVAL
+)
 
 logger = logging.getLogger(__name__)
 
+# Pyrogram entrega stream_media en bloques de 1 MiB; offset y limit se expresan en bloques
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+class DownloadCheckpointStore:
+    """
+    Checkpoints persistentes de descargas en curso, uno por
+    (user_id, file_unique_id): ruta destino, tamaño esperado y bloques
+    completados de cada segmento. Permiten reanudar tras un reintento o un
+    reinicio del proceso sin volver a transferir los bytes ya escritos.
+    El archivo parcial vive junto al checkpoint, fuera de downloads.
+    """
+
+    def __init__(self, directory=DOWNLOAD_CHECKPOINT_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id, file_unique_id):
+        return os.path.join(self.directory, f"{user_id}_{file_unique_id}.json")
+
+    def partial_path(self, user_id, file_unique_id):
+        return os.path.join(self.directory, f"{user_id}_{file_unique_id}.part")
+
+    def load(self, user_id, file_unique_id):
+        try:
+            with open(self._path(user_id, file_unique_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, user_id, file_unique_id, checkpoint):
+        path = self._path(user_id, file_unique_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+
+    def delete(self, user_id, file_unique_id):
+        try:
+            os.remove(self._path(user_id, file_unique_id))
+        except OSError:
+            pass
+
+
 class FastDownloadService:
     def __init__(self):
         self.active_downloads = {}
+        self.segments = max(1, DOWNLOAD_THREADS)
+        self.checkpoints = DownloadCheckpointStore()
+    
+    def get_file_object(self, message):
+        """Devuelve (objeto de archivo, tamaño) del medio del mensaje"""
+        if message.document:
+            file_obj = message.document
+        elif message.video:
+            file_obj = message.video
+        elif message.audio:
+            file_obj = message.audio
+        elif message.photo:
+            file_obj = message.photo[-1]
+        else:
+            return None, 0
+        return file_obj, file_obj.file_size or 0
+    
+    def get_partial_path(self, user_id, message):
+        """
+        Ruta de descarga temporal del medio, fuera de downloads. Es estable
+        para el mismo file_unique_id, así que un reintento o un reinicio
+        reanuda sobre el mismo parcial y su checkpoint.
+        """
+        file_obj, _ = self.get_file_object(message)
+        key = getattr(file_obj, "file_unique_id", None) or f"msg{message.chat.id}_{message.id}"
+        return self.checkpoints.partial_path(user_id, key)
+    
+    def _new_checkpoint(self, file_path, file_size, file_unique_id, segments):
+        total_chunks = (file_size + STREAM_CHUNK_SIZE - 1) // STREAM_CHUNK_SIZE
+        per_segment = (total_chunks + segments - 1) // segments
+        return {
+            "file_path": file_path,
+            "file_size": file_size,
+            "file_unique_id": file_unique_id,
+            # [primer bloque, número de bloques, bloques completados]
+            "segments": [
+                [first, min(per_segment, total_chunks - first), 0]
+                for first in range(0, total_chunks, per_segment)
+            ],
+            "updated_at": time.time()
+        }
+    
+    def _completed_bytes(self, checkpoint):
+        file_size = checkpoint["file_size"]
+        return sum(
+            min((first + done) * STREAM_CHUNK_SIZE, file_size) - first * STREAM_CHUNK_SIZE
+            for first, count, done in checkpoint["segments"] if done
+        )
+    
+    def _open_target(self, file_path, file_size, resume):
+        """Abre el archivo parcial o crea uno nuevo preasignado con su tamaño final"""
+        if resume:
+            return os.open(file_path, os.O_RDWR)
+        
+        fd = os.open(file_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(fd, 0, file_size)
+                except OSError:
+                    os.ftruncate(fd, file_size)
+            else:
+                os.ftruncate(fd, file_size)
+        except Exception:
+            os.close(fd)
+            raise
+        return fd
+    
+    async def _download_segment(self, client, file_obj, fd, segment, state):
+        """Descarga los bloques pendientes de un segmento y los escribe en su posición"""
+        loop = asyncio.get_running_loop()
+        first, count, done = segment
+        if done >= count:
+            return
+        
+        position = (first + done) * STREAM_CHUNK_SIZE
+        async for chunk in client.stream_media(file_obj, offset=first + done, limit=count - done):
+            if not chunk:
+                continue
+            await loop.run_in_executor(None, os.pwrite, fd, chunk, position)
+            position += len(chunk)
+            segment[2] += 1
+            state["downloaded"] += len(chunk)
+            
+            current_time = time.time()
+            if current_time - state["last_checkpoint_time"] >= DOWNLOAD_CHECKPOINT_INTERVAL:
+                state["last_checkpoint_time"] = current_time
+                state["save_checkpoint"]()
+            if state["progress_callback"] and current_time - state["last_callback_time"] >= 0.5:
+                state["last_callback_time"] = current_time
+                await state["progress_callback"](state["downloaded"], state["file_size"])
+    
+    async def _download_segmented(self, client, user_id, file_obj, file_path, file_size, segments, progress_callback):
+        """
+        Descarga rangos disjuntos del mismo archivo en paralelo sobre un
+        archivo preasignado; cada segmento escribe en su desplazamiento, así
+        que el resultado queda ensamblado en orden sin pasos adicionales.
+        Si existe un checkpoint para el mismo archivo, solo se piden los
+        bloques que faltan.
+        """
+        file_unique_id = getattr(file_obj, "file_unique_id", None)
+        checkpoint = None
+        if file_unique_id:
+            stored = self.checkpoints.load(user_id, file_unique_id)
+            if (stored and stored.get("file_path") == file_path and stored.get("file_size") == file_size
+                    and os.path.exists(file_path) and os.path.getsize(file_path) == file_size):
+                checkpoint = stored
+        
+        resume = checkpoint is not None
+        if not resume:
+            checkpoint = self._new_checkpoint(file_path, file_size, file_unique_id, segments)
+        
+        def _save_checkpoint():
+            if not file_unique_id:
+                return
+            checkpoint["updated_at"] = time.time()
+            try:
+                self.checkpoints.save(user_id, file_unique_id, checkpoint)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar el checkpoint de descarga: {e}")
+        
+        state = {
+            "downloaded": self._completed_bytes(checkpoint),
+            "file_size": file_size,
+            "last_callback_time": time.time(),
+            "last_checkpoint_time": time.time(),
+            "progress_callback": progress_callback,
+            "save_checkpoint": _save_checkpoint
+        }
+        if resume:
+            logger.info(f"Reanudando descarga: {os.path.basename(file_path)} "
+                        f"desde {state['downloaded']/1024/1024:.1f} MB")
+        
+        fd = self._open_target(file_path, file_size, resume)
+        _save_checkpoint()
+        try:
+            tasks = [
+                asyncio.create_task(self._download_segment(client, file_obj, fd, segment, state))
+                for segment in checkpoint["segments"]
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            os.close(fd)
+            _save_checkpoint()
+        
+        if state["downloaded"] != file_size:
+            raise IOError(f"Descarga segmentada incompleta: {state['downloaded']}/{file_size} bytes")
+        
+        if file_unique_id:
+            self.checkpoints.delete(user_id, file_unique_id)
+        if progress_callback:
+            await progress_callback(state["downloaded"], file_size)
+        return state["downloaded"]
     
     async def download_file_fast(self, client, message, file_path, progress_callback=None):
         """Descarga archivos a máxima velocidad con buffer optimizado"""
@@ -18,21 +224,7 @@ class FastDownloadService:
             user_id = message.from_user.id
             self.active_downloads[user_id] = True
             
-            file_obj = None
-            file_size = 0
-            
-            if message.document:
-                file_obj = message.document
-                file_size = file_obj.file_size or 0
-            elif message.video:
-                file_obj = message.video
-                file_size = file_obj.file_size or 0
-            elif message.audio:
-                file_obj = message.audio
-                file_size = file_obj.file_size or 0
-            elif message.photo:
-                file_obj = message.photo[-1]
-                file_size = file_obj.file_size or 0
+            file_obj, file_size = self.get_file_object(message)
             
             if not file_obj:
                 raise ValueError("No se pudo obtener el objeto de archivo")
@@ -43,27 +235,36 @@ class FastDownloadService:
             if file_size > 500 * 1024 * 1024:
                 timeout = 7200
             
-            logger.info(f"Iniciando descarga rápida: {os.path.basename(file_path)} ({file_size/1024/1024:.1f} MB)")
+            segments = min(self.segments, (file_size + STREAM_CHUNK_SIZE - 1) // STREAM_CHUNK_SIZE)
+            
+            logger.info(f"Iniciando descarga rápida: {os.path.basename(file_path)} "
+                        f"({file_size/1024/1024:.1f} MB, {max(segments, 1)} segmento(s))")
             
             start_time = time.time()
             downloaded = 0
             last_callback_time = start_time
             
-            async with aiofiles.open(file_path, 'wb') as f:
-                async for chunk in client.stream_media(file_obj, limit=DOWNLOAD_BUFFER_SIZE):
-                    if not chunk:
-                        continue
-                    
-                    await f.write(chunk)
-                    downloaded += len(chunk)
+            if segments >= 1:
+                downloaded = await self._download_segmented(
+                    client, user_id, file_obj, file_path, file_size, segments, progress_callback
+                )
+            else:
+                # Tamaño desconocido: descarga secuencial sin checkpoints
+                async with aiofiles.open(file_path, 'wb') as f:
+                    async for chunk in client.stream_media(file_obj, limit=DOWNLOAD_BUFFER_SIZE):
+                        if not chunk:
+                            continue
+                        
+                        await f.write(chunk)
+                        downloaded += len(chunk)
+                        
+                        current_time = time.time()
+                        if current_time - last_callback_time >= 0.5 and progress_callback:
+                            await progress_callback(downloaded, file_size)
+                            last_callback_time = current_time
                     
-                    current_time = time.time()
-                    if current_time - last_callback_time >= 0.5 and progress_callback:
+                    if progress_callback and downloaded > 0:
                         await progress_callback(downloaded, file_size)
-                        last_callback_time = current_time
-                
-                if progress_callback and downloaded > 0:
-                    await progress_callback(downloaded, file_size)
             
             elapsed = time.time() - start_time
             speed = downloaded / elapsed if elapsed > 0 else 0
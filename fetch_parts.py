@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Cliente de descarga paralela para los empaquetados divididos de file2link.
+
+Lee el manifiesto JSON de /pack (o el Metalink .meta4, o la lista .txt),
+descarga todas las partes a la vez en tramos con Range, reanuda lo que
+quedó a medias en una ejecución anterior, verifica tamaño y SHA-256 y,
+con -x, extrae cada ZIP en cuanto sus partes están completas leyendo las
+partes en orden como si fueran un solo archivo (sin concatenarlas antes).
+
+Solo usa la biblioteca estándar:
+
+    python fetch_parts.py https://.../storage/123/packed/packed_files_X.json -x destino/
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SEGMENT_SIZE_MB = 16
+READ_CHUNK = 1024 * 1024
+RETRIES = 5
+TIMEOUT = 60
+PART_SUFFIX = re.compile(r'\.\d{3}$')
+METALINK_NS = '{urn:ietf:params:xml:ns:metalink}'
+
+
+class FetchError(Exception):
+    """Error irrecuperable al descargar o verificar una parte"""
+
+
+def _open_url(url, headers=None, method='GET'):
+    request = urllib.request.Request(url, headers=headers or {}, method=method)
+    return urllib.request.urlopen(request, timeout=TIMEOUT)
+
+
+def read_source(source):
+    """Contenido del manifiesto, desde una URL o una ruta local"""
+    if re.match(r'https?://', source):
+        with _open_url(source) as response:
+            return response.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def parse_manifest(data):
+    """
+    Lista de partes {filename, archive, size, sha256, url} a partir del
+    manifiesto JSON, Metalink 4 o la lista .txt. size y sha256 pueden ser
+    None si el formato no los trae (lista .txt).
+    """
+    text = data.decode('utf-8')
+    stripped = text.lstrip()
+    parts = []
+    if stripped.startswith('{'):
+        for part in json.loads(text)['parts']:
+            parts.append({
+                'filename': part['filename'],
+                'archive': part.get('archive') or PART_SUFFIX.sub('', part['filename']),
+                'size': part.get('size'),
+                'sha256': part.get('sha256'),
+                'url': part['url']
+            })
+    elif '<metalink' in stripped[:200]:
+        root = ET.fromstring(data)
+        for file_element in root.iter(f'{METALINK_NS}file'):
+            name = file_element.get('name')
+            size = file_element.findtext(f'{METALINK_NS}size')
+            sha256 = next((h.text for h in file_element.iter(f'{METALINK_NS}hash')
+                           if h.get('type') == 'sha-256'), None)
+            parts.append({
+                'filename': name,
+                'archive': PART_SUFFIX.sub('', name),
+                'size': int(size) if size else None,
+                'sha256': sha256,
+                'url': file_element.findtext(f'{METALINK_NS}url')
+            })
+    else:
+        for match in re.finditer(r'^Parte \d+: (.+?)\s*$.*?^Enlace: (\S+)', text, re.M | re.S):
+            name = match.group(1)
+            parts.append({
+                'filename': name,
+                'archive': PART_SUFFIX.sub('', name),
+                'size': None,
+                'sha256': None,
+                'url': match.group(2)
+            })
+
+    if not parts:
+        raise FetchError("El manifiesto no contiene partes")
+    for part in parts:
+        if os.path.basename(part['filename']) != part['filename']:
+            raise FetchError(f"Nombre de parte no valido: {part['filename']}")
+    return parts
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JoinedReader:
+    """
+    Archivo de solo lectura (read/seek/tell) sobre varias partes en orden,
+    suficiente para que zipfile lea el ZIP sin unirlas en disco.
+    """
+
+    def __init__(self, paths):
+        self.files = []
+        self.offset = 0
+        for path in paths:
+            size = os.path.getsize(path)
+            self.files.append((self.offset, size, open(path, 'rb')))
+            self.offset += size
+        self.size = self.offset
+        self.offset = 0
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.offset
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.offset = max(0, offset)
+        return self.offset
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.size - self.offset
+        chunks = []
+        for start, size, f in self.files:
+            if n <= 0:
+                break
+            if self.offset >= start + size or self.offset < start:
+                continue
+            f.seek(self.offset - start)
+            chunk = f.read(min(n, start + size - self.offset))
+            chunks.append(chunk)
+            self.offset += len(chunk)
+            n -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        for _, _, f in self.files:
+            f.close()
+
+
+class PartsFetcher:
+    """
+    Descarga las partes como tramos independientes en un pool de hilos.
+    Cada parte guarda en <parte>.state los tramos terminados para reanudar;
+    al completarse se verifica y el archivo de estado desaparece.
+    """
+
+    def __init__(self, parts, directory, jobs, segment_size, extract_dir=None,
+                 keep_parts=True, verify=True):
+        self.parts = parts
+        self.directory = directory
+        self.jobs = jobs
+        self.segment_size = segment_size
+        self.extract_dir = extract_dir
+        self.keep_parts = keep_parts
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.total = 0
+        self.started = time.time()
+        self.last_report = 0.0
+
+    def _path(self, part):
+        return os.path.join(self.directory, part['filename'])
+
+    def _load_state(self, part):
+        try:
+            with open(self._path(part) + '.state', 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('size') == part['size'] and state.get('sha256') == part['sha256']:
+                return set(state['done'])
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def _save_state(self, part):
+        path = self._path(part) + '.state'
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({'size': part['size'], 'sha256': part['sha256'], 'done': sorted(part['done'])}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _prepare(self, part):
+        """Fija el tamaño, abre el archivo destino y devuelve los tramos pendientes"""
+        if part['size'] is None:
+            with _open_url(part['url'], method='HEAD') as response:
+                part['size'] = int(response.headers['Content-Length'])
+
+        path = self._path(part)
+        count = max(1, -(-part['size'] // self.segment_size))
+        done = self._load_state(part)
+        if done is None:
+            if (os.path.exists(path) and os.path.getsize(path) == part['size']
+                    and not os.path.exists(path + '.state')):
+                done = set(range(count))  # Completa en una ejecución anterior
+            else:
+                done = set()
+                with open(path, 'wb') as f:
+                    f.truncate(part['size'])
+        part['done'] = done
+        part['fd'] = os.open(path, os.O_RDWR)
+        self._save_state(part)
+        self.total += part['size']
+        for index in done:
+            self.downloaded += min(self.segment_size, part['size'] - index * self.segment_size)
+        return [index for index in range(count) if index not in done]
+
+    def _fetch_segment(self, part, index):
+        """Descarga un tramo con Range, reintentando desde el último byte escrito"""
+        start = index * self.segment_size
+        end = min(start + self.segment_size, part['size'])
+        position = start
+        for attempt in range(RETRIES + 1):
+            try:
+                headers = {'Range': f"bytes={position}-{end - 1}"}
+                with _open_url(part['url'], headers) as response:
+                    if response.status != 206 and not (response.status == 200 and position == 0
+                                                       and end == part['size']):
+                        raise FetchError(f"{part['filename']}: el servidor no acepto el rango")
+                    while position < end:
+                        chunk = response.read(min(READ_CHUNK, end - position))
+                        if not chunk:
+                            raise IOError("conexion cerrada antes de tiempo")
+                        os.pwrite(part['fd'], chunk, position)
+                        position += len(chunk)
+                        self._advance(len(chunk))
+                return part, index
+            except FetchError:
+                raise
+            except (OSError, urllib.error.URLError) as e:
+                if attempt == RETRIES:
+                    raise FetchError(f"{part['filename']}: {e}")
+                time.sleep(min(2 ** attempt, 30))
+
+    def _advance(self, nbytes):
+        with self.lock:
+            self.downloaded += nbytes
+            now = time.time()
+            if now - self.last_report < 0.5:
+                return
+            self.last_report = now
+            speed = self.downloaded / max(now - self.started, 1e-6)
+            percent = self.downloaded * 100 / self.total if self.total else 100
+            sys.stderr.write(f"\r{percent:5.1f}%  {self.downloaded / 2**20:.1f}/{self.total / 2**20:.1f} MB"
+                             f"  {speed / 2**20:.1f} MB/s   ")
+            sys.stderr.flush()
+
+    def _finish_part(self, part):
+        os.close(part['fd'])
+        path = self._path(part)
+        if os.path.getsize(path) != part['size']:
+            raise FetchError(f"{part['filename']}: tamanio incorrecto")
+        if self.verify and part['sha256'] and sha256_file(path) != part['sha256']:
+            os.remove(path)
+            os.remove(path + '.state')
+            raise FetchError(f"{part['filename']}: SHA-256 no coincide (parte eliminada, vuelve a ejecutar)")
+        os.remove(path + '.state')
+        part['complete'] = True
+
+    def _extract(self, archive, parts):
+        paths = [self._path(part) for part in parts]
+        reader = JoinedReader(paths)
+        try:
+            with zipfile.ZipFile(reader) as zipf:
+                zipf.extractall(self.extract_dir)
+                count = len(zipf.infolist())
+        finally:
+            reader.close()
+        sys.stderr.write(f"\rExtraido {archive}: {count} archivo(s)\n")
+        if not self.keep_parts:
+            for path in paths:
+                os.remove(path)
+
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        archives = {}
+        for part in self.parts:
+            archives.setdefault(part['archive'], []).append(part)
+
+        pending = {}
+        for part in self.parts:
+            part['complete'] = False
+            pending[part['filename']] = self._prepare(part)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            # Las partes en orden: los primeros ZIP se completan (y extraen) antes
+            futures = [executor.submit(self._fetch_segment, part, index)
+                       for part in self.parts for index in pending[part['filename']]]
+            for part in self.parts:
+                if not pending[part['filename']]:
+                    self._finish_part(part)
+            try:
+                for future in as_completed(futures):
+                    part, index = future.result()
+                    with self.lock:
+                        part['done'].add(index)
+                        self._save_state(part)
+                    pending[part['filename']].remove(index)
+                    if not pending[part['filename']]:
+                        self._finish_part(part)
+                    for archive in [a for a, ps in archives.items() if all(p['complete'] for p in ps)]:
+                        if self.extract_dir:
+                            self._extract(archive, archives[archive])
+                        del archives[archive]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        for archive, parts in list(archives.items()):
+            if self.extract_dir:
+                self._extract(archive, parts)
+        sys.stderr.write(f"\rListo: {len(self.parts)} parte(s), {self.total / 2**20:.1f} MB en "
+                         f"{time.time() - self.started:.1f}s\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Descarga en paralelo las partes de un empaquetado de file2link, "
+                    "las verifica y opcionalmente las extrae."
+    )
+    parser.add_argument('manifest', help="URL o ruta del manifiesto .json, .meta4 o lista .txt")
+    parser.add_argument('-d', '--dir', default='.', help="Carpeta para las partes (por defecto: actual)")
+    parser.add_argument('-x', '--extract', metavar='DIR', help="Extraer cada ZIP en DIR al completarse")
+    parser.add_argument('-j', '--jobs', type=int, default=8, help="Descargas simultaneas (por defecto: 8)")
+    parser.add_argument('--segment-mb', type=int, default=SEGMENT_SIZE_MB,
+                        help=f"Tamanio de cada tramo con Range (por defecto: {SEGMENT_SIZE_MB})")
+    parser.add_argument('--delete-parts', action='store_true', help="Borrar las partes tras extraer")
+    parser.add_argument('--no-verify', action='store_true', help="No comprobar SHA-256")
+    args = parser.parse_args(argv)
+
+    try:
+        parts = parse_manifest(read_source(args.manifest))
+        if re.match(r'https?://', args.manifest):
+            for part in parts:
+                part['url'] = urllib.parse.urljoin(args.manifest, part['url'])
+        fetcher = PartsFetcher(
+            parts, args.dir, max(1, args.jobs), max(1, args.segment_mb) * 1024 * 1024,
+            extract_dir=args.extract, keep_parts=not (args.extract and args.delete_parts),
+            verify=not args.no_verify
+        )
+        fetcher.run()
+    except (FetchError, OSError, urllib.error.URLError, zipfile.BadZipFile) as e:
+        sys.stderr.write(f"\nError: {e}\n")
+        return 1
+    except KeyboardInterrupt:
+        sys.stderr.write("\nInterrumpido; vuelve a ejecutar el mismo comando para reanudar.\n")
+        return 130
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
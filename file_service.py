@@ -1,49 +1,73 @@
 import os
+import copy
 import urllib.parse
 import hashlib
-import json
 import time
 import logging
 import sys
+import threading
 from config import BASE_DIR, RENDER_DOMAIN
+from metadata_store import create_metadata_store
+from storage_usage import storage_usage
 
 logger = logging.getLogger(__name__)
 
 class FileService:
     def __init__(self):
         self.file_mappings = {}
-        self.metadata_file = "file_metadata.json"
+        self.stored_name_index = {}
+        self.stored_number_index = {}
+        # La metadata se modifica desde el event loop y se lee desde hilos de empaquetado
+        self.lock = threading.RLock()
+        # Resultados de /pack por usuario: huella del conjunto de origen -> resultado
+        self.pack_cache = {}
+        self.store = create_metadata_store(metadata_lock=self.lock)
         self.load_metadata()
     
     def load_metadata(self):
-        """Carga la metadata de archivos desde JSON"""
+        """Carga la metadata de archivos desde el backend configurado"""
         try:
-            if os.path.exists(self.metadata_file):
-                with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    self.metadata = json.load(f)
-            else:
-                self.metadata = {}
+            self.metadata = self.store.load()
         except Exception as e:
             logger.error(f"Error cargando metadata: {e}")
             self.metadata = {}
+        self.rebuild_stored_name_index()
+
+    def rebuild_stored_name_index(self):
+        """Reconstruye los índices inversos (user_id, file_type, stored_name) -> entrada y número"""
+        with self.lock:
+            self.stored_name_index = {}
+            self.stored_number_index = {}
+            for user_key, user_data in self.metadata.items():
+                user_id, _, file_type = user_key.rpartition("_")
+                for file_num, file_data in user_data["files"].items():
+                    key = (user_id, file_type, file_data["stored_name"])
+                    self.stored_name_index[key] = file_data
+                    self.stored_number_index[key] = file_num
+
+    def _index_key(self, user_id, file_type, stored_name):
+        return (str(user_id), file_type, stored_name)
     
     def save_metadata(self):
-        """Guarda la metadata de archivos en JSON"""
+        """Vuelca la metadata completa al backend (solo para migraciones)"""
         try:
-            with open(self.metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(self.metadata, f, ensure_ascii=False, indent=2)
+            self.store.save_all(self.metadata)
         except Exception as e:
             logger.error(f"Error guardando metadata: {e}")
     
     def get_next_file_number(self, user_id, file_type="downloads"):
         """Obtiene el siguiente número de archivo para el usuario (PERSISTENTE)"""
         user_key = f"{user_id}_{file_type}"
-        if user_key not in self.metadata:
-            self.metadata[user_key] = {"next_number": 1, "files": {}}
-        
-        next_num = self.metadata[user_key]["next_number"]
-        self.metadata[user_key]["next_number"] += 1
-        self.save_metadata()
+        with self.lock:
+            if user_key not in self.metadata:
+                self.metadata[user_key] = {"next_number": 1, "files": {}}
+            
+            next_num = self.metadata[user_key]["next_number"]
+            self.metadata[user_key]["next_number"] += 1
+            try:
+                self.store.set_next_number(user_id, file_type, self.metadata[user_key]["next_number"])
+            except Exception as e:
+                logger.error(f"Error guardando metadata: {e}")
         return next_num
     
     def sanitize_filename(self, filename):
@@ -121,6 +145,13 @@ class FileService:
         """Crea una URL para empaquetados. filename debe ser el nombre almacenado (ya sanitizado)."""
         return f"{RENDER_DOMAIN}/storage/{user_id}/packed/{self.filename_to_url(filename)}"
 
+    def create_zip_url(self, user_id, numbers=None):
+        """URL del ZIP generado al vuelo con las descargas del usuario (o una selección por número)"""
+        url = f"{RENDER_DOMAIN}/zip/{user_id}"
+        if numbers:
+            url += "?files=" + ",".join(str(n) for n in numbers)
+        return url
+
     def get_user_directory(self, user_id, file_type="downloads"):
         """Obtiene el directorio del usuario"""
         user_dir = os.path.join(BASE_DIR, str(user_id), file_type)  # ⬅️ BASE_DIR ahora es "storage"
@@ -128,20 +159,8 @@ class FileService:
         return user_dir
 
     def get_user_storage_usage(self, user_id):
-        """Calcula el uso de almacenamiento por usuario"""
-        download_dir = self.get_user_directory(user_id, "downloads")
-        packed_dir = self.get_user_directory(user_id, "packed")
-        
-        total_size = 0
-        for directory in [download_dir, packed_dir]:
-            if not os.path.exists(directory):
-                continue
-            for file in os.listdir(directory):
-                file_path = os.path.join(directory, file)
-                if os.path.isfile(file_path):
-                    total_size += os.path.getsize(file_path)
-        
-        return total_size
+        """Calcula el uso de almacenamiento por usuario (contadores incrementales)"""
+        return storage_usage.get_user_usage(user_id)
 
     def create_file_hash(self, user_id, filename):
         """Crea un hash único para el archivo"""
@@ -157,10 +176,13 @@ class FileService:
         files = []
         user_key = f"{user_id}_{file_type}"
         
-        if user_key in self.metadata:
+        with self.lock:
+            entries = list(self.metadata[user_key]["files"].items()) if user_key in self.metadata else None
+        
+        if entries is not None:
             # Obtener archivos existentes y ordenar por número
             existing_files = []
-            for file_num, file_data in self.metadata[user_key]["files"].items():
+            for file_num, file_data in entries:
                 file_path = os.path.join(user_dir, file_data["stored_name"])
                 if os.path.exists(file_path):
                     existing_files.append((int(file_num), file_data))
@@ -191,20 +213,31 @@ class FileService:
 
     def register_file(self, user_id, original_name, stored_name, file_type="downloads"):
         """Registra un archivo en la metadata con número PERSISTENTE - CORREGIDO"""
+        if file_type == "downloads":
+            self.invalidate_pack_cache(user_id)
         user_key = f"{user_id}_{file_type}"
-        if user_key not in self.metadata:
-            self.metadata[user_key] = {"next_number": 1, "files": {}}
-        
-        # CORREGIDO: Usar el número actual SIN restar 1
-        file_num = self.metadata[user_key]["next_number"]
-        self.metadata[user_key]["next_number"] += 1
-        
-        self.metadata[user_key]["files"][str(file_num)] = {
-            "original_name": original_name,
-            "stored_name": stored_name,
-            "registered_at": time.time()
-        }
-        self.save_metadata()
+        with self.lock:
+            if user_key not in self.metadata:
+                self.metadata[user_key] = {"next_number": 1, "files": {}}
+            
+            # CORREGIDO: Usar el número actual SIN restar 1
+            file_num = self.metadata[user_key]["next_number"]
+            self.metadata[user_key]["next_number"] += 1
+            
+            file_data = {
+                "original_name": original_name,
+                "stored_name": stored_name,
+                "registered_at": time.time()
+            }
+            self.metadata[user_key]["files"][str(file_num)] = file_data
+            key = self._index_key(user_id, file_type, stored_name)
+            self.stored_name_index[key] = file_data
+            self.stored_number_index[key] = str(file_num)
+            try:
+                self.store.put_file(user_id, file_type, file_num, file_data,
+                                    self.metadata[user_key]["next_number"])
+            except Exception as e:
+                logger.error(f"Error guardando metadata: {e}")
         
         logger.info(f"✅ Archivo registrado: #{file_num} - {original_name} para usuario {user_id}")
         return file_num
@@ -241,16 +274,84 @@ class FileService:
 
     def get_original_filename(self, user_id, stored_filename, file_type="downloads"):
         """Obtiene el nombre original del archivo basado en el nombre almacenado"""
-        user_key = f"{user_id}_{file_type}"
-        if user_key not in self.metadata:
-            return stored_filename
-        
-        for file_data in self.metadata[user_key]["files"].values():
-            if file_data["stored_name"] == stored_filename:
-                return file_data["original_name"]
+        file_data = self.stored_name_index.get(self._index_key(user_id, file_type, stored_filename))
+        if file_data:
+            return file_data["original_name"]
         
         return stored_filename
 
+    def has_stored_name(self, user_id, stored_filename, file_type="downloads"):
+        """Indica si ya hay una entrada registrada con ese nombre almacenado"""
+        return self._index_key(user_id, file_type, stored_filename) in self.stored_name_index
+
+    def set_file_checksum(self, user_id, stored_name, file_type, crc32, file_path):
+        """Guarda CRC32, tamaño y mtime del archivo para reutilizarlos al empaquetar"""
+        stat = os.stat(file_path)
+        key = self._index_key(user_id, file_type, stored_name)
+        with self.lock:
+            file_data = self.stored_name_index.get(key)
+            if file_data is None:
+                return False
+            
+            file_data["crc32"] = crc32
+            file_data["size"] = stat.st_size
+            file_data["mtime_ns"] = stat.st_mtime_ns
+            
+            try:
+                self.store.put_file(user_id, file_type, self.stored_number_index[key], file_data,
+                                    self.metadata[f"{user_id}_{file_type}"]["next_number"])
+            except Exception as e:
+                logger.error(f"Error guardando metadata: {e}")
+        return True
+
+    def get_cached_crc(self, user_id, stored_name, file_type, stat):
+        """CRC32 guardado si el archivo no ha cambiado desde que se calculó, si no None"""
+        file_data = self.stored_name_index.get(self._index_key(user_id, file_type, stored_name))
+        if (not file_data or file_data.get("crc32") is None
+                or file_data.get("size") != stat.st_size
+                or file_data.get("mtime_ns") != stat.st_mtime_ns):
+            return None
+        return file_data["crc32"]
+
+    def get_cached_pack(self, user_id, fingerprint):
+        """
+        Resultado de un empaquetado anterior con la misma huella, si todos
+        sus archivos siguen en packed con el mismo tamaño; si no, None.
+        """
+        packed_dir = self.get_user_directory(user_id, "packed")
+        with self.lock:
+            user_cache = self.pack_cache.get(str(user_id), {})
+            entry = user_cache.get(fingerprint)
+            if not entry:
+                return None
+            for filename, size in entry["sizes"].items():
+                path = os.path.join(packed_dir, filename)
+                if (not self.has_stored_name(user_id, filename, "packed") or not os.path.isfile(path)
+                        or os.path.getsize(path) != size):
+                    user_cache.pop(fingerprint, None)
+                    return None
+            return copy.deepcopy(entry["result"])
+
+    def set_cached_pack(self, user_id, fingerprint, result):
+        """Guarda el resultado (archivos, mensaje) de un empaquetado para su huella"""
+        files, _ = result
+        packed_dir = self.get_user_directory(user_id, "packed")
+        entry = {
+            "result": copy.deepcopy(result),
+            "sizes": {f["filename"]: os.path.getsize(os.path.join(packed_dir, f["filename"])) for f in files}
+        }
+        with self.lock:
+            user_cache = self.pack_cache.setdefault(str(user_id), {})
+            user_cache.pop(fingerprint, None)
+            while len(user_cache) >= 8:
+                user_cache.pop(next(iter(user_cache)))
+            user_cache[fingerprint] = entry
+
+    def invalidate_pack_cache(self, user_id):
+        """Olvida los empaquetados en caché del usuario (subidas, renombrados, borrados)"""
+        with self.lock:
+            self.pack_cache.pop(str(user_id), None)
+
     def rename_file(self, user_id, file_number, new_name, file_type="downloads"):
         """Renombra un archivo"""
         try:
@@ -288,10 +389,19 @@ class FileService:
             new_path = os.path.join(user_dir, new_stored_name)
             
             os.rename(old_path, new_path)
-            
-            file_data["original_name"] = new_name
-            file_data["stored_name"] = new_stored_name
-            self.save_metadata()
+            self.invalidate_pack_cache(user_id)
+            
+            with self.lock:
+                old_key = self._index_key(user_id, file_type, file_data["stored_name"])
+                new_key = self._index_key(user_id, file_type, new_stored_name)
+                self.stored_name_index.pop(old_key, None)
+                self.stored_number_index.pop(old_key, None)
+                self.stored_name_index[new_key] = file_data
+                self.stored_number_index[new_key] = str(file_number)
+                file_data["original_name"] = new_name
+                file_data["stored_name"] = new_stored_name
+                self.store.put_file(user_id, file_type, file_number, file_data,
+                                    self.metadata[user_key]["next_number"])
             
             if file_type == "downloads":
                 new_url = self.create_download_url(user_id, new_stored_name)
@@ -323,29 +433,36 @@ class FileService:
             file_path = os.path.join(user_dir, file_data["stored_name"])
             
             if os.path.exists(file_path):
-                os.remove(file_path)
-            
-            # ELIMINAR la entrada de metadata y REASIGNAR números
-            del self.metadata[user_key]["files"][str(file_number)]
-            
-            # Reasignar números consecutivos
-            remaining_files = sorted(
-                [(int(num), data) for num, data in self.metadata[user_key]["files"].items()],
-                key=lambda x: x[0]
-            )
-            
-            # Resetear metadata
-            self.metadata[user_key]["files"] = {}
-            
-            # Reasignar números comenzando desde 1
-            new_number = 1
-            for old_num, file_data in remaining_files:
-                self.metadata[user_key]["files"][str(new_number)] = file_data
-                new_number += 1
-            
-            # Actualizar next_number
-            self.metadata[user_key]["next_number"] = new_number
-            self.save_metadata()
+                storage_usage.remove_file(file_path)
+            self.invalidate_pack_cache(user_id)
+            
+            with self.lock:
+                # ELIMINAR la entrada de metadata y REASIGNAR números
+                del self.metadata[user_key]["files"][str(file_number)]
+                deleted_key = self._index_key(user_id, file_type, file_data["stored_name"])
+                self.stored_name_index.pop(deleted_key, None)
+                self.stored_number_index.pop(deleted_key, None)
+                
+                # Reasignar números consecutivos
+                remaining_files = sorted(
+                    [(int(num), data) for num, data in self.metadata[user_key]["files"].items()],
+                    key=lambda x: x[0]
+                )
+                
+                # Resetear metadata
+                self.metadata[user_key]["files"] = {}
+                
+                # Reasignar números comenzando desde 1
+                new_number = 1
+                for old_num, remaining_data in remaining_files:
+                    self.metadata[user_key]["files"][str(new_number)] = remaining_data
+                    self.stored_number_index[
+                        self._index_key(user_id, file_type, remaining_data["stored_name"])] = str(new_number)
+                    new_number += 1
+                
+                # Actualizar next_number
+                self.metadata[user_key]["next_number"] = new_number
+                self.store.replace_user(user_id, file_type, self.metadata[user_key])
             
             return True, f"Archivo #{file_number} '{file_data['original_name']}' eliminado y números reasignados"
             
@@ -369,14 +486,20 @@ class FileService:
             for filename in files:
                 file_path = os.path.join(user_dir, filename)
                 if os.path.isfile(file_path):
-                    os.remove(file_path)
+                    storage_usage.remove_file(file_path)
                     deleted_count += 1
+            self.invalidate_pack_cache(user_id)
             
             # Resetear metadata para este tipo de archivo
             user_key = f"{user_id}_{file_type}"
-            if user_key in self.metadata:
-                self.metadata[user_key] = {"next_number": 1, "files": {}}
-                self.save_metadata()
+            with self.lock:
+                if user_key in self.metadata:
+                    for file_data in self.metadata[user_key]["files"].values():
+                        key = self._index_key(user_id, file_type, file_data["stored_name"])
+                        self.stored_name_index.pop(key, None)
+                        self.stored_number_index.pop(key, None)
+                    self.metadata[user_key] = {"next_number": 1, "files": {}}
+                    self.store.replace_user(user_id, file_type, self.metadata[user_key])
             
             return True, f"Se eliminaron {deleted_count} archivos {file_type} y se resetearon los números"
             
@@ -1,10 +1,15 @@
 import os
 import time
-from flask import Flask, send_from_directory, jsonify, render_template_string
+from flask import Flask, jsonify, render_template_string, request
+from werkzeug.security import safe_join
 
 from config import BASE_DIR, RENDER_DOMAIN, MAX_FILE_SIZE_MB
 from load_manager import load_manager
 from file_service import file_service
+from streaming_service import streaming_service
+from zip_stream_service import zip_stream_service
+from storage_usage import storage_usage
+from pack_jobs import pack_job_runner
 
 app = Flask(__name__)
 
@@ -135,20 +140,14 @@ def file_browser():
         </html>
         '''
         
-        # Calcular estadísticas
-        total_files = 0
-        total_size = 0
-        for root, dirs, files in os.walk(directory):
-            total_files += len(files)
-            for file in files:
-                file_path = os.path.join(root, file)
-                total_size += os.path.getsize(file_path)
+        # Estadísticas desde los contadores incrementales
+        totals = storage_usage.get_totals()
         
         return render_template_string(html_template,
             structure=structure,
             base_dir=directory,
-            total_files=total_files,
-            total_size=format_file_size(total_size)
+            total_files=totals["total_files"],
+            total_size=format_file_size(totals["total_bytes"])
         )
         
     except Exception as e:
@@ -509,14 +508,9 @@ def system_status():
     }
     
     if os.path.exists(BASE_DIR):
-        total_size = 0
-        total_files = 0
-        for root, dirs, files in os.walk(BASE_DIR):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if os.path.isfile(file_path):
-                    total_size += os.path.getsize(file_path)
-                    total_files += 1
+        totals = storage_usage.get_totals()
+        total_size = totals["total_bytes"]
+        total_files = totals["total_files"]
         
         storage_info.update({
             "total_files": total_files,
@@ -542,6 +536,8 @@ def system_status():
             "health_check": "/health",
             "system_status": "/system-status",
             "file_download": "/storage/<user_id>/<folder>/<filename>",  # ⬅️ CAMBIADO: static → storage
+            "zip_stream": "/zip/<user_id>?files=1,2,3",
+            "pack_job": "/pack-jobs/<user_id>/<job_id>",
             "file_browser": "/files"
         }
     })
@@ -553,15 +549,12 @@ def serve_static(path):
         # Extraer el nombre del archivo del path
         filename = os.path.basename(path)
         
-        # Servir el archivo
-        response = send_from_directory(BASE_DIR, path)
+        file_path = safe_join(BASE_DIR, path)
+        if file_path is None or not os.path.isfile(file_path):
+            raise FileNotFoundError(path)
         
-        # Configurar headers para forzar descarga
-        response.headers["Content-Disposition"] = f"attachment; filename=\"{filename}\""
-        response.headers["Content-Type"] = "application/octet-stream"
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        
-        return response
+        # Servir el archivo forzando la descarga (con soporte de Range)
+        return streaming_service.build_response(file_path, filename)
     except Exception as e:
         return jsonify({
             "error": "Archivo no encontrado",
@@ -583,8 +576,8 @@ def serve_download(user_id, filename):
             }), 404
         
         # Verificar que el archivo existe
-        file_path = os.path.join(user_download_dir, filename)
-        if not os.path.exists(file_path):
+        file_path = safe_join(user_download_dir, filename)
+        if file_path is None or not os.path.isfile(file_path):
             return jsonify({
                 "error": "Archivo no encontrado",
                 "filename": filename,
@@ -594,15 +587,8 @@ def serve_download(user_id, filename):
         # Obtener el nombre original del archivo desde la metadata
         original_filename = file_service.get_original_filename(user_id, filename, "downloads")
         
-        # Servir el archivo forzando la descarga
-        response = send_from_directory(user_download_dir, filename)
-        
-        # Configurar headers para forzar descarga
-        response.headers["Content-Disposition"] = f"attachment; filename=\"{original_filename}\""
-        response.headers["Content-Type"] = "application/octet-stream"
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        
-        return response
+        # Servir el archivo forzando la descarga (con soporte de Range)
+        return streaming_service.build_response(file_path, original_filename)
         
     except Exception as e:
         return jsonify({
@@ -624,8 +610,8 @@ def serve_packed(user_id, filename):
             }), 404
         
         # Verificar que el archivo existe
-        file_path = os.path.join(user_packed_dir, filename)
-        if not os.path.exists(file_path):
+        file_path = safe_join(user_packed_dir, filename)
+        if file_path is None or not os.path.isfile(file_path):
             return jsonify({
                 "error": "Archivo empaquetado no encontrado",
                 "filename": filename,
@@ -635,15 +621,47 @@ def serve_packed(user_id, filename):
         # Obtener el nombre original del archivo desde la metadata
         original_filename = file_service.get_original_filename(user_id, filename, "packed")
         
-        # Servir el archivo forzando la descarga
-        response = send_from_directory(user_packed_dir, filename)
+        # Servir el archivo forzando la descarga (con soporte de Range)
+        return streaming_service.build_response(file_path, original_filename)
         
-        # Configurar headers para forzar descarga
-        response.headers["Content-Disposition"] = f"attachment; filename=\"{original_filename}\""
-        response.headers["Content-Type"] = "application/octet-stream"
-        response.headers["X-Content-Type-Options"] = "nosniff"
+    except Exception as e:
+        return jsonify({
+            "error": "Error interno del servidor",
+            "message": str(e)
+        }), 500
+
+@app.route('/zip/<user_id>')
+def serve_zip(user_id):
+    """ZIP generado al vuelo con las descargas del usuario (?files=1,3,5 para una selección)"""
+    try:
+        user_download_dir = os.path.join(BASE_DIR, user_id, "downloads")
+        if not user_id.isdigit() or not os.path.isdir(user_download_dir):
+            return jsonify({
+                "error": "Usuario no encontrado",
+                "user_id": user_id
+            }), 404
+        
+        files = file_service.list_user_files(user_id, "downloads")
+        selection = request.args.get("files")
+        if selection:
+            try:
+                numbers = {int(n) for n in selection.split(",") if n.strip()}
+            except ValueError:
+                return jsonify({"error": "Parámetro files inválido", "files": selection}), 400
+            files = [f for f in files if f["number"] in numbers]
+        
+        if not files:
+            return jsonify({
+                "error": "No hay archivos para comprimir",
+                "user_id": user_id
+            }), 404
         
-        return response
+        members = []
+        for f in files:
+            file_path = os.path.join(user_download_dir, f["stored_name"])
+            crc = file_service.get_cached_crc(user_id, f["stored_name"], "downloads", os.stat(file_path))
+            members.append((f["stored_name"], file_path, crc))
+        return zip_stream_service.build_response(members, f"downloads_{user_id}.zip")
         
     except Exception as e:
         return jsonify({
@@ -651,6 +669,19 @@ def serve_packed(user_id, filename):
             "message": str(e)
         }), 500
 
+@app.route('/pack-jobs/<user_id>/<job_id>')
+def pack_job_status(user_id, job_id):
+    """Estado y progreso de un trabajo de empaquetado del usuario"""
+    job = pack_job_runner.get_job(job_id)
+    # Un trabajo ajeno se responde igual que uno inexistente
+    if not job or str(job["user_id"]) != user_id:
+        return jsonify({
+            "error": "Trabajo no encontrado",
+            "user_id": user_id,
+            "job_id": job_id
+        }), 404
+    return jsonify(job)
+
 @app.errorhandler(404)
 def not_found(error):
     """Manejo de errores 404"""
@@ -1,8 +1,14 @@
+import asyncio
 import threading
+import time
 import psutil
 import logging
 import sys
-from config import MAX_CONCURRENT_PROCESSES, CPU_USAGE_LIMIT
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    MAX_CONCURRENT_PROCESSES, CPU_USAGE_LIMIT, LOAD_SAMPLE_INTERVAL, LOAD_SMOOTHING,
+    JOB_WEIGHTS, ADMISSION_TIMEOUT
+)
 
 logger = logging.getLogger(__name__)
 
@@ -11,46 +17,195 @@ class LoadManager:
         self.active_processes = 0
         self.max_processes = MAX_CONCURRENT_PROCESSES
         self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        # Cola de admisión con start-time fair queuing entre usuarios
+        self.waiting = []
+        self.user_finish_tags = {}
+        self.virtual_time = 0
+        self.sequence = 0
+        # Hilos propios para las esperas de acquire_async: una cola larga no
+        # debe agotar el executor por defecto del event loop
+        self.wait_executor = ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT_PROCESSES * 4, thread_name_prefix="admission-wait"
+        )
+        # Snapshot inmutable que el muestreador reemplaza de golpe: se lee sin lock
+        self.snapshot = {
+            'cpu_percent': 0.0,
+            'memory_percent': 0.0,
+            'io_read_bps': 0.0,
+            'io_write_bps': 0.0,
+            'sampled_at': 0.0
+        }
+        self.sampler = threading.Thread(target=self._sample_loop, name="load-sampler", daemon=True)
+        self.sampler.start()
     
-    def can_start_process(self):
-        """Verifica si se puede iniciar un nuevo proceso pesado"""
-        with self.lock:
+    def _smooth(self, previous, current):
+        return LOAD_SMOOTHING * current + (1 - LOAD_SMOOTHING) * previous
+    
+    def _sample_loop(self):
+        """Muestrea CPU, memoria y E/S de disco en segundo plano"""
+        try:
+            psutil.cpu_percent(interval=None)
+            last_io = psutil.disk_io_counters()
+        except Exception:
+            last_io = None
+        last_time = time.time()
+        
+        while True:
+            time.sleep(LOAD_SAMPLE_INTERVAL)
             try:
-                cpu_percent = psutil.cpu_percent(interval=1)
-            except:
-                cpu_percent = 0
-            
-            if cpu_percent > CPU_USAGE_LIMIT:
-                return False, f"CPU sobrecargada ({cpu_percent:.1f}%). Espera un momento."
+                now = time.time()
+                elapsed = max(now - last_time, 1e-6)
+                cpu_percent = psutil.cpu_percent(interval=None)
+                memory_percent = psutil.virtual_memory().percent
+                
+                read_bps = write_bps = 0.0
+                io = psutil.disk_io_counters()
+                if io and last_io:
+                    read_bps = (io.read_bytes - last_io.read_bytes) / elapsed
+                    write_bps = (io.write_bytes - last_io.write_bytes) / elapsed
+                last_io, last_time = io, now
+                
+                previous = self.snapshot
+                first = previous['sampled_at'] == 0
+                self.snapshot = {
+                    'cpu_percent': cpu_percent if first else self._smooth(previous['cpu_percent'], cpu_percent),
+                    'memory_percent': memory_percent,
+                    'io_read_bps': read_bps if first else self._smooth(previous['io_read_bps'], read_bps),
+                    'io_write_bps': write_bps if first else self._smooth(previous['io_write_bps'], write_bps),
+                    'sampled_at': now
+                }
+            except Exception as e:
+                logger.error(f"Error muestreando carga del sistema: {e}")
+    
+    def _position(self, ticket):
+        """Posición (1 = siguiente) del ticket en la cola ordenada por etiqueta de inicio"""
+        key = (ticket['start_tag'], ticket['sequence'])
+        return 1 + sum(1 for t in self.waiting if (t['start_tag'], t['sequence']) < key)
+    
+    def _can_admit(self, position):
+        free_slots = self.max_processes - self.active_processes
+        return position <= free_slots and self.snapshot['cpu_percent'] <= CPU_USAGE_LIMIT
+    
+    def acquire(self, job_type, user_id, timeout=ADMISSION_TIMEOUT, on_position=None, cancel_event=None):
+        """
+        Espera turno para un proceso pesado en lugar de rechazarlo.
+        
+        Cada usuario avanza su etiqueta virtual según el coste del trabajo
+        (JOB_WEIGHTS), así que los usuarios se alternan y quien acaba de
+        empaquetar cede el turno a los demás. on_position(pos) se invoca
+        cada vez que cambia la posición en la cola; si cancel_event se activa,
+        el turno se abandona. Devuelve (éxito, mensaje).
+        """
+        cost = JOB_WEIGHTS.get(job_type, 1)
+        deadline = time.time() + timeout
+        
+        with self.cond:
+            start_tag = max(self.virtual_time, self.user_finish_tags.get(user_id, 0))
+            self.user_finish_tags[user_id] = start_tag + cost
+            self.sequence += 1
+            ticket = {
+                'job_type': job_type,
+                'user_id': user_id,
+                'start_tag': start_tag,
+                'sequence': self.sequence,
+                'enqueued_at': time.time()
+            }
+            self.waiting.append(ticket)
             
-            if self.active_processes >= self.max_processes:
-                return False, "Ya hay un proceso en ejecución. Espera a que termine."
+            last_position = None
+            while True:
+                # La cancelación se mira antes que el turno, también al despertar:
+                # un trabajo ya cancelado nunca ocupa un hueco
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                remaining = deadline - time.time()
+                position = self._position(ticket)
+                if not cancelled and self._can_admit(position):
+                    break
+                
+                if cancelled or remaining <= 0:
+                    self.waiting.remove(ticket)
+                    # Devolver el coste reservado si nadie lo ha superado
+                    if self.user_finish_tags.get(user_id) == start_tag + cost:
+                        self.user_finish_tags[user_id] = start_tag
+                    self.cond.notify_all()
+                    if cancelled:
+                        return False, "Cancelado mientras esperaba en la cola."
+                    return False, "Tiempo de espera agotado en la cola. Intenta de nuevo más tarde."
+                
+                if on_position and position != last_position:
+                    try:
+                        on_position(position)
+                    except Exception as e:
+                        logger.debug(f"Error notificando posición en cola: {e}")
+                    last_position = position
+                
+                # Despertar periódico: la CPU puede bajar sin que nadie notifique
+                self.cond.wait(min(remaining, LOAD_SAMPLE_INTERVAL))
             
+            self.waiting.remove(ticket)
+            self.virtual_time = max(self.virtual_time, start_tag)
             self.active_processes += 1
-            return True, f"Proceso iniciado (CPU: {cpu_percent:.1f}%)"
+            if len(self.user_finish_tags) > 1024:
+                self.user_finish_tags = {
+                    uid: tag for uid, tag in self.user_finish_tags.items() if tag > self.virtual_time
+                }
+            self.cond.notify_all()
+            
+            waited = time.time() - ticket['enqueued_at']
+            return True, f"Proceso iniciado tras {waited:.0f}s en cola (CPU: {self.snapshot['cpu_percent']:.1f}%)"
+    
+    async def acquire_async(self, job_type, user_id, timeout=ADMISSION_TIMEOUT, on_position=None,
+                            cancel_event=None):
+        """
+        Versión awaitable de acquire: espera en un hilo dedicado sin bloquear
+        el event loop. Si la corrutina se cancela, el turno se abandona y una
+        admisión que llegue tarde se libera sola.
+        """
+        if cancel_event is None:
+            cancel_event = threading.Event()
+        future = self.wait_executor.submit(
+            self.acquire, job_type, user_id, timeout, on_position, cancel_event
+        )
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            future.add_done_callback(self._release_abandoned)
+            raise
+    
+    def _release_abandoned(self, future):
+        """Libera el turno obtenido por una espera cuyo llamador ya no existe"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        admitted, _ = future.result()
+        if admitted:
+            self.finish_process()
     
     def finish_process(self):
-        """Marca un proceso como terminado"""
-        with self.lock:
+        """Marca un proceso como terminado y despierta a la cola"""
+        with self.cond:
             self.active_processes = max(0, self.active_processes - 1)
+            self.cond.notify_all()
+    
+    def get_queue_length(self):
+        return len(self.waiting)
     
     def get_status(self):
-        """Obtiene estado actual del sistema"""
-        with self.lock:
-            try:
-                cpu_percent = psutil.cpu_percent(interval=1)
-                memory = psutil.virtual_memory()
-                memory_percent = memory.percent
-            except:
-                cpu_percent = 0
-                memory_percent = 0
-            
-            return {
-                'active_processes': self.active_processes,
-                'max_processes': self.max_processes,
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory_percent,
-                'can_accept_work': self.active_processes < self.max_processes and cpu_percent < CPU_USAGE_LIMIT
-            }
+        """Obtiene estado actual del sistema (lectura sin bloqueo del último snapshot)"""
+        snapshot = self.snapshot
+        active = self.active_processes
+        
+        return {
+            'active_processes': active,
+            'max_processes': self.max_processes,
+            'cpu_percent': snapshot['cpu_percent'],
+            'memory_percent': snapshot['memory_percent'],
+            'io_read_bps': snapshot['io_read_bps'],
+            'io_write_bps': snapshot['io_write_bps'],
+            'sampled_at': snapshot['sampled_at'],
+            'queue_length': len(self.waiting),
+            'can_accept_work': active < self.max_processes and snapshot['cpu_percent'] < CPU_USAGE_LIMIT
+        }
 
 load_manager = LoadManager()
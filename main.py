@@ -5,9 +5,11 @@ import time
 import sys
 from waitress import serve
 
-from config import BASE_DIR, PORT
-from telegram_bot import TelegramBot
-from flask_app import app
+from config import BASE_DIR, PORT, FILE_SERVING_MODE
+
+# Los servicios se importan solo al ejecutar main: los workers de los pools
+# (spawn/forkserver) reimportan este módulo como __mp_main__ y no deben
+# construir FileService ni abrir la metadata
 
 # ===== LOGGING =====
 logging.basicConfig(
@@ -20,20 +22,34 @@ logger = logging.getLogger(__name__)
 # ===== INICIALIZACIÓN =====
 def start_telegram_bot():
     """Inicia el bot de Telegram en un hilo separado"""
+    from telegram_bot import TelegramBot
+    
     logger.info("Iniciando bot de Telegram...")
     bot = TelegramBot()
     bot.run_bot()
 
 def start_web_server():
     """Inicia el servidor web Flask"""
-    logger.info(f"Iniciando servidor web en puerto {PORT}")
-    serve(app, host='0.0.0.0', port=PORT)
+    from flask_app import app
+    from sendfile_server import serve_sendfile
+    
+    logger.info(f"Iniciando servidor web en puerto {PORT} (modo {FILE_SERVING_MODE})")
+    if FILE_SERVING_MODE == "sendfile":
+        serve_sendfile(app, host='0.0.0.0', port=PORT)
+    else:
+        serve(app, host='0.0.0.0', port=PORT)
 
 if __name__ == '__main__':
+    from storage_usage import storage_usage
+    from blob_store import blob_store
+    
     os.makedirs(BASE_DIR, exist_ok=True)
     
     logger.info(f"Directorios creados/verificados: {BASE_DIR}")
 
+    storage_usage.start()
+    blob_store.start()
+
     bot_thread = threading.Thread(target=start_telegram_bot, daemon=True)
     bot_thread.start()
 
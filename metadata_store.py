@@ -0,0 +1,382 @@
+import os
+import json
+import fcntl
+import sqlite3
+import threading
+import time
+import logging
+from config import (
+    METADATA_BACKEND, METADATA_JSON_FILE, METADATA_DB_FILE,
+    METADATA_SNAPSHOT_FILE, METADATA_JOURNAL_FILE,
+    METADATA_JOURNAL_MAX_MB, METADATA_COMPACT_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Campos con columna propia en SQLite; el resto viaja en la columna "extra"
+BASE_FIELDS = ("original_name", "stored_name", "registered_at")
+
+
+def split_user_key(user_key):
+    """Separa una clave '<user_id>_<file_type>' en sus dos componentes"""
+    user_id, _, file_type = user_key.rpartition("_")
+    return user_id, file_type
+
+
+def read_json_metadata(path):
+    """Lee un archivo de metadata en el formato JSON heredado"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class JsonMetadataStore:
+    """Backend heredado: reescribe el JSON completo en cada cambio"""
+
+    def __init__(self, path=METADATA_JSON_FILE):
+        self.path = path
+        self.metadata = {}
+
+    def load(self):
+        self.metadata = read_json_metadata(self.path)
+        return self.metadata
+
+    def save_all(self, metadata):
+        self.metadata = metadata
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    def put_file(self, user_id, file_type, number, file_data, next_number):
+        self.save_all(self.metadata)
+
+    def set_next_number(self, user_id, file_type, next_number):
+        self.save_all(self.metadata)
+
+    def replace_user(self, user_id, file_type, user_data):
+        self.save_all(self.metadata)
+
+
+class SqliteMetadataStore:
+    """Backend transaccional: cada registro es una única fila en SQLite (WAL)"""
+
+    def __init__(self, path=METADATA_DB_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS counters (
+                user_id TEXT NOT NULL,
+                file_type TEXT NOT NULL,
+                next_number INTEGER NOT NULL,
+                PRIMARY KEY (user_id, file_type)
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                user_id TEXT NOT NULL,
+                file_type TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                original_name TEXT NOT NULL,
+                stored_name TEXT NOT NULL,
+                registered_at REAL,
+                extra TEXT,
+                PRIMARY KEY (user_id, file_type, number)
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_stored_name
+                ON files (user_id, file_type, stored_name);
+        """)
+        self.conn.commit()
+
+    def _file_row(self, user_id, file_type, number, file_data):
+        extra = {k: v for k, v in file_data.items() if k not in BASE_FIELDS}
+        return (
+            str(user_id), file_type, int(number),
+            file_data["original_name"], file_data["stored_name"],
+            file_data.get("registered_at"),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    def _upsert_counter(self, user_id, file_type, next_number):
+        self.conn.execute(
+            "INSERT INTO counters (user_id, file_type, next_number) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, file_type) DO UPDATE SET next_number = excluded.next_number",
+            (str(user_id), file_type, next_number)
+        )
+
+    def _insert_user(self, user_id, file_type, user_data):
+        self.conn.execute(
+            "DELETE FROM files WHERE user_id = ? AND file_type = ?",
+            (str(user_id), file_type)
+        )
+        self.conn.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [self._file_row(user_id, file_type, num, data)
+             for num, data in user_data["files"].items()]
+        )
+        self._upsert_counter(user_id, file_type, user_data["next_number"])
+
+    def is_empty(self):
+        with self.lock:
+            row = self.conn.execute("SELECT COUNT(*) FROM counters").fetchone()
+            return row[0] == 0
+
+    def load(self):
+        """Reconstruye el diccionario de metadata con el formato heredado"""
+        metadata = {}
+        with self.lock:
+            for user_id, file_type, next_number in self.conn.execute(
+                    "SELECT user_id, file_type, next_number FROM counters"):
+                metadata[f"{user_id}_{file_type}"] = {"next_number": next_number, "files": {}}
+
+            for row in self.conn.execute(
+                    "SELECT user_id, file_type, number, original_name, stored_name, "
+                    "registered_at, extra FROM files"):
+                user_id, file_type, number, original_name, stored_name, registered_at, extra = row
+                user_key = f"{user_id}_{file_type}"
+                if user_key not in metadata:
+                    metadata[user_key] = {"next_number": number + 1, "files": {}}
+                file_data = {
+                    "original_name": original_name,
+                    "stored_name": stored_name,
+                    "registered_at": registered_at
+                }
+                if extra:
+                    file_data.update(json.loads(extra))
+                metadata[user_key]["files"][str(number)] = file_data
+        return metadata
+
+    def save_all(self, metadata):
+        """Reemplaza todo el contenido (solo para migraciones)"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM files")
+            self.conn.execute("DELETE FROM counters")
+            for user_key, user_data in metadata.items():
+                user_id, file_type = split_user_key(user_key)
+                self._insert_user(user_id, file_type, user_data)
+
+    def put_file(self, user_id, file_type, number, file_data, next_number):
+        """Inserta o actualiza una sola entrada y el contador del usuario"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._file_row(user_id, file_type, number, file_data)
+            )
+            self._upsert_counter(user_id, file_type, next_number)
+
+    def set_next_number(self, user_id, file_type, next_number):
+        with self.lock, self.conn:
+            self._upsert_counter(user_id, file_type, next_number)
+
+    def replace_user(self, user_id, file_type, user_data):
+        """Reescribe las entradas de un usuario/tipo (renumeración o vaciado)"""
+        with self.lock, self.conn:
+            self._insert_user(user_id, file_type, user_data)
+
+    def migrate_from_json(self, json_path):
+        """Migración única desde el JSON heredado si la base está vacía"""
+        if not os.path.exists(json_path) or not self.is_empty():
+            return False
+
+        metadata = read_json_metadata(json_path)
+        self.save_all(metadata)
+        os.replace(json_path, f"{json_path}.migrated")
+        logger.info(f"✅ Metadata migrada de {json_path} a SQLite ({len(metadata)} claves)")
+        return True
+
+
+class JournalMetadataStore:
+    """
+    Backend de diario append-only: cada cambio añade un registro compacto al
+    journal y un compactador en segundo plano reescribe el snapshot cuando el
+    journal supera el umbral. Los registros son idempotentes, así que volver a
+    aplicar uno ya incluido en el snapshot no altera el resultado.
+
+    Solo el proceso que obtiene el lock exclusivo (flock sobre
+    <journal>.lock) compacta y escribe; cualquier otro proceso que cargue
+    el store lo hace en solo lectura y nunca trunca el journal.
+
+    self.metadata es el mismo dict que modifica el dueño de la metadata:
+    metadata_lock debe ser el lock con el que la protege.
+    """
+
+    def __init__(self, snapshot_path=METADATA_SNAPSHOT_FILE, journal_path=METADATA_JOURNAL_FILE,
+                 max_journal_mb=METADATA_JOURNAL_MAX_MB, compact_interval=METADATA_COMPACT_INTERVAL,
+                 metadata_lock=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        # Journal que recibe los registros mientras se escribe un snapshot
+        self.next_journal_path = f"{journal_path}.next"
+        self.metadata_lock = metadata_lock or threading.RLock()
+        self.compact_lock = threading.Lock()
+        self.max_journal_bytes = max_journal_mb * 1024 * 1024
+        self.compact_interval = compact_interval
+        self.lock = threading.Lock()
+        self.metadata = {}
+        self.journal = None
+        self.compactor = None
+        self.owner_lock = None
+        self.owner = False
+
+    def _acquire_ownership(self):
+        """Intenta tomar el lock exclusivo del journal sin esperar"""
+        if self.owner:
+            return True
+        lock_file = open(f"{self.journal_path}.lock", 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Se mantiene abierto: el lock dura lo que viva el proceso
+        self.owner_lock = lock_file
+        self.owner = True
+        return True
+
+    def _check_owner(self):
+        if not self.owner:
+            raise RuntimeError(f"{self.journal_path} pertenece a otro proceso: store en solo lectura")
+
+    def _apply(self, record):
+        """Aplica un registro del journal sobre self.metadata"""
+        user_key = f"{record['u']}_{record['t']}"
+        op = record["op"]
+        if op == "user":
+            self.metadata[user_key] = record["d"]
+            return
+
+        user_data = self.metadata.setdefault(user_key, {"next_number": 1, "files": {}})
+        user_data["next_number"] = record["next"]
+        if op == "put":
+            user_data["files"][str(record["n"])] = record["d"]
+
+    def _replay(self, path):
+        """Aplica un journal; una última línea truncada por un crash se descarta"""
+        if not os.path.exists(path):
+            return 0
+
+        applied = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Registro incompleto en {path} tras {applied} entradas, descartado")
+                    break
+                self._apply(record)
+                applied += 1
+        return applied
+
+    def _append(self, record):
+        self._check_owner()
+        with self.lock:
+            self.journal.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.journal.flush()
+
+    def load(self):
+        """Reconstruye la metadata: último snapshot + replay del journal"""
+        owner = self._acquire_ownership()
+        with self.lock:
+            if os.path.exists(self.snapshot_path):
+                self.metadata = read_json_metadata(self.snapshot_path)
+            else:
+                # Primer arranque: partir del JSON heredado si existe
+                self.metadata = read_json_metadata(METADATA_JSON_FILE)
+            # Un .next solo sobrevive si se cayó una compactación: va después del journal
+            applied = self._replay(self.journal_path) + self._replay(self.next_journal_path)
+
+        logger.info(f"Metadata reconstruida: {len(self.metadata)} claves, {applied} registros de journal")
+        if not owner:
+            logger.warning(f"{self.journal_path} en uso por otro proceso: metadata cargada en solo lectura")
+            return self.metadata
+
+        # Aún no hay escritores: el snapshot se escribe directamente y, ya
+        # persistido, los journals se pueden descartar
+        with self.lock:
+            self._write_snapshot(json.dumps(self.metadata, ensure_ascii=False, separators=(",", ":")))
+            if os.path.exists(self.next_journal_path):
+                os.remove(self.next_journal_path)
+            self.journal = open(self.journal_path, 'w', encoding='utf-8')
+        if os.path.exists(METADATA_JSON_FILE):
+            os.replace(METADATA_JSON_FILE, f"{METADATA_JSON_FILE}.migrated")
+        self._start_compactor()
+        return self.metadata
+
+    def _write_snapshot(self, data):
+        """Escribe el snapshot en un temporal y lo sustituye de forma atómica"""
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def compact(self):
+        """
+        Reescribe el snapshot y vacía el journal sin bloquear a los escritores
+        mientras se escribe: la copia se serializa bajo metadata_lock y los
+        registros nuevos van a un journal aparte que sustituye al actual solo
+        cuando el snapshot ya está en disco.
+        """
+        self._check_owner()
+        with self.compact_lock:
+            with self.metadata_lock:
+                data = json.dumps(self.metadata, ensure_ascii=False, separators=(",", ":"))
+                with self.lock:
+                    if self.journal:
+                        self.journal.close()
+                    self.journal = open(self.next_journal_path, 'w', encoding='utf-8')
+
+            self._write_snapshot(data)
+            with self.lock:
+                os.replace(self.next_journal_path, self.journal_path)
+
+    def _start_compactor(self):
+        if self.compactor:
+            return
+
+        def _run():
+            while True:
+                time.sleep(self.compact_interval)
+                try:
+                    if os.path.getsize(self.journal_path) >= self.max_journal_bytes:
+                        self.compact()
+                        logger.info("Journal de metadata compactado")
+                except Exception as e:
+                    logger.error(f"Error compactando journal de metadata: {e}")
+
+        self.compactor = threading.Thread(target=_run, name="metadata-compactor", daemon=True)
+        self.compactor.start()
+
+    def save_all(self, metadata):
+        self.metadata = metadata
+        self.compact()
+
+    def put_file(self, user_id, file_type, number, file_data, next_number):
+        self._append({"op": "put", "u": str(user_id), "t": file_type, "n": int(number),
+                      "d": file_data, "next": next_number})
+
+    def set_next_number(self, user_id, file_type, next_number):
+        self._append({"op": "next", "u": str(user_id), "t": file_type, "next": next_number})
+
+    def replace_user(self, user_id, file_type, user_data):
+        self._append({"op": "user", "u": str(user_id), "t": file_type, "d": user_data})
+
+
+def create_metadata_store(backend=METADATA_BACKEND, metadata_lock=None):
+    """
+    Crea el backend de metadata configurado. metadata_lock es el lock con el
+    que el llamador protege el dict devuelto por load().
+    """
+    if backend == "json":
+        return JsonMetadataStore(METADATA_JSON_FILE)
+
+    if backend == "journal":
+        return JournalMetadataStore(metadata_lock=metadata_lock)
+
+    store = SqliteMetadataStore(METADATA_DB_FILE)
+    try:
+        store.migrate_from_json(METADATA_JSON_FILE)
+    except Exception as e:
+        logger.error(f"Error migrando metadata JSON a SQLite: {e}")
+    return store
@@ -0,0 +1,199 @@
+import secrets
+import threading
+import time
+import logging
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from config import MAX_CONCURRENT_PROCESSES
+from load_manager import load_manager
+from packing_service import packing_service
+
+logger = logging.getLogger(__name__)
+
+# Tiempo que se conserva el estado de un trabajo terminado para consultarlo
+FINISHED_JOB_TTL = 3600
+
+
+class PackJobRunner:
+    """
+    Ejecuta empaquetados como trabajos en segundo plano identificados por
+    un id corto. Cada trabajo expone su estado y progreso en bytes, y se
+    puede cancelar (también mientras espera en la cola de admisión).
+    Los callbacks se invocan desde el hilo del trabajo.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+        # Solo ejecutan trabajos ya admitidos por load_manager, así que nunca
+        # hay más que turnos: la espera ocurre en la cola justa, no aquí
+        self.executor = ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT_PROCESSES, thread_name_prefix="pack-job"
+        )
+
+    def submit(self, user_id, split_size_mb=None, compress=False, on_position=None, on_progress=None,
+               independent=False):
+        """
+        Encola un empaquetado y devuelve el trabajo: 'admitted' se resuelve
+        al obtener turno (True) o al terminar sin empaquetar (False) y
+        'future' con el resultado (archivos, mensaje).
+        """
+        self._purge()
+        job = {
+            'id': secrets.token_hex(4),
+            'user_id': user_id,
+            'split_size_mb': split_size_mb,
+            'compress': compress,
+            'independent': independent,
+            'state': 'queued',
+            'position': None,
+            'bytes_done': 0,
+            'bytes_total': 0,
+            'message': None,
+            'files': None,
+            'created_at': time.time(),
+            'finished_at': None,
+            'cancel_event': threading.Event(),
+            'admitted': Future(),
+            'future': Future()
+        }
+        with self.lock:
+            self.jobs[job['id']] = job
+        # Cada trabajo espera turno en su propio hilo para entrar ya en la cola
+        # justa de load_manager (posición visible, alternancia entre usuarios)
+        threading.Thread(
+            target=self._admit, args=(job, on_position, on_progress),
+            name=f"pack-wait-{job['id']}", daemon=True
+        ).start()
+        logger.info(f"Trabajo de empaquetado {job['id']} encolado para el usuario {user_id}")
+        return job
+
+    def _notify(self, job, callback, *args):
+        # Los callbacks solo informan: un error en ellos no debe abortar el trabajo
+        if not callback:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.warning(f"Error en callback del trabajo {job['id']}: {e}")
+
+    def _admit(self, job, on_position, on_progress):
+        def _position(position):
+            job['position'] = position
+            self._notify(job, on_position, position)
+
+        try:
+            cached = packing_service.get_cached_result(
+                job['user_id'], job['split_size_mb'], job['compress'], job['independent']
+            )
+            if cached:
+                self._finish(job, *cached)
+                return
+            if job['cancel_event'].is_set():
+                self._finish(job, None, "Empaquetado cancelado")
+                return
+
+            can_start, message = load_manager.acquire(
+                "pack", job['user_id'], on_position=_position, cancel_event=job['cancel_event']
+            )
+            if not can_start:
+                self._finish(job, None, message)
+                return
+
+            job['state'] = 'running'
+            job['position'] = None
+            self._resolve(job['admitted'], True)
+            self._notify(job, on_position, None)
+            try:
+                self.executor.submit(self._run, job, on_progress)
+            except Exception:
+                load_manager.finish_process()
+                raise
+        except Exception as e:
+            logger.error(f"Error admitiendo trabajo de empaquetado {job['id']}: {e}", exc_info=True)
+            self._finish(job, None, str(e))
+
+    def _run(self, job, on_progress):
+        def _progress(done, total):
+            job['bytes_done'] = done
+            job['bytes_total'] = total
+            self._notify(job, on_progress, done, total)
+
+        try:
+            files, message = packing_service.pack_admitted(
+                job['user_id'], job['split_size_mb'], compress=job['compress'],
+                on_progress=_progress, cancel_event=job['cancel_event'],
+                independent=job['independent']
+            )
+        except Exception as e:
+            logger.error(f"Error en trabajo de empaquetado {job['id']}: {e}", exc_info=True)
+            files, message = None, str(e)
+        self._finish(job, files, message)
+
+    def _finish(self, job, files, message):
+        job['files'] = files
+        job['message'] = message
+        if files:
+            job['state'] = 'done'
+        elif job['cancel_event'].is_set():
+            job['state'] = 'cancelled'
+        else:
+            job['state'] = 'failed'
+        job['finished_at'] = time.time()
+        self._resolve(job['admitted'], False)
+        self._resolve(job['future'], (files, message))
+
+    def _resolve(self, future, result):
+        # Quien espera puede haber abandonado (cancelado) el future
+        if not future.done():
+            try:
+                future.set_result(result)
+            except InvalidStateError:
+                pass
+
+    def cancel(self, job_id, user_id):
+        """Pide cancelar un trabajo del usuario. Devuelve (éxito, mensaje)"""
+        job = self.jobs.get(job_id)
+        if not job or job['user_id'] != user_id:
+            return False, "Trabajo no encontrado"
+        if job['finished_at'] is not None:
+            return False, "El empaquetado ya termino"
+        job['cancel_event'].set()
+        logger.info(f"Cancelación solicitada para el trabajo {job_id}")
+        return True, "Cancelando empaquetado..."
+
+    def get_job(self, job_id):
+        """Estado público de un trabajo (sin objetos internos) o None"""
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+        total = job['bytes_total']
+        return {
+            'id': job['id'],
+            'user_id': job['user_id'],
+            'state': job['state'],
+            'position': job['position'],
+            'bytes_done': job['bytes_done'],
+            'bytes_total': total,
+            'percent': round(job['bytes_done'] * 100 / total, 1) if total else 0.0,
+            'message': job['message'],
+            'created_at': job['created_at'],
+            'finished_at': job['finished_at'],
+            'files': [
+                {'filename': f['filename'], 'url': f['url'], 'size_mb': round(f['size_mb'], 2)}
+                for f in job['files']
+            ] if job['files'] else None
+        }
+
+    def get_user_jobs(self, user_id):
+        return [self.get_job(job_id) for job_id, job in list(self.jobs.items())
+                if job['user_id'] == user_id]
+
+    def _purge(self):
+        now = time.time()
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if job['finished_at'] and now - job['finished_at'] > FINISHED_JOB_TTL]:
+                del self.jobs[job_id]
+
+
+pack_job_runner = PackJobRunner()
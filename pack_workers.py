@@ -0,0 +1,61 @@
+import multiprocessing
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from config import PACK_COMPRESS_WORKERS
+
+# Funciones que ejecutan los pools de procesos del empaquetado. Este módulo
+# solo depende de la stdlib y de constantes de config: con spawn/forkserver
+# cada worker lo importa de cero y no debe construir ningún servicio.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shared_process_pool():
+    """
+    Pool de procesos compartido por todos los empaquetados (CRC32 y
+    DEFLATE). Se crea una vez y desde hilos de empaquetado: con fork se
+    copiarían locks tomados por otros hilos del bot, así que usa
+    forkserver (o spawn donde no existe), cuyo arranque solo se paga una vez.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=PACK_COMPRESS_WORKERS,
+                                        mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def file_crc32(path):
+    """CRC32 de un archivo (función de módulo para poder usarla en un pool de procesos)"""
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def deflate_block(path, offset, length, level, last):
+    """
+    Comprime un bloque del archivo como tramo de un flujo DEFLATE crudo
+    (estilo pigz). Los 32 KB anteriores se usan como diccionario y el
+    bloque termina alineado a byte (Z_FULL_FLUSH) salvo el último, así que
+    la concatenación de los bloques es un único flujo válido.
+    """
+    with open(path, 'rb') as f:
+        zdict = b''
+        if offset:
+            window_start = max(0, offset - 32768)
+            f.seek(window_start)
+            zdict = f.read(offset - window_start)
+        data = f.read(length)
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
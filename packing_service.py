@@ -1,79 +1,463 @@
 import os
+import re
+import json
 import math
+import hashlib
 import logging
 import time
+import uuid
+import threading
 import zipfile
-from config import BASE_DIR, MAX_PART_SIZE_MB
+import zlib
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    BASE_DIR, MAX_PART_SIZE_MB, PACK_COMPRESS_WORKERS, PACK_DEFLATE_LEVEL, PACK_DEFLATE_BLOCK_MB,
+    PACK_VOLUME_WORKERS
+)
 from load_manager import load_manager
 from file_service import file_service
+from storage_usage import storage_usage
+from pack_workers import deflate_block, file_crc32, shared_process_pool
+from zip_stream_service import zip_stream_service
 
 logger = logging.getLogger(__name__)
 
+# Firmas de formatos ya comprimidos: pasarlos por DEFLATE solo gasta CPU
+COMPRESSED_SIGNATURES = (
+    b'\xff\xd8\xff',            # JPEG
+    b'\x89PNG\r\n\x1a\n',       # PNG
+    b'GIF8',                    # GIF
+    b'PK\x03\x04',              # ZIP, docx, apk, jar
+    b'\x1f\x8b',                # gzip
+    b'BZh',                     # bzip2
+    b'\xfd7zXZ\x00',            # xz
+    b"7z\xbc\xaf'\x1c",          # 7z
+    b'Rar!\x1a\x07',            # RAR
+    b'\x28\xb5\x2f\xfd',        # zstd
+    b'\x1aE\xdf\xa3',            # Matroska / WebM
+    b'OggS', b'fLaC', b'ID3',   # audio
+)
+
+# Cota de lo que ocupa en el ZIP cada miembro además de datos y nombre
+# (cabecera local + descriptor + entrada central, con ZIP64) y cada archivo
+# (registros de fin de directorio central)
+VOLUME_ENTRY_OVERHEAD = 160
+VOLUME_ARCHIVE_OVERHEAD = 128
+# Muestras de 64 KB con las que se estima el tamaño comprimido de un miembro
+VOLUME_ESTIMATE_SAMPLES = 4
+
+def looks_compressed(head):
+    """Detecta por la cabecera formatos multimedia o archivos ya comprimidos"""
+    if head.startswith(COMPRESSED_SIGNATURES):
+        return True
+    if head[4:8] == b'ftyp':  # MP4, MOV, M4A, HEIC
+        return True
+    if head[:4] == b'RIFF' and head[8:12] in (b'WEBP', b'AVI '):
+        return True
+    return False
+
+class PackCancelled(Exception):
+    """El usuario canceló el empaquetado en curso"""
+
+
+class PackProgress:
+    """
+    Progreso en bytes de un empaquetado. advance() se llama desde la
+    escritura del ZIP: notifica on_progress(hechos, total) como mucho dos
+    veces por segundo y lanza PackCancelled si se pidió cancelar.
+    """
+
+    def __init__(self, total, on_progress=None, cancel_event=None):
+        self.total = total
+        self.done = 0
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event
+        self.last_notify = 0.0
+        # Los volúmenes independientes avanzan desde varios hilos
+        self.lock = threading.Lock()
+
+    def advance(self, nbytes):
+        with self.lock:
+            self.done = min(self.done + nbytes, self.total)
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise PackCancelled("cancelado por el usuario")
+        now = time.time()
+        if self.on_progress and now - self.last_notify >= 0.5:
+            self.last_notify = now
+            self.on_progress(self.done, self.total)
+
+    def finish(self):
+        self.done = self.total
+        if self.on_progress:
+            self.on_progress(self.done, self.total)
+
+
+class ProgressWriter:
+    """Envuelve el destino del ZIP para contar los bytes escritos"""
+
+    def __init__(self, out, progress):
+        self.out = out
+        self.progress = progress
+
+    def write(self, data):
+        written = self.out.write(data)
+        self.progress.advance(len(data))
+        return written
+
+    def tell(self):
+        return self.out.tell()
+
+
+class ParallelDeflater:
+    """Reparte bloques entre el pool y los entrega en orden con una ventana acotada en vuelo"""
+
+    def __init__(self, pool, tasks, window):
+        self.pool = pool
+        self.tasks = iter(tasks)
+        self.window = window
+        self.inflight = deque()
+        self._fill()
+
+    def _fill(self):
+        while len(self.inflight) < self.window:
+            task = next(self.tasks, None)
+            if task is None:
+                return
+            self.inflight.append(self.pool.submit(deflate_block, *task))
+
+    def blocks(self, count):
+        for _ in range(count):
+            future = self.inflight.popleft()
+            self._fill()
+            yield future.result()
+
+
+class SplitVolumeWriter:
+    """
+    Destino de escritura secuencial que reparte el archivo directamente en
+    partes .001, .002... de tamaño fijo: una sola pasada, memoria acotada
+    al buffer y sin ZIP temporal. La concatenación de las partes es el ZIP
+    completo. parts guarda [nombre, tamaño, sha256] de cada parte, con el
+    hash calculado al escribir.
+    """
+
+    def __init__(self, packed_dir, base_filename, part_size, buffer_size):
+        self.packed_dir = packed_dir
+        self.base_filename = base_filename
+        self.part_size = part_size
+        self.buffer_size = buffer_size
+        self.position = 0
+        self.parts = []
+        self.current = None
+        self.current_size = 0
+        self.current_hash = None
+
+    def _open_next_part(self):
+        self._close_current()
+        part_filename = f"{self.base_filename}.zip.{len(self.parts) + 1:03d}"
+        self.current = open(os.path.join(self.packed_dir, part_filename), 'wb',
+                            buffering=self.buffer_size)
+        self.current_size = 0
+        self.current_hash = hashlib.sha256()
+        self.parts.append([part_filename, 0, None])
+
+    def _close_current(self):
+        if self.current:
+            self.current.close()
+            self.parts[-1][1] = self.current_size
+            self.parts[-1][2] = self.current_hash.hexdigest()
+            self.current = None
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            if self.current is None or self.current_size >= self.part_size:
+                self._open_next_part()
+            room = self.part_size - self.current_size
+            piece = view[:room]
+            self.current.write(piece)
+            self.current_hash.update(piece)
+            self.current_size += len(piece)
+            self.position += len(piece)
+            view = view[len(piece):]
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        if self.current:
+            self.current.flush()
+
+    def close(self):
+        self._close_current()
+
+    def part_paths(self):
+        return [os.path.join(self.packed_dir, name) for name, _, _ in self.parts]
+
+
 class AdvancedPackingService:
     def __init__(self):
         self.max_part_size_mb = MAX_PART_SIZE_MB
         self.buffer_size = 64 * 1024  # 64KB buffer optimizado
     
-    def pack_folder(self, user_id, split_size_mb=None):
-        """Empaqueta archivos en ZIP o divide el ZIP en partes válidas"""
+    def pack_folder(self, user_id, split_size_mb=None, on_position=None, compress=False,
+                    on_progress=None, cancel_event=None, independent=False):
+        """
+        Empaqueta archivos en ZIP o divide el ZIP en partes válidas.
+        Espera turno en la cola de admisión; on_position recibe la posición.
+        Con compress=True los miembros comprimibles se guardan con DEFLATE.
+        Con independent=True las partes son ZIP completos que se extraen
+        por separado en lugar de trozos de un único ZIP.
+        on_progress(bytes_hechos, bytes_totales) informa del avance y
+        cancel_event (threading.Event) permite abortar en cualquier momento.
+        Si las descargas no han cambiado desde un empaquetado con las mismas
+        opciones, se devuelven sus enlaces sin volver a empaquetar.
+        """
+        cached = self.get_cached_result(user_id, split_size_mb, compress, independent)
+        if cached:
+            return cached
+        
+        can_start, message = load_manager.acquire("pack", user_id, on_position=on_position,
+                                                  cancel_event=cancel_event)
+        if not can_start:
+            return None, message
+        return self.pack_admitted(user_id, split_size_mb, compress, on_progress, cancel_event,
+                                  independent)
+    
+    def get_cached_result(self, user_id, split_size_mb=None, compress=False, independent=False):
+        """Resultado de un empaquetado anterior del mismo conjunto y opciones, o None"""
+        try:
+            user_dir = file_service.get_user_directory(user_id, "downloads")
+            fingerprint = self._fingerprint(user_dir, self._list_sources(user_dir),
+                                            split_size_mb, compress, independent)
+            cached = fingerprint and file_service.get_cached_pack(user_id, fingerprint)
+        except Exception as e:
+            logger.error(f"Error consultando empaquetados previos: {e}")
+            return None
+        if not cached:
+            return None
+        files, message = cached
+        logger.info(f"Empaquetado sin cambios para el usuario {user_id}: reutilizando resultado")
+        return files, f"{message} (sin cambios, enlaces reutilizados)"
+    
+    def pack_admitted(self, user_id, split_size_mb=None, compress=False, on_progress=None,
+                      cancel_event=None, independent=False):
+        """
+        Empaqueta con un turno ya concedido por load_manager y lo libera al
+        terminar. Mismas opciones y resultado que pack_folder.
+        """
         try:
-            can_start, message = load_manager.can_start_process()
-            if not can_start:
-                return None, message
-            
             try:
                 user_dir = file_service.get_user_directory(user_id, "downloads")
-                if not os.path.exists(user_dir):
-                    return None, "No tienes archivos para empaquetar"
-                
-                files = [f for f in os.listdir(user_dir) 
-                        if os.path.isfile(os.path.join(user_dir, f))]
-                
+                files = self._list_sources(user_dir)
                 if not files:
                     return None, "No tienes archivos para empaquetar"
+                # Huella del conjunto que se va a empaquetar (puede cambiar mientras se esperaba turno)
+                fingerprint = self._fingerprint(user_dir, files, split_size_mb, compress, independent)
+                cached = fingerprint and file_service.get_cached_pack(user_id, fingerprint)
+                if cached:
+                    # Otra petición idéntica terminó mientras esta esperaba en la cola
+                    files, message = cached
+                    return files, f"{message} (sin cambios, enlaces reutilizados)"
                 
                 packed_dir = file_service.get_user_directory(user_id, "packed")
                 os.makedirs(packed_dir, exist_ok=True)
                 
                 timestamp = int(time.time())
-                base_filename = f"packed_files_{timestamp}"
+                # Sufijo aleatorio: varios trabajos pueden terminar en el mismo segundo
+                base_filename = f"packed_files_{timestamp}_{uuid.uuid4().hex[:8]}"
+                progress = PackProgress(
+                    sum(os.path.getsize(os.path.join(user_dir, f)) for f in files),
+                    on_progress, cancel_event
+                )
                 
-                if split_size_mb:
+                if split_size_mb and independent:
+                    result = self._create_independent_zips(user_id, user_dir, packed_dir,
+                                                           base_filename, split_size_mb, files,
+                                                           compress, progress)
+                elif split_size_mb:
                     # Crear ZIP y luego dividirlo en partes válidas
                     result = self._create_and_split_zip(user_id, user_dir, packed_dir, 
-                                                       base_filename, split_size_mb, files)
+                                                       base_filename, split_size_mb, files, compress,
+                                                       progress)
                 else:
-                    # Crear un único archivo ZIP
-                    result = self._pack_single_zip(user_id, user_dir, packed_dir, 
-                                                  base_filename, files)
+                    # Reutilizar el último ZIP si solo hay archivos nuevos; si no, crear uno
+                    result = None
+                    if not compress:
+                        result = self._append_to_previous_zip(user_id, user_dir, packed_dir, files,
+                                                              progress)
+                    if result is None:
+                        result = self._pack_single_zip(user_id, user_dir, packed_dir, 
+                                                      base_filename, files, compress, progress)
                 
+                progress.finish()
+                if result[0] and fingerprint:
+                    file_service.set_cached_pack(user_id, fingerprint, result)
                 return result
                 
             finally:
                 load_manager.finish_process()
                 
+        except PackCancelled:
+            logger.info(f"Empaquetado cancelado por el usuario {user_id}")
+            return None, "Empaquetado cancelado"
         except Exception as e:
-            load_manager.finish_process()
             logger.error(f"Error en empaquetado avanzado: {e}")
             return None, f"Error al empaquetar: {str(e)}"
     
-    def _pack_single_zip(self, user_id, user_dir, packed_dir, base_filename, files):
-        """Crea un único archivo ZIP sin compresión"""
+    def _list_sources(self, user_dir):
+        """Archivos de descargas a empaquetar (vacío si la carpeta no existe)"""
+        if not os.path.exists(user_dir):
+            return []
+        return [f for f in os.listdir(user_dir) 
+                if os.path.isfile(os.path.join(user_dir, f))]
+    
+    def _fingerprint(self, user_dir, files, split_size_mb, compress, independent):
+        """
+        Huella del conjunto de origen (nombres, tamaños y mtimes de las
+        descargas) y de las opciones del empaquetado; None si no hay archivos.
+        """
+        if not files:
+            return None
+        entries = []
+        for filename in files:
+            try:
+                stat = os.stat(os.path.join(user_dir, filename))
+            except OSError:
+                return None
+            entries.append(f"{filename}\0{stat.st_size}\0{stat.st_mtime_ns}")
+        digest = hashlib.sha256()
+        digest.update(f"{split_size_mb or 0}:{int(compress)}:{int(bool(split_size_mb and independent))}\n".encode())
+        for line in sorted(entries):
+            digest.update(line.encode('utf-8', 'surrogateescape') + b'\n')
+        return digest.hexdigest()
+    
+    def _collect_members(self, user_id, user_dir, files, progress=None):
+        """
+        (nombre, ruta, crc32) de cada archivo. El CRC sale de la metadata
+        (calculado al recibir el archivo); los que falten o hayan cambiado se
+        calculan en paralelo en un pool de procesos y se guardan para la
+        próxima vez, así que volver a empaquetar es solo E/S.
+        """
+        members = []
+        missing = []
+        for filename in files:
+            file_path = os.path.join(user_dir, filename)
+            crc = file_service.get_cached_crc(user_id, filename, "downloads", os.stat(file_path))
+            member = [filename, file_path, crc]
+            members.append(member)
+            if crc is None:
+                missing.append(member)
+        
+        if missing:
+            logger.info(f"Calculando CRC32 de {len(missing)} archivo(s) sin caché...")
+            pool = shared_process_pool()
+            for member, crc in zip(missing, pool.map(file_crc32, [m[1] for m in missing])):
+                member[2] = crc
+                if progress:
+                    progress.advance(0)
+                file_service.set_file_checksum(user_id, member[0], "downloads", crc, member[1])
+        
+        return [tuple(member) for member in members]
+    
+    def _should_compress(self, file_path, size):
+        """Comprimir solo si no es un formato ya comprimido y una muestra se reduce"""
+        if size < 512:
+            return False
+        with open(file_path, 'rb') as f:
+            head = f.read(65536)
+        if looks_compressed(head):
+            return False
+        return len(zlib.compress(head, 1)) < len(head) * 0.9
+    
+    def _write_zip(self, members, out, compress, progress=None, pool=None):
+        """
+        Escribe el ZIP de members en out. En modo comprimido, los bloques de
+        todos los miembros comprimibles se desinflan en paralelo en un pool
+        de procesos (pool, o el compartido) y se escriben en orden; devuelve
+        estadísticas de compresión (o None en modo STORED). Con progress,
+        el avance se mide en bytes de origen procesados.
+        """
+        if compress and pool is None:
+            pool = shared_process_pool()
+        
+        if progress:
+            out = ProgressWriter(out, progress)
+        
+        if not compress:
+            zip_stream_service.write_archive(zip_stream_service.build_layout(members), out)
+            return None
+        
+        start = time.time()
+        block_size = PACK_DEFLATE_BLOCK_MB * 1024 * 1024
+        plan = []
+        tasks = []
+        for name, file_path, crc in members:
+            size = os.path.getsize(file_path)
+            blocks = 0
+            if self._should_compress(file_path, size):
+                blocks = max(1, math.ceil(size / block_size))
+                tasks.extend(
+                    (file_path, i * block_size, min(block_size, size - i * block_size),
+                     PACK_DEFLATE_LEVEL, i == blocks - 1)
+                    for i in range(blocks)
+                )
+            plan.append(blocks)
+        
+        def _member_blocks(index, entry):
+            if not plan[index]:
+                return None
+            blocks = deflater.blocks(plan[index])
+            if not progress:
+                return blocks
+            return self._track_deflated(blocks, entry["size"], block_size, progress)
+        
+        deflater = ParallelDeflater(pool, tasks, PACK_COMPRESS_WORKERS * 2)
+        original, written = zip_stream_service.write_archive_sequential(
+            members, out, _member_blocks
+        )
+        
+        elapsed = max(time.time() - start, 1e-6)
+        stats = {
+            'original_bytes': original,
+            'written_bytes': written,
+            'ratio': written / original if original else 1.0,
+            'throughput': original / elapsed,
+            'compressed_files': sum(1 for blocks in plan if blocks)
+        }
+        logger.info(f"ZIP comprimido: {stats['compressed_files']}/{len(members)} miembros con DEFLATE, "
+                    f"{stats['ratio']*100:.1f}% del original, {stats['throughput']/(1024*1024):.1f} MB/s")
+        return stats
+    
+    def _track_deflated(self, blocks, size, block_size, progress):
+        """
+        Completa el progreso de un miembro comprimido: ProgressWriter ya
+        cuenta los bytes escritos, aquí se suma lo que ahorró la compresión
+        para que el avance refleje los bytes de origen.
+        """
+        remaining = size
+        for block in blocks:
+            consumed = min(block_size, remaining)
+            remaining -= consumed
+            yield block
+            progress.advance(max(0, consumed - len(block)))
+    
+    def _pack_single_zip(self, user_id, user_dir, packed_dir, base_filename, files, compress=False,
+                         progress=None):
+        """Crea un único archivo ZIP (sin compresión salvo que se pida)"""
         output_file = os.path.join(packed_dir, f"{base_filename}.zip")
         
         try:
             logger.info(f"Creando ZIP con {len(files)} archivos...")
             
-            with zipfile.ZipFile(output_file, 'w', compression=zipfile.ZIP_STORED) as zipf:
-                for filename in files:
-                    file_path = os.path.join(user_dir, filename)
-                    try:
-                        zipf.write(file_path, filename)
-                        logger.debug(f"Agregado: {filename}")
-                    except Exception as e:
-                        logger.error(f"Error agregando {filename}: {e}")
-                        continue
+            members = self._collect_members(user_id, user_dir, files, progress)
+            with open(output_file, 'wb') as out:
+                stats = self._write_zip(members, out, compress, progress)
             
+            storage_usage.file_added(output_file)
             file_size = os.path.getsize(output_file)
             size_mb = file_size / (1024 * 1024)
             
@@ -88,7 +472,8 @@ class AdvancedPackingService:
                 'filename': f"{base_filename}.zip",
                 'url': download_url,
                 'size_mb': size_mb,
-                'total_files': len(files)
+                'total_files': len(files),
+                'compression': stats
             }], f"Empaquetado completado: {len(files)} archivos, {size_mb:.1f}MB"
             
         except Exception as e:
@@ -97,92 +482,132 @@ class AdvancedPackingService:
             logger.error(f"Error en ZIP simple: {e}")
             raise e
     
+    def _find_appendable_zip(self, packed_dir, members):
+        """
+        ZIP previo (el más reciente primero) cuyos miembros siguen todos en
+        downloads sin cambios (mismo nombre, tamaño y CRC). Devuelve
+        (ruta, lista de ZipInfo) o None.
+        """
+        current = {name: (os.path.getsize(path), crc) for name, path, crc in members}
+        candidates = [
+            os.path.join(packed_dir, f) for f in os.listdir(packed_dir)
+            if f.startswith("packed_files_") and f.endswith(".zip")
+        ]
+        candidates.sort(key=os.path.getmtime, reverse=True)
+        
+        for zip_path in candidates:
+            try:
+                with zipfile.ZipFile(zip_path) as zipf:
+                    infos = zipf.infolist()
+            except (zipfile.BadZipFile, OSError):
+                continue
+            if infos and all(
+                info.compress_type == zipfile.ZIP_STORED
+                and current.get(info.filename) == (info.file_size, info.CRC)
+                for info in infos
+            ):
+                return zip_path, infos
+        return None
+    
+    def _append_to_previous_zip(self, user_id, user_dir, packed_dir, files, progress=None):
+        """
+        Re-empaquetado incremental: añade al ZIP anterior solo los archivos
+        nuevos y escribe un directorio central actualizado al final. Los
+        bytes existentes no se modifican (el directorio central antiguo
+        queda como relleno), así que una descarga en curso del ZIP anterior
+        sigue recibiendo un archivo válido. Devuelve None si no hay un ZIP
+        reutilizable.
+        """
+        members = self._collect_members(user_id, user_dir, files, progress)
+        found = self._find_appendable_zip(packed_dir, members)
+        if not found:
+            return None
+        
+        zip_path, infos = found
+        zip_filename = os.path.basename(zip_path)
+        packed_names = {info.filename for info in infos}
+        new_members = [member for member in members if member[0] not in packed_names]
+        old_size = os.path.getsize(zip_path)
+        
+        if new_members:
+            logger.info(f"Re-empaquetado incremental de {zip_filename}: {len(new_members)} archivo(s) nuevo(s)")
+            existing = [zip_stream_service.entry_from_zipinfo(info) for info in infos]
+            layout = zip_stream_service.build_layout(new_members, old_size, existing)
+            if progress:
+                # Solo se escriben los archivos nuevos
+                progress.total = sum(os.path.getsize(path) for _, path, _ in new_members)
+            try:
+                with open(zip_path, 'ab') as out:
+                    zip_stream_service.write_archive(
+                        layout, ProgressWriter(out, progress) if progress else out
+                    )
+            except Exception:
+                # Dejar el ZIP anterior intacto
+                os.truncate(zip_path, old_size)
+                raise
+            storage_usage.file_removed(zip_path, old_size)
+            storage_usage.file_added(zip_path)
+        
+        size_mb = os.path.getsize(zip_path) / (1024 * 1024)
+        packed_file = next((f for f in file_service.list_user_files(user_id, "packed")
+                            if f['stored_name'] == zip_filename), None)
+        if packed_file:
+            file_num = packed_file['number']
+        else:
+            file_num = file_service.register_file(user_id, zip_filename, zip_filename, "packed")
+        
+        return [{
+            'number': file_num,
+            'filename': zip_filename,
+            'url': file_service.create_packed_url(user_id, zip_filename),
+            'size_mb': size_mb,
+            'total_files': len(members)
+        }], (f"Empaquetado actualizado: {len(new_members)} archivo(s) nuevo(s), "
+             f"{len(members)} en total, {size_mb:.1f}MB")
+    
     def _create_and_split_zip(self, user_id, user_dir, packed_dir, base_filename, 
-                             split_size_mb, files):
-        """Crea un ZIP válido y lo divide en partes que se pueden unir y extraer"""
+                             split_size_mb, files, compress=False, progress=None):
+        """Escribe el ZIP directamente en partes que se pueden unir y extraer"""
         split_size_bytes = min(split_size_mb, self.max_part_size_mb) * 1024 * 1024
+        writer = SplitVolumeWriter(packed_dir, base_filename, split_size_bytes, 1024 * 1024)
         
         try:
-            # PASO 1: Crear el archivo ZIP temporal (VÁLIDO)
-            temp_zip_path = os.path.join(packed_dir, f"temp_{base_filename}.zip")
+            logger.info(f"Creando ZIP en partes de {split_size_bytes/(1024*1024):.0f}MB con {len(files)} archivos...")
             
-            logger.info(f"Creando ZIP temporal con {len(files)} archivos...")
+            members = self._collect_members(user_id, user_dir, files, progress)
+            stats = self._write_zip(members, writer, compress, progress)
+            writer.close()
             
-            with zipfile.ZipFile(temp_zip_path, 'w', compression=zipfile.ZIP_STORED) as zipf:
-                for filename in files:
-                    file_path = os.path.join(user_dir, filename)
-                    try:
-                        zipf.write(file_path, filename)
-                        logger.debug(f"Agregado al ZIP: {filename}")
-                    except Exception as e:
-                        logger.error(f"Error agregando {filename} al ZIP: {e}")
-                        continue
-            
-            zip_size = os.path.getsize(temp_zip_path)
-            logger.info(f"ZIP creado: {temp_zip_path} ({zip_size/(1024*1024):.2f}MB)")
-            
-            # PASO 2: Dividir el archivo ZIP en partes (MÉTODO SEGURO)
             part_files_result = []
             parts_info = []
-            part_num = 1
-            
-            with open(temp_zip_path, 'rb') as zip_file:
-                while True:
-                    # Crear nombre de parte (.001, .002, etc.)
-                    part_filename = f"{base_filename}.zip.{part_num:03d}"
-                    part_path = os.path.join(packed_dir, part_filename)
-                    
-                    # Leer exactamente split_size_bytes o lo que quede
-                    chunk = zip_file.read(split_size_bytes)
-                    if not chunk:
-                        break
-                    
-                    # Escribir la parte
-                    with open(part_path, 'wb') as part_file:
-                        part_file.write(chunk)
-                    
-                    part_size = len(chunk)
-                    part_size_mb = part_size / (1024 * 1024)
-                    
-                    # Registrar la parte
-                    file_num = file_service.register_file(user_id, part_filename, part_filename, "packed")
-                    download_url = file_service.create_packed_url(user_id, part_filename)
-                    
-                    parts_info.append((part_filename, part_size, download_url))
-                    
-                    part_files_result.append({
-                        'number': file_num,
-                        'filename': part_filename,
-                        'url': download_url,
-                        'size_mb': part_size_mb,
-                        'total_files': len(files) if part_num == 1 else 0
-                    })
-                    
-                    logger.info(f"Parte {part_num} creada: {part_filename} ({part_size_mb:.2f}MB)")
-                    part_num += 1
-            
-            # PASO 3: Eliminar el archivo ZIP temporal
-            os.remove(temp_zip_path)
-            logger.info(f"Archivo temporal eliminado: {temp_zip_path}")
-            
-            # PASO 4: Crear archivo .txt con lista de enlaces
-            self._create_parts_list_file(user_id, packed_dir, base_filename, parts_info, len(files))
+            for part_num, (part_filename, part_size, part_sha256) in enumerate(writer.parts, 1):
+                storage_usage.file_added(os.path.join(packed_dir, part_filename))
+                part_size_mb = part_size / (1024 * 1024)
+                
+                # Registrar la parte
+                file_num = file_service.register_file(user_id, part_filename, part_filename, "packed")
+                download_url = file_service.create_packed_url(user_id, part_filename)
+                
+                parts_info.append((part_filename, part_size, download_url, part_sha256))
+                
+                part_files_result.append({
+                    'number': file_num,
+                    'filename': part_filename,
+                    'url': download_url,
+                    'size_mb': part_size_mb,
+                    'total_files': len(files) if part_num == 1 else 0,
+                    'compression': stats if part_num == 1 else None
+                })
+                
+                logger.info(f"Parte {part_num} creada: {part_filename} ({part_size_mb:.2f}MB)")
             
-            # PASO 5: Verificar que el primer archivo sea un ZIP válido
-            # (opcional pero recomendado para debugging)
-            if part_files_result:
-                first_part = os.path.join(packed_dir, part_files_result[0]['filename'])
-                if os.path.exists(first_part):
-                    try:
-                        # Intentar leer el primer archivo como ZIP
-                        with zipfile.ZipFile(first_part, 'r') as test_zip:
-                            # Solo verificar que se pueda abrir
-                            test_files = test_zip.namelist()
-                            logger.info(f"Primera parte es ZIP válido: {len(test_files)} archivos listados")
-                    except zipfile.BadZipFile:
-                        logger.warning("La primera parte NO es un ZIP válido. Puede necesitar unión completa.")
-                    except Exception as e:
-                        logger.warning(f"No se pudo verificar ZIP: {e}")
+            # Crear archivo .txt con lista de enlaces
+            part_files_result[0]['list_filename'] = self._create_parts_list_file(
+                user_id, packed_dir, base_filename, parts_info, len(files)
+            )
+            part_files_result[0].update(
+                self._create_parts_manifests(user_id, packed_dir, base_filename, parts_info, len(files))
+            )
             
             total_size_mb = sum(part['size_mb'] for part in part_files_result)
             
@@ -191,27 +616,177 @@ class AdvancedPackingService:
             
         except Exception as e:
             logger.error(f"Error en creación y división de ZIP: {e}", exc_info=True)
-            # Limpiar archivos en caso de error
-            temp_zip_path = os.path.join(packed_dir, f"temp_{base_filename}.zip")
-            if os.path.exists(temp_zip_path):
+            # Limpiar partes parciales (aún no contabilizadas ni registradas)
+            writer.close()
+            for part_path in writer.part_paths():
                 try:
-                    os.remove(temp_zip_path)
-                except:
+                    os.remove(part_path)
+                except OSError:
                     pass
             
-            # Limpiar partes parciales
-            for part_num in range(1, 100):
-                part_filename = f"{base_filename}.zip.{part_num:03d}"
-                part_path = os.path.join(packed_dir, part_filename)
-                if os.path.exists(part_path):
+            raise e
+    
+    def _estimated_member_size(self, file_path, size, compress):
+        """
+        Bytes que ocupará el miembro dentro del ZIP: el tamaño real si se
+        guarda en STORED y, si se va a desinflar, una estimación con margen
+        a partir de muestras repartidas por el archivo. Una estimación corta
+        no rompe nada: el volumen simplemente se trocea al escribirlo.
+        """
+        if not compress or not self._should_compress(file_path, size):
+            return size
+        sampled = compressed = 0
+        with open(file_path, 'rb') as f:
+            for i in range(VOLUME_ESTIMATE_SAMPLES):
+                f.seek(size * i // VOLUME_ESTIMATE_SAMPLES)
+                data = f.read(65536)
+                sampled += len(data)
+                compressed += len(zlib.compress(data, PACK_DEFLATE_LEVEL))
+        ratio = compressed / sampled if sampled else 1.0
+        # DEFLATE puede crecer un poco con datos incompresibles
+        return min(size + size // 1000 + 64, int(size * ratio * 1.1) + 64)
+    
+    def _plan_volumes(self, members, part_size, compress):
+        """
+        Reparte los miembros en volúmenes ZIP independientes de como mucho
+        part_size bytes. First-fit decreasing fija el número de volúmenes y
+        después se reparten por carga (el más grande al volumen más vacío)
+        para que queden de tamaño parecido, si así siguen cabiendo.
+        En modo comprimido se planifica con el tamaño comprimido estimado.
+        Devuelve (volúmenes, miembros que no caben solos en una parte).
+        """
+        def _cost(member):
+            size = self._estimated_member_size(member[1], os.path.getsize(member[1]), compress)
+            return size + VOLUME_ENTRY_OVERHEAD + 2 * len(member[0].encode('utf-8'))
+        
+        items = sorted(((_cost(m), m) for m in members), key=lambda item: item[0], reverse=True)
+        capacity = part_size - VOLUME_ARCHIVE_OVERHEAD
+        oversized = [m for cost, m in items if cost > capacity]
+        items = [(cost, m) for cost, m in items if cost <= capacity]
+        
+        first_fit = []
+        for cost, member in items:
+            for volume in first_fit:
+                if volume[0] + cost <= capacity:
+                    volume[0] += cost
+                    volume[1].append(member)
+                    break
+            else:
+                first_fit.append([cost, [member]])
+        
+        balanced = [[0, []] for _ in first_fit]
+        for cost, member in items:
+            volume = min(balanced, key=lambda v: v[0])
+            volume[0] += cost
+            volume[1].append(member)
+        volumes = balanced if all(v[0] <= capacity for v in balanced) else first_fit
+        
+        return [sorted(v[1]) for v in volumes], oversized
+    
+    def _create_independent_zips(self, user_id, user_dir, packed_dir, base_filename,
+                                 split_size_mb, files, compress=False, progress=None):
+        """
+        Divide en varios ZIP completos (cada uno se descarga y extrae por
+        separado) de como mucho split_size_mb, escritos en paralelo. Solo
+        un volumen que no cabe en una parte (un archivo demasiado grande o
+        una compresión peor que la estimada) se trocea en .zip.001, .002...
+        """
+        part_size = min(split_size_mb, self.max_part_size_mb) * 1024 * 1024
+        members = self._collect_members(user_id, user_dir, files, progress)
+        volumes, oversized = self._plan_volumes(members, part_size, compress)
+        jobs = volumes + [[member] for member in oversized]
+        
+        logger.info(f"Creando {len(jobs)} ZIP independientes de hasta {part_size/(1024*1024):.0f}MB "
+                    f"con {len(files)} archivos ({len(oversized)} troceado(s))...")
+        
+        def _write_volume(index, vol_members, pool):
+            volume_base = f"{base_filename}_vol{index:02d}"
+            writer = SplitVolumeWriter(packed_dir, volume_base, part_size, 1024 * 1024)
+            try:
+                stats = self._write_zip(vol_members, writer, compress, progress, pool)
+            finally:
+                writer.close()
+            if len(writer.parts) == 1:
+                # Cabe en una parte: es un ZIP normal, sin sufijo de troceado
+                volume_filename = f"{volume_base}.zip"
+                os.replace(os.path.join(packed_dir, writer.parts[0][0]),
+                           os.path.join(packed_dir, volume_filename))
+                writer.parts[0][0] = volume_filename
+            return writer.parts, stats
+        
+        start = time.time()
+        deflate_pool = shared_process_pool() if compress else None
+        try:
+            with ThreadPoolExecutor(max_workers=PACK_VOLUME_WORKERS) as executor:
+                futures = [
+                    executor.submit(_write_volume, index, vol_members, deflate_pool)
+                    for index, vol_members in enumerate(jobs, 1)
+                ]
+                try:
+                    written = [future.result() for future in futures]
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        except BaseException as e:
+            if not isinstance(e, PackCancelled):
+                logger.error(f"Error creando ZIP independientes: {e}", exc_info=True)
+            # Limpiar volúmenes parciales (aún no contabilizados ni registrados)
+            prefix = f"{base_filename}_vol"
+            for filename in os.listdir(packed_dir):
+                if filename.startswith(prefix):
                     try:
-                        os.remove(part_path)
-                    except:
+                        os.remove(os.path.join(packed_dir, filename))
+                    except OSError:
                         pass
-            
-            raise e
+            raise
+        
+        stats = None
+        if compress:
+            original = sum(s['original_bytes'] for _, s in written)
+            written_bytes = sum(s['written_bytes'] for _, s in written)
+            stats = {
+                'original_bytes': original,
+                'written_bytes': written_bytes,
+                'ratio': written_bytes / original if original else 1.0,
+                'throughput': original / max(time.time() - start, 1e-6),
+                'compressed_files': sum(s['compressed_files'] for _, s in written)
+            }
+        
+        part_files_result = []
+        parts_info = []
+        for parts, _ in written:
+            for part_filename, part_size_bytes, part_sha256 in parts:
+                storage_usage.file_added(os.path.join(packed_dir, part_filename))
+                file_num = file_service.register_file(user_id, part_filename, part_filename, "packed")
+                download_url = file_service.create_packed_url(user_id, part_filename)
+                parts_info.append((part_filename, part_size_bytes, download_url, part_sha256))
+                part_files_result.append({
+                    'number': file_num,
+                    'filename': part_filename,
+                    'url': download_url,
+                    'size_mb': part_size_bytes / (1024 * 1024),
+                    'total_files': 0,
+                    'compression': None
+                })
+        
+        part_files_result[0]['total_files'] = len(files)
+        part_files_result[0]['compression'] = stats
+        part_files_result[0]['list_filename'] = self._create_parts_list_file(
+            user_id, packed_dir, base_filename, parts_info, len(files),
+            note="Cada .zip se extrae por separado; solo las partes .zip.001, .002... "
+                 "de un mismo volumen hay que unirlas antes."
+        )
+        part_files_result[0].update(
+            self._create_parts_manifests(user_id, packed_dir, base_filename, parts_info, len(files))
+        )
+        
+        total_size_mb = sum(part['size_mb'] for part in part_files_result)
+        return part_files_result, (f"✅ Empaquetado completado: {len(jobs)} ZIP independientes, "
+                                   f"{len(files)} archivos, {total_size_mb:.1f}MB total")
     
-    def _create_parts_list_file(self, user_id, packed_dir, base_filename, parts_info, total_files):
+    def _create_parts_list_file(self, user_id, packed_dir, base_filename, parts_info, total_files,
+                                note=None):
         """Crea archivo .txt con lista de enlaces"""
         list_filename = f"{base_filename}.txt"
         list_path = os.path.join(packed_dir, list_filename)
@@ -222,14 +797,17 @@ class AdvancedPackingService:
                 f.write(f"Lista de partes para: {base_filename}\n")
                 f.write(f"Total archivos originales: {total_files}\n")
                 f.write(f"Partes generadas: {len(parts_info)}\n")
+                if note:
+                    f.write(f"{note}\n")
                 f.write("=" * 50 + "\n\n")
                 
                 # Listar cada parte con su enlace
-                for i, (part_filename, part_size, part_url) in enumerate(parts_info, 1):
+                for i, (part_filename, part_size, part_url, _) in enumerate(parts_info, 1):
                     part_size_mb = part_size / (1024 * 1024)
                     f.write(f"Parte {i:03d}: {part_filename}\n")
                     f.write(f"Tamaño: {part_size_mb:.2f} MB\n")
                     f.write(f"Enlace: {part_url}\n\n")
+            storage_usage.file_added(list_path)
             
             # Registrar archivo de lista en el sistema
             file_service.register_file(user_id, list_filename, list_filename, "packed")
@@ -241,6 +819,58 @@ class AdvancedPackingService:
             logger.error(f"Error creando archivo de lista: {e}")
             return None
     
+    def _create_parts_manifests(self, user_id, packed_dir, base_filename, parts_info, total_files):
+        """
+        Crea los manifiestos legibles por máquina de las partes: JSON y
+        Metalink 4 (RFC 5854, p. ej. aria2c -M) con URL, tamaño y SHA-256
+        de cada una. En el JSON, 'archive' indica el ZIP al que pertenece
+        cada parte: las partes con el mismo archive se concatenan en orden.
+        Devuelve los nombres generados.
+        """
+        parts = [{
+            'filename': part_filename,
+            'archive': re.sub(r'\.\d{3}$', '', part_filename),
+            'size': part_size,
+            'sha256': part_sha256,
+            'url': part_url
+        } for part_filename, part_size, part_url, part_sha256 in parts_info]
+        
+        manifest_filename = f"{base_filename}.json"
+        metalink_filename = f"{base_filename}.meta4"
+        created = {}
+        try:
+            manifest_path = os.path.join(packed_dir, manifest_filename)
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'name': base_filename,
+                    'created_at': int(time.time()),
+                    'total_files': total_files,
+                    'total_size': sum(part['size'] for part in parts),
+                    'parts': parts
+                }, f, ensure_ascii=False, indent=2)
+            
+            metalink = ET.Element('metalink', xmlns='urn:ietf:params:xml:ns:metalink')
+            ET.SubElement(metalink, 'generator').text = 'file2link'
+            ET.SubElement(metalink, 'published').text = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            for part in parts:
+                file_element = ET.SubElement(metalink, 'file', name=part['filename'])
+                ET.SubElement(file_element, 'size').text = str(part['size'])
+                ET.SubElement(file_element, 'hash', type='sha-256').text = part['sha256']
+                ET.SubElement(file_element, 'url').text = part['url']
+            metalink_path = os.path.join(packed_dir, metalink_filename)
+            ET.ElementTree(metalink).write(metalink_path, encoding='UTF-8', xml_declaration=True)
+            
+            for key, filename in (('manifest_filename', manifest_filename),
+                                  ('metalink_filename', metalink_filename)):
+                storage_usage.file_added(os.path.join(packed_dir, filename))
+                file_service.register_file(user_id, filename, filename, "packed")
+                created[key] = filename
+            
+            logger.info(f"Manifiestos creados: {manifest_filename}, {metalink_filename} ({len(parts)} partes)")
+        except Exception as e:
+            logger.error(f"Error creando manifiestos de partes: {e}")
+        return created
+    
     def clear_packed_folder(self, user_id):
         """Elimina todos los archivos empaquetados del usuario"""
         try:
@@ -257,8 +887,9 @@ class AdvancedPackingService:
             for filename in files:
                 file_path = os.path.join(packed_dir, filename)
                 if os.path.isfile(file_path):
-                    os.remove(file_path)
+                    storage_usage.remove_file(file_path)
                     deleted_count += 1
+            file_service.invalidate_pack_cache(user_id)
             
             return True, f"Se eliminaron {deleted_count} archivos empaquetados"
             
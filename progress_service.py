@@ -1,11 +1,152 @@
+import asyncio
 import logging
 import sys
 import time
+from collections import OrderedDict
+from pyrogram.errors import FloodWait, MessageNotModified
 from file_service import file_service
+from config import PROGRESS_EDITS_PER_SECOND, PROGRESS_CHAT_EDIT_INTERVAL, PROGRESS_STATE_TTL
 
 logger = logging.getLogger(__name__)
 
 class ProgressService:
+    def __init__(self):
+        # Despachador de ediciones: (chat_id, message_id) -> última actualización pendiente
+        self.pending = OrderedDict()
+        self.last_text = {}
+        self.locks = {}
+        # Última actividad de cada mensaje: los abandonados (error, cancelación)
+        # nunca pasan por finish_edit y se descartan tras PROGRESS_STATE_TTL
+        self.last_activity = {}
+        self.next_eviction = 0.0
+        # Mensajes ya cerrados con finish_edit (clave -> instante) para descartar envíos tardíos
+        self.finished = {}
+        self.chat_next_edit = {}
+        self.global_interval = 1.0 / PROGRESS_EDITS_PER_SECOND
+        self.global_next_edit = 0.0
+        self.wakeup = None
+        self.dispatcher = None
+
+    def _key(self, message):
+        return message.chat.id, message.id
+
+    def schedule_edit(self, message, text, **kwargs):
+        """
+        Programa la edición de un mensaje de progreso sin esperar a Telegram.
+        Las actualizaciones del mismo mensaje se fusionan: solo se envía la
+        más reciente, respetando el presupuesto global y por chat. Debe
+        llamarse desde el loop del bot.
+        """
+        key = self._key(message)
+        if key in self.finished:
+            return
+        now = time.time()
+        self.last_activity[key] = now
+        self._evict_idle(now)
+        if key not in self.pending and self.last_text.get(key) == text:
+            return
+        self.pending[key] = (message, text, kwargs)
+        if self.dispatcher is None:
+            self.wakeup = asyncio.Event()
+            self.dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        self.wakeup.set()
+
+    async def finish_edit(self, message, text, **kwargs):
+        """
+        Edición final (resultado, error): descarta las actualizaciones
+        pendientes del mensaje y se envía de inmediato, después de cualquier
+        edición en curso, para que nunca quede pisada por un progreso antiguo.
+        """
+        key = self._key(message)
+        self.pending.pop(key, None)
+        now = time.time()
+        for old_key in [k for k, t in self.finished.items() if now - t > 300]:
+            del self.finished[old_key]
+        self.finished[key] = now
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                await message.edit_text(text, **kwargs)
+        finally:
+            self.last_text.pop(key, None)
+            self.locks.pop(key, None)
+            self.last_activity.pop(key, None)
+            self.chat_next_edit[key[0]] = time.time() + PROGRESS_CHAT_EDIT_INTERVAL
+
+    def _evict_idle(self, now):
+        """Descarta (como mucho una vez por minuto) el estado de mensajes inactivos"""
+        if now < self.next_eviction:
+            return
+        self.next_eviction = now + 60
+        for key in [k for k, t in self.last_activity.items() if now - t > PROGRESS_STATE_TTL]:
+            lock = self.locks.get(key)
+            if key in self.pending or (lock and lock.locked()):
+                continue
+            del self.last_activity[key]
+            self.last_text.pop(key, None)
+            self.locks.pop(key, None)
+        for chat_id in [c for c, t in self.chat_next_edit.items() if now - t > PROGRESS_STATE_TTL]:
+            del self.chat_next_edit[chat_id]
+
+    def _next_ready(self, now):
+        """Primera actualización cuyo chat tiene presupuesto, o el instante en que lo tendrá"""
+        earliest = None
+        for key in self.pending:
+            allowed_at = self.chat_next_edit.get(key[0], 0.0)
+            if allowed_at <= now:
+                return key, None
+            earliest = allowed_at if earliest is None else min(earliest, allowed_at)
+        return None, earliest
+
+    async def _dispatch(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            now = time.time()
+            if self.global_next_edit > now:
+                await asyncio.sleep(self.global_next_edit - now)
+                continue
+
+            key, earliest = self._next_ready(now)
+            if key is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=max(earliest - now, 0.01))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            message, text, kwargs = self.pending.pop(key)
+            if self.last_text.get(key) == text:
+                continue
+            self.global_next_edit = now + self.global_interval
+            self.chat_next_edit[key[0]] = now + PROGRESS_CHAT_EDIT_INTERVAL
+            asyncio.create_task(self._send(key, message, text, kwargs))
+
+    async def _send(self, key, message, text, kwargs):
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key in self.finished:
+                return
+            self.last_activity[key] = time.time()
+            try:
+                await message.edit_text(text, **kwargs)
+                self.last_text[key] = text
+            except MessageNotModified:
+                self.last_text[key] = text
+            except FloodWait as e:
+                logger.warning(f"FloodWait editando progreso: pausa de {e.value}s")
+                self.chat_next_edit[key[0]] = time.time() + e.value
+                self.global_next_edit = max(self.global_next_edit, time.time() + 1)
+                # Reintentar después, salvo que ya haya una actualización más reciente
+                self.pending.setdefault(key, (message, text, kwargs))
+                self.wakeup.set()
+            except Exception as e:
+                logger.debug(f"No se pudo editar el progreso: {e}")
+
     def create_progress_bar(self, current, total, bar_length=15):
         """Crea una barra de progreso visual en una sola línea"""
         if total == 0:
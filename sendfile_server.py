@@ -0,0 +1,78 @@
+import logging
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler, make_server
+
+logger = logging.getLogger(__name__)
+
+# Marca en el environ WSGI: el servidor transmite los file wrappers con sendfile
+SENDFILE_ENVIRON_KEY = "file2link.sendfile"
+
+
+class SendfileServerHandler(ServerHandler):
+    """ServerHandler que entrega los archivos al kernel con os.sendfile"""
+
+    def sendfile(self):
+        filelike = getattr(self.result, "filelike", None)
+        if filelike is None or not hasattr(filelike, "fileno"):
+            return False
+
+        if not self.headers_sent:
+            self.bytes_sent = 0
+            self.send_headers()
+
+        content_length = self.headers.get("Content-Length")
+        count = int(content_length) if content_length else None
+
+        # socket.sendfile usa os.sendfile y cae a send() por bloques si no está disponible
+        connection = self.request_handler.connection
+        self.bytes_sent = connection.sendfile(filelike, filelike.tell(), count)
+        return True
+
+
+class SendfileRequestHandler(WSGIRequestHandler):
+    def get_environ(self):
+        environ = super().get_environ()
+        environ[SENDFILE_ENVIRON_KEY] = True
+        return environ
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def handle(self):
+        """Igual que WSGIRequestHandler.handle pero con SendfileServerHandler"""
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+
+        if not self.parse_request():
+            return
+
+        handler = SendfileServerHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=True,
+        )
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class ThreadingSendfileServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def serve_sendfile(app, host, port):
+    """
+    Sirve la app WSGI transmitiendo las descargas con sendfile (zero-copy).
+    Es un servidor wsgiref: responde en HTTP/1.0, cierra la conexión tras
+    cada petición y abre un hilo por conexión sin límite.
+    """
+    server = make_server(host, port, app,
+                         server_class=ThreadingSendfileServer,
+                         handler_class=SendfileRequestHandler)
+    logger.info(f"Servidor sendfile escuchando en {host}:{port}")
+    logger.warning("Modo sendfile: HTTP/1.0 sin keep-alive ni límite de hilos; "
+                   "usar detrás de un proxy o volver a FILE_SERVING_MODE=waitress")
+    server.serve_forever()
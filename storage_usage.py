@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+import logging
+from config import BASE_DIR, STORAGE_RECONCILE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class StorageUsageService:
+    """
+    Contadores de uso de almacenamiento (bytes y número de archivos) por
+    usuario/carpeta y globales. Se actualizan en cada escritura o borrado (los
+    renombrados no salen de su carpeta) y un escaneo periódico en segundo
+    plano corrige cualquier desvío.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders = {}
+        self.total_bytes = 0
+        self.total_files = 0
+        self.scanned = False
+        self.reconciler = None
+
+    def _folder_key(self, path):
+        """(user_id, carpeta) a partir de una ruta dentro de BASE_DIR"""
+        parts = os.path.relpath(path, BASE_DIR).split(os.sep)
+        if len(parts) >= 3:
+            return parts[0], parts[1]
+        if len(parts) == 2:
+            return parts[0], ""
+        return "", ""
+
+    def _apply(self, key, size, files):
+        with self.lock:
+            usage = self.folders.setdefault(key, {"bytes": 0, "files": 0})
+            usage["bytes"] += size
+            usage["files"] += files
+            self.total_bytes += size
+            self.total_files += files
+
+    def file_added(self, path):
+        """Contabiliza un archivo recién escrito"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self._apply(self._folder_key(path), size, 1)
+
+    def file_removed(self, path, size):
+        """Descuenta un archivo borrado (size debe obtenerse antes del borrado)"""
+        self._apply(self._folder_key(path), -size, -1)
+
+    def remove_file(self, path):
+        """Borra un archivo del disco y lo descuenta"""
+        size = os.path.getsize(path)
+        os.remove(path)
+        self.file_removed(path, size)
+
+    def reconcile(self):
+        """Recalcula todos los contadores recorriendo BASE_DIR"""
+        folders = {}
+        total_bytes = 0
+        total_files = 0
+        start = time.time()
+
+        for root, dirs, files in os.walk(BASE_DIR):
+            for file in files:
+                file_path = os.path.join(root, file)
+                try:
+                    size = os.path.getsize(file_path)
+                except OSError:
+                    continue
+                usage = folders.setdefault(self._folder_key(file_path), {"bytes": 0, "files": 0})
+                usage["bytes"] += size
+                usage["files"] += 1
+                total_bytes += size
+                total_files += 1
+
+        with self.lock:
+            drift = total_bytes - self.total_bytes
+            self.folders = folders
+            self.total_bytes = total_bytes
+            self.total_files = total_files
+            was_scanned = self.scanned
+            self.scanned = True
+
+        if was_scanned and drift:
+            logger.info(f"Contabilidad de almacenamiento corregida ({drift:+d} bytes)")
+        logger.debug(f"Escaneo de almacenamiento: {total_files} archivos en {time.time() - start:.2f}s")
+
+    def _ensure_scanned(self):
+        if not self.scanned:
+            self.reconcile()
+
+    def start(self):
+        """Escaneo inicial y reconciliación periódica en segundo plano"""
+        if self.reconciler:
+            return
+
+        def _run():
+            while True:
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    logger.error(f"Error reconciliando uso de almacenamiento: {e}")
+                time.sleep(STORAGE_RECONCILE_INTERVAL)
+
+        self.reconciler = threading.Thread(target=_run, name="storage-reconciler", daemon=True)
+        self.reconciler.start()
+
+    def get_folder_usage(self, user_id, folder):
+        self._ensure_scanned()
+        with self.lock:
+            return dict(self.folders.get((str(user_id), folder), {"bytes": 0, "files": 0}))
+
+    def get_user_usage(self, user_id):
+        """Bytes usados por el usuario en downloads + packed"""
+        return sum(self.get_folder_usage(user_id, folder)["bytes"]
+                   for folder in ("downloads", "packed"))
+
+    def get_totals(self):
+        self._ensure_scanned()
+        with self.lock:
+            return {"total_files": self.total_files, "total_bytes": self.total_bytes}
+
+storage_usage = StorageUsageService()
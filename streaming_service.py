@@ -0,0 +1,209 @@
+import os
+import secrets
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+from config import CHUNK_SIZE, MAX_BYTE_RANGES
+from sendfile_server import SENDFILE_ENVIRON_KEY
+
+logger = logging.getLogger(__name__)
+
+class FileStreamingService:
+    def __init__(self):
+        self.chunk_size = CHUNK_SIZE
+        self.max_ranges = MAX_BYTE_RANGES
+
+    def parse_range(self, header, size):
+        """
+        Interpreta la cabecera Range (RFC 9110).
+
+        Devuelve None si la cabecera no existe o debe ignorarse (sintaxis
+        inválida, demasiados rangos), [] si ningún rango es satisfacible y,
+        en otro caso, la lista ordenada de rangos (inicio, fin) inclusivos
+        con los solapados o contiguos ya fusionados.
+        """
+        if not header or not header.startswith("bytes="):
+            return None
+
+        ranges = []
+        for spec in header[6:].split(","):
+            spec = spec.strip()
+            if not spec:
+                continue
+
+            start_str, sep, end_str = spec.partition("-")
+            if not sep:
+                return None
+
+            try:
+                if start_str == "":
+                    # Sufijo: los últimos N bytes
+                    length = int(end_str)
+                    if length <= 0:
+                        continue
+                    start, end = max(0, size - length), size - 1
+                else:
+                    start = int(start_str)
+                    end = int(end_str) if end_str else size - 1
+                    if start < 0 or (end_str and end < start):
+                        return None
+                    end = min(end, size - 1)
+            except ValueError:
+                return None
+
+            if start >= size:
+                continue
+            ranges.append((start, end))
+
+        if not ranges:
+            return []
+
+        ranges.sort()
+        merged = [ranges[0]]
+        for start, end in ranges[1:]:
+            last_start, last_end = merged[-1]
+            if start <= last_end + 1:
+                merged[-1] = (last_start, max(last_end, end))
+            else:
+                merged.append((start, end))
+
+        if len(merged) > self.max_ranges:
+            return None
+        return merged
+
+    def make_etag(self, stat):
+        """ETag fuerte derivado de (inode, tamaño, mtime)"""
+        return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    def _parse_http_date(self, header):
+        try:
+            return parsedate_to_datetime(header).timestamp()
+        except (TypeError, ValueError):
+            return None
+
+    def is_not_modified(self, etag, mtime):
+        """
+        Evalúa If-None-Match (prioritario) e If-Modified-Since. Con
+        mtime=None (recursos sin fecha fiable) solo vale el ETag.
+        """
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            candidates = [tag.strip() for tag in if_none_match.split(",")]
+            # Comparación débil: W/"x" equivale a "x"
+            return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+        if mtime is None:
+            return False
+        since = self._parse_http_date(request.headers.get("If-Modified-Since"))
+        return since is not None and int(mtime) <= since
+
+    def if_range_matches(self, header, etag, mtime):
+        """
+        If-Range: solo se respeta Range si el validador sigue vigente. Con
+        mtime=None una fecha nunca valida y se responde el recurso completo.
+        """
+        if not header:
+            return True
+        if header.startswith('"'):
+            return header == etag
+        if mtime is None:
+            return False
+        since = self._parse_http_date(header)
+        return since is not None and int(since) == int(mtime)
+
+    def _iter_ranges(self, file_path, ranges):
+        """Lee del disco solo los bytes de los rangos indicados"""
+        with open(file_path, 'rb') as f:
+            for prefix, start, end in ranges:
+                if prefix:
+                    yield prefix
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+    def _iter_multipart(self, file_path, parts, closing):
+        yield from self._iter_ranges(file_path, parts)
+        yield closing
+
+    def build_response(self, file_path, download_name):
+        """
+        Respuesta de descarga con Range, multi-range, If-Range y peticiones
+        condicionales. Las respuestas 304, 416 y HEAD solo cuestan un stat().
+        """
+        stat = os.stat(file_path)
+        size = stat.st_size
+        etag = self.make_etag(stat)
+
+        headers = {
+            "Content-Disposition": f"attachment; filename=\"{download_name}\"",
+            "X-Content-Type-Options": "nosniff",
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        }
+
+        if self.is_not_modified(etag, stat.st_mtime):
+            return Response(status=304, headers=headers)
+
+        ranges = None
+        if self.if_range_matches(request.headers.get("If-Range"), etag, stat.st_mtime):
+            ranges = self.parse_range(request.headers.get("Range"), size)
+
+        if ranges == []:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+
+        content_type = "application/octet-stream"
+        if not ranges:
+            status = 200
+            headers["Content-Length"] = str(size)
+        elif len(ranges) == 1:
+            status = 206
+            start, end = ranges[0]
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+        else:
+            # multipart/byteranges: la longitud total se calcula antes de leer nada
+            status = 206
+            boundary = secrets.token_hex(16)
+            content_type = f"multipart/byteranges; boundary={boundary}"
+            parts = []
+            content_length = 0
+            for start, end in ranges:
+                prefix = (f"\r\n--{boundary}\r\n"
+                          f"Content-Type: application/octet-stream\r\n"
+                          f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("ascii")
+                parts.append((prefix, start, end))
+                content_length += len(prefix) + end - start + 1
+            closing = f"\r\n--{boundary}--\r\n".encode("ascii")
+            content_length += len(closing)
+            headers["Content-Length"] = str(content_length)
+
+        if request.method == "HEAD":
+            return Response(status=status, headers=headers, content_type=content_type)
+
+        if not ranges:
+            f = open(file_path, 'rb')
+            body = wrap_file(request.environ, f, self.chunk_size)
+        elif len(ranges) == 1:
+            if request.environ.get(SENDFILE_ENVIRON_KEY):
+                # El servidor sendfile respeta la posición y Content-Length del archivo
+                f = open(file_path, 'rb')
+                f.seek(start)
+                body = wrap_file(request.environ, f, self.chunk_size)
+            else:
+                body = self._iter_ranges(file_path, [(None, start, end)])
+        else:
+            logger.debug(f"Respuesta multi-range: {len(ranges)} rangos de {os.path.basename(file_path)}")
+            body = self._iter_multipart(file_path, parts, closing)
+
+        return Response(body, status=status, headers=headers, content_type=content_type,
+                        direct_passthrough=True)
+
+streaming_service = FileStreamingService()
@@ -4,7 +4,7 @@ import sys
 from pyrogram import Client, filters
 
 from config import API_ID, API_HASH, BOT_TOKEN
-from telegram_handlers import setup_handlers
+from telegram_handlers import setup_handlers, start_upload_workers
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +34,8 @@ class TelegramBot:
 
             bot_info = await self.client.get_me()
             logger.info(f"Bot iniciado: @{bot_info.username}")
+
+            await start_upload_workers(self.client)
             
             logger.info("El bot está listo y respondiendo a comandos")
 
@@ -2,7 +2,10 @@ import os
 import logging
 import time
 import asyncio
-import concurrent.futures
+import functools
+import shutil
+import weakref
+import contextlib
 
 from pyrogram import Client, filters, enums
 from pyrogram.types import (
@@ -15,9 +18,12 @@ from pyrogram.types import (
 from load_manager import load_manager
 from file_service import file_service
 from progress_service import progress_service
-from packing_service import packing_service
+from pack_jobs import pack_job_runner
 from download_service import fast_download_service
-from config import MAX_FILE_SIZE, MAX_FILE_SIZE_MB
+from storage_usage import storage_usage
+from blob_store import blob_store
+from upload_scheduler import upload_scheduler
+from config import MAX_FILE_SIZE, MAX_FILE_SIZE_MB, ADMISSION_TIMEOUT, COMPRESSION_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
@@ -25,9 +31,6 @@ logger = logging.getLogger(__name__)
 #  ESTADO EN MEMORIA POR USUARIO
 # ─────────────────────────────────────────────
 user_sessions: dict = {}
-user_queues: dict = {}
-user_current_processing: dict = {}
-user_batch_totals: dict = {}
 
 
 def get_session(user_id: int) -> dict:
@@ -36,6 +39,24 @@ def get_session(user_id: int) -> dict:
     return user_sessions[user_id]
 
 
+# Un lock por file_unique_id mientras alguien lo procesa (desaparece solo)
+_media_locks = weakref.WeakValueDictionary()
+
+
+def _media_lock(file_unique_id):
+    """
+    Serializa el procesamiento de un mismo medio: dos reenvíos comparten
+    parcial y checkpoint, y el segundo debe enlazar el resultado del primero.
+    """
+    if not file_unique_id:
+        return contextlib.nullcontext()
+    lock = _media_locks.get(file_unique_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _media_locks[file_unique_id] = lock
+    return lock
+
+
 # ─────────────────────────────────────────────
 #  ESCAPE DE MARKDOWN (evita ENTITY_BOUNDS_INVALID)
 # ─────────────────────────────────────────────
@@ -184,6 +205,10 @@ HELP_TEXT = (
     "/clear — Vaciar carpeta activa\n"
     "/pack — Comprimir descargas en ZIP\n"
     "/pack MB — ZIP dividido en partes\n"
+    "/pack c  o  /pack MB c — ZIP comprimido\n"
+    "/pack MB i — partes como ZIP independientes\n"
+    "/zip — Enlace ZIP instantaneo de descargas\n"
+    "/zip 1 3 5 — ZIP instantaneo de esos archivos\n"
     "/queue — Ver cola de descargas\n"
     "/clearqueue — Cancelar cola\n"
     "/status — Estado del sistema\n\n"
@@ -215,6 +240,7 @@ def _build_status(user_id: int, session: dict) -> str:
     pk = len(file_service.list_user_files(user_id, "packed"))
     mb = file_service.get_user_storage_usage(user_id) / (1024 * 1024)
     s = load_manager.get_status()
+    u = upload_scheduler.get_status()
     icon = "🟢" if s["can_accept_work"] else "🔴"
     return (
         "📊 **Estado del sistema**\n\n"
@@ -228,6 +254,8 @@ def _build_status(user_id: int, session: dict) -> str:
         f"  CPU: {s['cpu_percent']:.1f}%\n"
         f"  Memoria: {s['memory_percent']:.1f}%\n"
         f"  Procesos: {s['active_processes']}/{s['max_processes']}\n"
+        f"  En cola: {s['queue_length']}\n"
+        f"  Subidas: {u['active']} en curso, {u['pending']} en cola\n"
         f"  Estado: {icon} {'Operativo' if s['can_accept_work'] else 'Sobrecargado'}"
     )
 
@@ -449,17 +477,9 @@ async def status_command(client: Client, message: Message):
 async def pack_command(client: Client, message: Message):
     user_id = message.from_user.id
     parts = message.text.split()
-
-    sys_st = load_manager.get_status()
-    if not sys_st["can_accept_work"]:
-        await message.reply_text(
-            "⚠️ **Servidor sobrecargado.**\n\n"
-            f"CPU: {sys_st['cpu_percent']:.1f}%  |  "
-            f"Procesos: {sys_st['active_processes']}\n\n"
-            "Intentalo de nuevo en unos minutos.",
-            reply_markup=kb_main_menu(),
-        )
-        return
+    compress = any(p.lower() in ("c", "comprimir") for p in parts[1:])
+    independent = any(p.lower() in ("i", "independiente") for p in parts[1:])
+    parts = [p for p in parts if p.lower() not in ("c", "comprimir", "i", "independiente")]
 
     split_size = None
     if len(parts) > 1:
@@ -472,7 +492,7 @@ async def pack_command(client: Client, message: Message):
                 )
                 return
         except ValueError:
-            await message.reply_text("❌ Valor invalido.\nUso: /pack  o  /pack MB")
+            await message.reply_text("❌ Valor invalido.\nUso: /pack  o  /pack MB  (anade c para comprimir, i para ZIP independientes)")
             return
 
     status_msg = await message.reply_text(
@@ -480,20 +500,60 @@ async def pack_command(client: Client, message: Message):
         + (f"Dividiendo en partes de {split_size} MB..." if split_size else "Creando archivo ZIP...")
     )
 
-    result_text, result_kb = await _run_pack(user_id, split_size)
-    await status_msg.edit_text(result_text, reply_markup=result_kb, disable_web_page_preview=True)
+    result_text, result_kb = await _run_pack(user_id, split_size, status_msg, compress, independent)
+    await progress_service.finish_edit(status_msg, result_text, reply_markup=result_kb, disable_web_page_preview=True)
+
+
+async def zip_command(client: Client, message: Message):
+    """Enlace inmediato a un ZIP que se genera al vuelo al descargarlo"""
+    user_id = message.from_user.id
+    files = file_service.list_user_files(user_id, "downloads")
+    if not files:
+        await message.reply_text("📭 No tienes archivos en descargas.", reply_markup=kb_main_menu())
+        return
+
+    numbers = []
+    for arg in message.text.split()[1:]:
+        try:
+            numbers.append(int(arg))
+        except ValueError:
+            await message.reply_text("❌ Valor invalido.\nUso: /zip  o  /zip 1 3 5")
+            return
+
+    if numbers:
+        available = {f["number"] for f in files}
+        missing = [n for n in numbers if n not in available]
+        if missing:
+            await message.reply_text(
+                f"❌ No existen en descargas: {', '.join(f'#{n}' for n in missing)}",
+                reply_markup=kb_back(),
+            )
+            return
+        files = [f for f in files if f["number"] in numbers]
+
+    total = sum(f["size"] for f in files)
+    url = file_service.create_zip_url(user_id, numbers)
+    await message.reply_text(
+        f"🗜 **ZIP listo — {len(files)} archivo(s), {file_service.format_bytes(total)}**\n\n"
+        f"{_link(f'downloads_{user_id}.zip', url)}\n\n"
+        "Se genera mientras lo descargas: no ocupa espacio y admite reanudar.",
+        reply_markup=kb_main_menu(),
+        disable_web_page_preview=True,
+    )
 
 
 async def queue_command(client: Client, message: Message):
     user_id = message.from_user.id
-    queue = user_queues.get(user_id, [])
+    active = upload_scheduler.get_active(user_id)
+    queue = active + upload_scheduler.get_pending(user_id)
 
     if not queue:
         await message.reply_text("📭 **Cola vacia.** No hay archivos pendientes.", reply_markup=kb_main_menu())
         return
 
     lines = [f"📋 **Cola — {len(queue)} archivo(s)**\n"]
-    for i, msg in enumerate(queue, 1):
+    for i, entry in enumerate(queue, 1):
+        msg = entry["message"]
         if msg.document:
             lbl = f"Documento: {msg.document.file_name or 'sin nombre'}"
         elif msg.video:
@@ -506,23 +566,18 @@ async def queue_command(client: Client, message: Message):
             lbl = "Archivo"
         lines.append(f"#{i} — {lbl}")
 
-    processing = user_id in user_current_processing
-    lines.append("\n" + ("Procesando el primero ahora mismo..." if processing else "En espera."))
+    lines.append("\n" + (f"Procesando {len(active)} ahora mismo..." if active else "En espera."))
     await message.reply_text("\n".join(lines), reply_markup=kb_main_menu())
 
 
 async def clear_queue_command(client: Client, message: Message):
     user_id = message.from_user.id
-    queue = user_queues.get(user_id, [])
+    count = upload_scheduler.clear_user(user_id)
 
-    if not queue:
+    if not count:
         await message.reply_text("📭 La cola ya esta vacia.", reply_markup=kb_main_menu())
         return
 
-    count = len(queue)
-    user_queues[user_id] = []
-    user_current_processing.pop(user_id, None)
-    user_batch_totals.pop(user_id, None)
     await message.reply_text(
         f"🗑 **Cola limpiada.** Se cancelaron **{count}** archivo(s).",
         reply_markup=kb_main_menu(),
@@ -546,18 +601,72 @@ async def cleanup_command(client: Client, message: Message):
 #  LÓGICA DE EMPAQUETADO COMPARTIDA
 # ─────────────────────────────────────────────
 
-async def _run_pack(user_id: int, split_size) -> tuple:
-    """Ejecuta el empaquetado y devuelve (texto_resultado, teclado)."""
-    def _do():
+def kb_pack_job(job_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("❌ Cancelar", callback_data=f"pack_cancel:{job_id}"),
+        InlineKeyboardButton("🔄 Estado", callback_data=f"pack_status:{job_id}"),
+    ]])
+
+
+def _pack_job_text(job: dict) -> str:
+    if job["state"] == "queued" and job["position"]:
+        return (
+            "⏳ **En cola para empaquetar.**\n"
+            f"Posicion: #{job['position']} — empezara automaticamente."
+        )
+    if not job["bytes_total"]:
+        return "⏳ **Empaquetando...**\nPreparando archivos..."
+    return (
+        "⏳ **Empaquetando...**\n"
+        f"{progress_service.create_progress_bar(job['bytes_done'], job['bytes_total'])} "
+        f"{job['percent']:.0f}%\n"
+        f"{job['bytes_done'] / (1024 * 1024):.1f} / {job['bytes_total'] / (1024 * 1024):.1f} MB"
+    )
+
+
+async def _run_pack(user_id: int, split_size, status_msg=None, compress=False, independent=False) -> tuple:
+    """
+    Lanza el empaquetado como trabajo en segundo plano y espera su
+    resultado sin bloquear el event loop; devuelve (texto_resultado,
+    teclado). status_msg muestra la posición en cola y el progreso en
+    bytes, con botones para cancelar y consultar el estado.
+    """
+    loop = asyncio.get_running_loop()
+    job_id = None
+
+    def _update(*_):
+        if not status_msg or not job_id:
+            return
         try:
-            return packing_service.pack_folder(user_id, split_size)
+            job = pack_job_runner.get_job(job_id)
+            if job and job["finished_at"] is None:
+                loop.call_soon_threadsafe(functools.partial(
+                    progress_service.schedule_edit,
+                    status_msg, _pack_job_text(job), reply_markup=kb_pack_job(job_id),
+                ))
         except Exception as e:
-            return None, str(e)
+            # Un fallo al mostrar el progreso nunca debe abortar el empaquetado
+            logger.warning(f"No se pudo actualizar el progreso del empaquetado {job_id}: {e}")
+
+    job = pack_job_runner.submit(
+        user_id, split_size, compress=compress, on_position=_update, on_progress=_update,
+        independent=independent,
+    )
+    job_id = job["id"]
+    _update()
 
     try:
-        with concurrent.futures.ThreadPoolExecutor() as ex:
-            files, err_msg = ex.submit(_do).result(timeout=300)
-    except concurrent.futures.TimeoutError:
+        # La espera en cola y el empaquetado tienen límites separados: un
+        # trabajo admitido tarde conserva todo su tiempo de ejecución.
+        # shield: al agotarse el tiempo se cancela el trabajo, no el future
+        await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(job["admitted"])), timeout=ADMISSION_TIMEOUT + 60
+        )
+        files, err_msg = await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(job["future"])), timeout=COMPRESSION_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        pack_job_runner.cancel(job_id, user_id)
         return (
             "❌ **Tiempo de espera agotado.**\n\n"
             "El empaquetado tardo demasiado. Intenta con menos archivos.",
@@ -570,30 +679,41 @@ async def _run_pack(user_id: int, split_size) -> tuple:
     total_mb = sum(f["size_mb"] for f in files)
     orig = f" ({files[0]['total_files']} archivos)" if files[0].get("total_files") else ""
 
+    stats = files[0].get("compression")
+    compression_note = ""
+    if stats:
+        compression_note = (
+            f"\nCompresion: {stats['ratio'] * 100:.0f}% del original "
+            f"({stats['compressed_files']} archivo(s) comprimidos, "
+            f"{progress_service.format_speed(stats['throughput'])})"
+        )
+
     if len(files) == 1:
         f = files[0]
         text = (
             f"✅ **Empaquetado completado{orig}**\n\n"
             f"{_link(f['filename'], f['url'])}\n"
-            f"{f['size_mb']:.1f} MB"
+            f"{f['size_mb']:.1f} MB{compression_note}"
         )
         return text, kb_after_pack()
 
-    # Buscar .txt de lista de partes
-    user_dir = file_service.get_user_directory(user_id, "packed")
-    base = next((f["filename"].rsplit(".", 2)[0] for f in files if ".001" in f["filename"]), None)
-    list_url = None
-    if base:
-        txt_path = os.path.join(user_dir, f"{base}.txt")
-        if os.path.exists(txt_path):
-            list_url = file_service.create_packed_url(user_id, f"{base}.txt")
+    # .txt con la lista de partes
+    list_filename = files[0].get("list_filename")
+    list_url = file_service.create_packed_url(user_id, list_filename) if list_filename else None
 
     lines = [
         f"✅ **Empaquetado completado{orig}**\n",
-        f"Partes: {len(files)}  |  Total: {total_mb:.1f} MB\n",
+        f"Partes: {len(files)}  |  Total: {total_mb:.1f} MB{compression_note}\n",
     ]
     if list_url:
         lines.append(f"\n{_link('Lista de partes (.txt)', list_url)}")
+    manifest_links = [
+        _link(label, file_service.create_packed_url(user_id, files[0][key]))
+        for label, key in (("Manifiesto JSON", "manifest_filename"), ("Metalink", "metalink_filename"))
+        if files[0].get(key)
+    ]
+    if manifest_links:
+        lines.append("\n" + "  |  ".join(manifest_links) + " (SHA-256 por parte, aria2c -M)")
     lines.append("\n**Enlaces de descarga:**")
     for f in files:
         lines.append(f"\n{_link(f['filename'], f['url'])} — {f['size_mb']:.1f} MB")
@@ -716,17 +836,34 @@ async def callback_handler(client: Client, query: CallbackQuery):
 
         # ── Empaquetar desde boton ────────────────
         elif data == "pack":
-            sys_st = load_manager.get_status()
-            if not sys_st["can_accept_work"]:
-                await query.answer("Servidor sobrecargado. Intenta mas tarde.", show_alert=True)
-                return
             await query.answer("Iniciando empaquetado...")
             wait_msg = await query.message.reply_text("⏳ **Empaquetando...** Creando archivo ZIP...")
-            result_text, result_kb = await _run_pack(user_id, None)
-            await wait_msg.edit_text(result_text, reply_markup=result_kb, disable_web_page_preview=True)
+            result_text, result_kb = await _run_pack(user_id, None, wait_msg)
+            await progress_service.finish_edit(wait_msg, result_text, reply_markup=result_kb, disable_web_page_preview=True)
             await query.answer()
             return
 
+        # ── Cancelar / consultar empaquetado ──────
+        elif data.startswith("pack_cancel:"):
+            success, msg = pack_job_runner.cancel(data[12:], user_id)
+            await query.answer(msg, show_alert=not success)
+            return
+
+        elif data.startswith("pack_status:"):
+            job = pack_job_runner.get_job(data[12:])
+            if not job or job["user_id"] != user_id:
+                await query.answer("Trabajo no encontrado.", show_alert=True)
+            elif job["finished_at"] is not None:
+                await query.answer(job["message"] or "Empaquetado terminado.", show_alert=True)
+            else:
+                await query.answer(
+                    f"Posicion en cola: #{job['position']}" if job["state"] == "queued" and job["position"]
+                    else f"Empaquetando: {job['percent']:.0f}% "
+                         f"({job['bytes_done'] / (1024 * 1024):.1f} / {job['bytes_total'] / (1024 * 1024):.1f} MB)",
+                    show_alert=True,
+                )
+            return
+
         else:
             await query.answer("Accion no reconocida.", show_alert=True)
             return
@@ -767,36 +904,33 @@ async def handle_file(client: Client, message: Message):
         )
         return
 
-    if user_id not in user_queues:
-        user_queues[user_id] = []
-
-    user_queues[user_id].append(message)
-    pos = len(user_queues[user_id])
-
-    if pos == 1:
-        await process_file_queue(client, user_id)
-    else:
+    # El handler no espera a la descarga: los workers globales atienden la cola
+    file_obj, _ = fast_download_service.get_file_object(message)
+    pos = upload_scheduler.submit(
+        user_id, message, file_size, getattr(file_obj, "file_unique_id", None)
+    )
+    if pos > 1:
         await message.reply_text(
             f"📬 **Anadido a la cola.**\n"
             f"Posicion: #{pos} — espera tu turno..."
         )
 
 
-async def process_file_queue(client: Client, user_id: int):
-    total = len(user_queues[user_id])
-    user_batch_totals[user_id] = total
-    pos = 0
-    try:
-        while user_queues.get(user_id):
-            msg = user_queues[user_id][0]
-            pos += 1
-            await process_single_file(client, msg, user_id, pos, total)
-            await asyncio.sleep(0.5)
-    except Exception as e:
-        logger.error(f"Error cola {user_id}: {e}", exc_info=True)
-        user_queues[user_id] = []
-    finally:
-        user_batch_totals.pop(user_id, None)
+async def start_upload_workers(client: Client):
+    """Recupera la cola persistida y arranca los workers de subidas sobre el loop del bot"""
+    async def _fetch(chat_id, message_id):
+        msg = await client.get_messages(chat_id, message_id)
+        if not msg or msg.empty or not fast_download_service.get_file_object(msg)[0]:
+            return None
+        return msg
+
+    async def _process(entry):
+        await process_single_file(
+            client, entry["message"], entry["user_id"], entry["position"], entry["total"]
+        )
+
+    await upload_scheduler.rehydrate(_fetch)
+    upload_scheduler.start(_process)
 
 
 async def process_single_file(client, message, user_id, position, total):
@@ -823,21 +957,25 @@ async def process_single_file(client, message, user_id, position, total):
             orig_name = f"foto_{message.id}.jpg"
             file_size = file_obj.file_size or 0
         else:
-            user_queues[user_id].pop(0)
             return
 
         user_dir = file_service.get_user_directory(user_id, "downloads")
-        sanitized = file_service.sanitize_filename(orig_name)
-        stored = sanitized
-        path = os.path.join(user_dir, stored)
-        base, ext = os.path.splitext(sanitized)
-        c = 1
-        while os.path.exists(path):
-            stored = f"{base}_{c}{ext}"
+        os.makedirs(user_dir, exist_ok=True)
+
+        def _free_stored_name():
+            # Sin await entre elegir el nombre y ocupar la ruta: otra subida no puede tomarlo
+            sanitized = file_service.sanitize_filename(orig_name)
+            stored = sanitized
             path = os.path.join(user_dir, stored)
-            c += 1
+            base, ext = os.path.splitext(sanitized)
+            c = 1
+            while os.path.exists(path):
+                stored = f"{base}_{c}{ext}"
+                path = os.path.join(user_dir, stored)
+                c += 1
+            return stored, path
 
-        file_number = file_service.register_file(user_id, orig_name, stored, "downloads")
+        file_unique_id = getattr(file_obj, "file_unique_id", None)
 
         prog_msg = await message.reply_text(
             progress_service.create_progress_message(
@@ -846,43 +984,66 @@ async def process_single_file(client, message, user_id, position, total):
                 process_type="Descargando", current_file=position, total_files=total,
             )
         )
-        user_current_processing[user_id] = prog_msg.id
 
-        pdata = {"last_update": 0.0, "last_speed": 0.0}
+        pdata = {"last_speed": 0.0, "last_bytes": 0}
 
         async def on_progress(current, total_bytes):
             try:
+                upload_scheduler.record_transfer(current - pdata["last_bytes"])
+                pdata["last_bytes"] = current
                 elapsed = time.time() - start
                 speed = current / elapsed if elapsed > 0 else 0
                 pdata["last_speed"] = 0.7 * pdata["last_speed"] + 0.3 * speed
-                now = time.time()
-                if now - pdata["last_update"] >= 0.6 or current == total_bytes:
-                    txt = progress_service.create_progress_message(
-                        filename=orig_name, current=current, total=total_bytes,
-                        speed=pdata["last_speed"], user_first_name=message.from_user.first_name,
-                        process_type="Descargando", current_file=position, total_files=total,
-                    )
-                    try:
-                        await prog_msg.edit_text(txt)
-                        pdata["last_update"] = now
-                    except Exception:
-                        pass
+                # El despachador de ProgressService fusiona y limita las ediciones
+                progress_service.schedule_edit(prog_msg, progress_service.create_progress_message(
+                    filename=orig_name, current=current, total=total_bytes,
+                    speed=pdata["last_speed"], user_first_name=message.from_user.first_name,
+                    process_type="Descargando", current_file=position, total_files=total,
+                ))
             except Exception:
                 pass
 
-        success, _ = await fast_download_service.download_with_retry(
-            client=client, message=message, file_path=path, progress_callback=on_progress,
-        )
+        async with _media_lock(file_unique_id):
+            # Medio ya almacenado (mismo file_unique_id, quizá por el reenvío que
+            # tenía el lock): se enlaza sin descargarlo
+            stored, path = _free_stored_name()
+            checksums = blob_store.link_existing(file_unique_id, path)
+            success = checksums is not None
+
+            if not success:
+                # Se descarga fuera de downloads (con checkpoint para reanudar) y el
+                # archivo solo aparece en la carpeta del usuario cuando está completo
+                partial_path = fast_download_service.get_partial_path(user_id, message)
+                success, _ = await fast_download_service.download_with_retry(
+                    client=client, message=message, file_path=partial_path, progress_callback=on_progress,
+                )
+                success = success and os.path.exists(partial_path)
+                if success:
+                    stored, path = _free_stored_name()
+                    try:
+                        os.replace(partial_path, path)
+                    except OSError:
+                        # Checkpoints en otro sistema de archivos: copiar y borrar
+                        await asyncio.get_running_loop().run_in_executor(None, shutil.move, partial_path, path)
+                    # Una lectura: sha256 para deduplicar y CRC32 para empaquetar
+                    checksums = await asyncio.get_running_loop().run_in_executor(
+                        None, blob_store.ingest, path, file_unique_id
+                    )
 
         if not success or not os.path.exists(path):
-            await prog_msg.edit_text(
+            await progress_service.finish_edit(
+                prog_msg,
                 "❌ **Error al descargar el archivo.**\n\n"
                 "El archivo no se guardo. Intentalo de nuevo.",
                 reply_markup=kb_main_menu(),
             )
-            user_queues[user_id].pop(0)
             return
 
+        file_number = file_service.register_file(user_id, orig_name, stored, "downloads")
+
+        storage_usage.file_added(path)
+        if checksums and checksums["crc32"] is not None:
+            file_service.set_file_checksum(user_id, stored, "downloads", checksums["crc32"], path)
         final_size = os.path.getsize(path)
         if file_size > 0 and final_size < file_size * 0.95:
             logger.warning(f"Descarga posiblemente incompleta: {file_size}B -> {final_size}B")
@@ -894,10 +1055,11 @@ async def process_single_file(client, message, user_id, position, total):
             (f["number"] for f in files_list if f["stored_name"] == stored), file_number
         )
 
-        remaining = len(user_queues[user_id]) - 1
+        remaining = len(upload_scheduler.get_pending(user_id))
         queue_note = f"\n\nSiguiente en cola: {remaining} archivo(s) restante(s)..." if remaining > 0 else ""
 
-        await prog_msg.edit_text(
+        await progress_service.finish_edit(
+            prog_msg,
             f"✅ **Archivo guardado — #{final_num}**\n\n"
             f"{_link(orig_name, url)}\n"
             f"{file_type}  ·  {size_mb:.2f} MB  ·  downloads"
@@ -916,10 +1078,6 @@ async def process_single_file(client, message, user_id, position, total):
             )
         except Exception:
             pass
-    finally:
-        if user_queues.get(user_id):
-            user_queues[user_id].pop(0)
-        user_current_processing.pop(user_id, None)
 
 
 # ─────────────────────────────────────────────
@@ -936,6 +1094,7 @@ def setup_handlers(client: Client):
     client.on_message(filters.command("clear")      & filters.private)(clear_command)
     client.on_message(filters.command("rename")     & filters.private)(rename_command)
     client.on_message(filters.command("pack")       & filters.private)(pack_command)
+    client.on_message(filters.command("zip")        & filters.private)(zip_command)
     client.on_message(filters.command("queue")      & filters.private)(queue_command)
     client.on_message(filters.command("clearqueue") & filters.private)(clear_queue_command)
     client.on_message(filters.command("cleanup")    & filters.private)(cleanup_command)
@@ -0,0 +1,210 @@
+"""
+Peticiones Range/condicionales sobre /storage/<user_id>/downloads/<archivo>.
+
+La mayoría usa el cliente de pruebas de Flask (solo la app y
+streaming_service). Los tests live_* repiten los casos clave contra
+waitress y el servidor sendfile reales en loopback, que son los que
+sirven las descargas en producción.
+"""
+import http.client
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+USER_ID = "1001"
+FILENAME = "datos.bin"
+DATA = bytes(range(256)) * 1200  # 300 KB: varios bloques de CHUNK_SIZE
+URL = f"/storage/{USER_ID}/downloads/{FILENAME}"
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    # BASE_DIR y la metadata usan rutas relativas: todo queda dentro del tmp
+    workdir = tmp_path_factory.mktemp("storage_ranges")
+    old_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from flask_app import app as flask_app
+
+        download_dir = os.path.join("storage", USER_ID, "downloads")
+        os.makedirs(download_dir)
+        with open(os.path.join(download_dir, FILENAME), "wb") as f:
+            f.write(DATA)
+
+        flask_app.config["TESTING"] = True
+        yield flask_app
+    finally:
+        os.chdir(old_cwd)
+
+
+@pytest.fixture(scope="module")
+def client(app):
+    with app.test_client() as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="module", params=["waitress", "sendfile"])
+def live_server(request, app):
+    """Puerto de un servidor real (waitress o sendfile) sirviendo la app en loopback"""
+    if request.param == "waitress":
+        from waitress import create_server
+
+        server = create_server(app, host="127.0.0.1", port=0)
+        port = server.effective_port
+        thread = threading.Thread(target=server.run, daemon=True)
+        stop = server.close
+    else:
+        from wsgiref.simple_server import make_server
+        from sendfile_server import ThreadingSendfileServer, SendfileRequestHandler
+
+        server = make_server("127.0.0.1", 0, app, server_class=ThreadingSendfileServer,
+                             handler_class=SendfileRequestHandler)
+        port = server.server_port
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+
+    thread.start()
+    yield port
+    stop()
+
+
+def live_get(port, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.request("GET", URL, headers=headers or {})
+        response = connection.getresponse()
+        # Cabeceras sin distinguir mayúsculas: waitress envía "Etag"
+        return response.status, response.headers, response.read()
+    finally:
+        connection.close()
+
+
+def test_full_download(client):
+    response = client.get(URL)
+    assert response.status_code == 200
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["Content-Length"] == str(len(DATA))
+    assert response.data == DATA
+
+
+def test_single_range(client):
+    response = client.get(URL, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(DATA)}"
+    assert response.headers["Content-Length"] == "100"
+    assert response.data == DATA[100:200]
+
+
+def test_suffix_range(client):
+    response = client.get(URL, headers={"Range": "bytes=-50"})
+    assert response.status_code == 206
+    assert response.data == DATA[-50:]
+
+
+def test_multi_range(client):
+    response = client.get(URL, headers={"Range": "bytes=0-9,1000-1009"})
+    assert response.status_code == 206
+
+    content_type = response.headers["Content-Type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=", 1)[1]
+
+    body = response.data
+    assert response.headers["Content-Length"] == str(len(body))
+    assert body.endswith(f"\r\n--{boundary}--\r\n".encode("ascii"))
+
+    parts = body.split(f"--{boundary}".encode("ascii"))[1:-1]
+    assert len(parts) == 2
+    for part, (start, end) in zip(parts, [(0, 9), (1000, 1009)]):
+        head, payload = part.split(b"\r\n\r\n", 1)
+        assert f"Content-Range: bytes {start}-{end}/{len(DATA)}".encode("ascii") in head
+        assert payload[:-2] == DATA[start:end + 1]
+
+
+def test_overlapping_ranges_are_merged(client):
+    response = client.get(URL, headers={"Range": "bytes=0-99,50-149"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 0-149/{len(DATA)}"
+    assert response.data == DATA[:150]
+
+
+def test_unsatisfiable_range(client):
+    response = client.get(URL, headers={"Range": f"bytes={len(DATA)}-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(DATA)}"
+
+
+def test_if_range_with_current_etag(client):
+    etag = client.head(URL).headers["ETag"]
+    response = client.get(URL, headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.data == DATA[:10]
+
+
+def test_if_range_with_stale_etag(client):
+    response = client.get(URL, headers={"Range": "bytes=0-9", "If-Range": '"obsoleto"'})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_if_none_match(client):
+    etag = client.head(URL).headers["ETag"]
+    response = client.get(URL, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_if_modified_since(client):
+    last_modified = client.head(URL).headers["Last-Modified"]
+    response = client.get(URL, headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+
+def test_missing_file(client):
+    response = client.get(f"/storage/{USER_ID}/downloads/no_existe.bin")
+    assert response.status_code == 404
+
+
+def test_live_full_download(live_server):
+    status, headers, body = live_get(live_server)
+    assert status == 200
+    assert headers["Content-Length"] == str(len(DATA))
+    assert body == DATA
+
+
+def test_live_single_range(live_server):
+    # Con el servidor sendfile este es el camino zero-copy (seek + sendfile)
+    status, headers, body = live_get(live_server, {"Range": "bytes=70000-200000"})
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes 70000-200000/{len(DATA)}"
+    assert body == DATA[70000:200001]
+
+
+def test_live_multi_range(live_server):
+    status, headers, body = live_get(live_server, {"Range": "bytes=0-9,100000-100009"})
+    assert status == 206
+    assert headers["Content-Type"].startswith("multipart/byteranges; boundary=")
+    assert headers["Content-Length"] == str(len(body))
+    assert DATA[100000:100010] in body
+
+
+def test_live_unsatisfiable_range(live_server):
+    status, headers, _ = live_get(live_server, {"Range": f"bytes={len(DATA)}-"})
+    assert status == 416
+    assert headers["Content-Range"] == f"bytes */{len(DATA)}"
+
+
+def test_live_if_range_and_not_modified(live_server):
+    _, headers, _ = live_get(live_server)
+    etag = headers["ETag"]
+    status, _, body = live_get(live_server, {"Range": "bytes=0-9", "If-Range": etag})
+    assert (status, body) == (206, DATA[:10])
+    status, _, body = live_get(live_server, {"If-None-Match": etag})
+    assert (status, body) == (304, b"")
@@ -0,0 +1,286 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from config import (
+    UPLOAD_WORKERS, UPLOAD_MAX_PER_USER, UPLOAD_DRR_QUANTUM_MB, UPLOAD_BANDWIDTH_MB_S,
+    UPLOAD_QUEUE_DB
+)
+
+logger = logging.getLogger(__name__)
+
+# Ventana para medir el caudal agregado de descarga
+BANDWIDTH_WINDOW = 5.0
+
+class UploadQueueStore:
+    """
+    Copia durable de la cola de subidas en SQLite. Solo guarda lo necesario
+    para recuperar el mensaje de Telegram tras un reinicio: el objeto
+    Message no se persiste, se vuelve a pedir con (chat_id, message_id).
+    """
+
+    def __init__(self, path=UPLOAD_QUEUE_DB):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS upload_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                file_unique_id TEXT,
+                size INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def add(self, user_id, chat_id, message_id, file_unique_id, size, enqueued_at):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO upload_queue (user_id, chat_id, message_id, file_unique_id, size, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, chat_id, message_id, file_unique_id, size, enqueued_at)
+            )
+            self.conn.commit()
+            return cursor.lastrowid
+
+    def remove(self, entry_ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM upload_queue WHERE id = ?", [(i,) for i in entry_ids])
+            self.conn.commit()
+
+    def load(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, user_id, chat_id, message_id, file_unique_id, size, enqueued_at "
+                "FROM upload_queue ORDER BY id"
+            ).fetchall()
+        return [
+            dict(zip(("id", "user_id", "chat_id", "message_id", "file_unique_id", "size", "enqueued_at"), row))
+            for row in rows
+        ]
+
+class UploadScheduler:
+    """
+    Cola global de archivos recibidos, atendida por un número fijo de
+    workers asyncio. El reparto entre usuarios usa deficit round robin con
+    el tamaño del archivo como coste, cada usuario tiene un máximo de
+    descargas simultáneas y no se arrancan descargas adicionales mientras
+    el caudal agregado ya satura la capacidad configurada.
+    """
+
+    def __init__(self):
+        self.workers = UPLOAD_WORKERS
+        self.max_per_user = UPLOAD_MAX_PER_USER
+        self.quantum = UPLOAD_DRR_QUANTUM_MB * 1024 * 1024
+        self.bandwidth_limit = UPLOAD_BANDWIDTH_MB_S * 1024 * 1024
+        # user_id -> {pending, active, deficit, batch_total, batch_started}
+        self.users = {}
+        self.round = deque()
+        self.active_count = 0
+        self.transfers = deque()
+        self.handler = None
+        self.wakeup = None
+        self.tasks = []
+        self.store = UploadQueueStore()
+
+    def start(self, handler):
+        """Arranca los workers en el loop actual; handler(entry) procesa cada archivo"""
+        if self.tasks:
+            return
+        self.handler = handler
+        self.wakeup = asyncio.Event()
+        self.tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+        logger.info(f"Planificador de subidas iniciado con {self.workers} workers")
+
+    def submit(self, user_id, message, size, file_unique_id=None):
+        """Encola un archivo; devuelve cuántos archivos del usuario hay en curso o en cola"""
+        enqueued_at = time.time()
+        entry_id = self.store.add(
+            user_id, message.chat.id, message.id, file_unique_id, size, enqueued_at
+        )
+        return self._enqueue({
+            "id": entry_id,
+            "user_id": user_id,
+            "message": message,
+            "size": size,
+            "enqueued_at": enqueued_at
+        })
+
+    async def rehydrate(self, fetch_message):
+        """
+        Recupera la cola persistida tras un reinicio. fetch_message(chat_id,
+        message_id) debe devolver el mensaje o None si ya no existe; las
+        entradas cuyo mensaje no se puede recuperar se descartan.
+        """
+        restored = 0
+        dropped = []
+        for row in self.store.load():
+            try:
+                message = await fetch_message(row["chat_id"], row["message_id"])
+            except Exception as e:
+                logger.warning(f"No se pudo recuperar el mensaje {row['message_id']} de la cola: {e}")
+                message = None
+            if message is None:
+                dropped.append(row["id"])
+                continue
+            self._enqueue({
+                "id": row["id"],
+                "user_id": row["user_id"],
+                "message": message,
+                "size": row["size"],
+                "enqueued_at": row["enqueued_at"]
+            })
+            restored += 1
+
+        if dropped:
+            self.store.remove(dropped)
+        if restored or dropped:
+            logger.info(f"Cola de subidas recuperada: {restored} archivo(s), {len(dropped)} descartado(s)")
+        return restored
+
+    def _enqueue(self, entry):
+        user_id = entry["user_id"]
+        state = self.users.get(user_id)
+        if state is None:
+            state = {"pending": deque(), "active": [], "deficit": 0,
+                     "batch_total": 0, "batch_started": 0}
+            self.users[user_id] = state
+        if not state["pending"]:
+            self.round.append(user_id)
+
+        state["batch_total"] += 1
+        state["pending"].append(entry)
+        if self.wakeup:
+            self.wakeup.set()
+        return len(state["pending"]) + len(state["active"])
+
+    def record_transfer(self, nbytes):
+        """Los workers informan de los bytes descargados para medir el caudal"""
+        if nbytes > 0:
+            self.transfers.append((time.time(), nbytes))
+
+    def get_throughput(self):
+        cutoff = time.time() - BANDWIDTH_WINDOW
+        while self.transfers and self.transfers[0][0] < cutoff:
+            self.transfers.popleft()
+        return sum(nbytes for _, nbytes in self.transfers) / BANDWIDTH_WINDOW
+
+    def _bandwidth_saturated(self):
+        return bool(self.bandwidth_limit) and self.get_throughput() >= self.bandwidth_limit * 0.9
+
+    def _next_entry(self):
+        """Elige el siguiente archivo con deficit round robin, o None"""
+        if not self.round:
+            return None
+        # Con el enlace saturado, otra descarga solo repartiría el mismo caudal
+        if self.active_count and self._bandwidth_saturated():
+            return None
+
+        eligible = [
+            self.users[user_id] for user_id in self.round
+            if len(self.users[user_id]["active"]) < self.max_per_user
+        ]
+        if not eligible:
+            return None
+
+        largest = max(max(state["pending"][0]["size"], 1) for state in eligible)
+        rounds = largest // self.quantum + 2
+        for _ in range(len(self.round) * rounds):
+            user_id = self.round[0]
+            state = self.users[user_id]
+            self.round.rotate(-1)
+            if len(state["active"]) >= self.max_per_user:
+                continue
+
+            entry = state["pending"][0]
+            cost = max(entry["size"], 1)
+            if state["deficit"] < cost:
+                state["deficit"] += self.quantum
+                if state["deficit"] < cost:
+                    continue
+
+            state["pending"].popleft()
+            state["deficit"] -= cost
+            if not state["pending"]:
+                self.round.remove(user_id)
+                state["deficit"] = 0
+            state["batch_started"] += 1
+            entry["position"] = state["batch_started"]
+            entry["total"] = state["batch_total"]
+            state["active"].append(entry)
+            self.active_count += 1
+            return entry
+        return None
+
+    def _finish(self, entry):
+        self.store.remove([entry["id"]])
+        user_id = entry["user_id"]
+        state = self.users.get(user_id)
+        self.active_count -= 1
+        if state is None:
+            return
+        if entry in state["active"]:
+            state["active"].remove(entry)
+        if not state["pending"] and not state["active"]:
+            del self.users[user_id]
+
+    async def _worker(self, index):
+        while True:
+            entry = self._next_entry()
+            if entry is None:
+                self.wakeup.clear()
+                try:
+                    # Reevaluar periódicamente: el caudal medido cambia sin eventos
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.handler(entry)
+            except Exception as e:
+                logger.error(f"Error en worker de subidas {index}: {e}", exc_info=True)
+            finally:
+                self._finish(entry)
+                self.wakeup.set()
+
+    def get_pending(self, user_id):
+        state = self.users.get(user_id)
+        return list(state["pending"]) if state else []
+
+    def get_active(self, user_id):
+        state = self.users.get(user_id)
+        return list(state["active"]) if state else []
+
+    def clear_user(self, user_id):
+        """Cancela los archivos en cola del usuario (los activos terminan); devuelve cuántos"""
+        state = self.users.get(user_id)
+        if not state or not state["pending"]:
+            return 0
+        count = len(state["pending"])
+        self.store.remove([entry["id"] for entry in state["pending"]])
+        state["pending"].clear()
+        state["deficit"] = 0
+        if user_id in self.round:
+            self.round.remove(user_id)
+        if not state["active"]:
+            del self.users[user_id]
+        return count
+
+    def get_status(self):
+        return {
+            "workers": self.workers,
+            "active": self.active_count,
+            "pending": sum(len(state["pending"]) for state in self.users.values()),
+            "throughput_bps": self.get_throughput()
+        }
+
+upload_scheduler = UploadScheduler()
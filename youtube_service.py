@@ -9,6 +9,7 @@ from config import BASE_DIR, YT_DLP_TIMEOUT, YT_DLP_MAX_FILE_SIZE_MB
 from file_service import file_service
 from load_manager import load_manager
 from cookies_service import cookies_service
+from storage_usage import storage_usage
 
 logger = logging.getLogger(__name__)
 
@@ -99,13 +100,13 @@ class YouTubeService:
         logger.info(f"🎬 Iniciando descarga YouTube para {user_id} - {cookies_status}")
         
         for attempt in range(1, MAX_RETRIES + 1):
+            can_start, message = await load_manager.acquire_async("youtube", user_id)
+            if not can_start:
+                return False, message
+
             try:
                 logger.info(f"🎬 Intento {attempt}/{MAX_RETRIES} para: {url}")
                 
-                can_start, message = load_manager.can_start_process()
-                if not can_start:
-                    return False, message
-
                 # Validación mejorada de URL
                 if not await self._validate_youtube_url(url):
                     return False, "❌ URL de YouTube no válida"
@@ -137,6 +138,7 @@ class YouTubeService:
                         raise Exception("Archivo descargado está vacío")
 
                     # Registrar en sistema
+                    storage_usage.file_added(final_path)
                     file_number = file_service.register_file(user_id, original_filename, final_filename, "downloads")
                     download_url = file_service.create_download_url(user_id, final_filename)
                     
@@ -374,7 +376,7 @@ class YouTubeService:
                 if os.path.isfile(file_path):
                     file_age = current_time - os.path.getctime(file_path)
                     if file_age > max_age_hours * 3600:
-                        os.remove(file_path)
+                        storage_usage.remove_file(file_path)
                         logger.info(f"🧹 Limpiado temporal: {filename}")
         except Exception as e:
             logger.error(f"Error limpiando temporales: {e}")
@@ -0,0 +1,374 @@
+import os
+import time
+import struct
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from flask import Response, request
+from config import CHUNK_SIZE
+from streaming_service import streaming_service
+from pack_workers import file_crc32
+
+logger = logging.getLogger(__name__)
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+# Bit 3: CRC y tamaños en el descriptor de datos; bit 11: nombres UTF-8
+ZIP_FLAGS = 0x0808
+
+class ZipStreamService:
+    """
+    Genera al vuelo un ZIP (STORED, ZIP64 cuando hace falta) a partir de los
+    archivos originales, sin copiarlos a disco. Como no hay compresión, la
+    disposición completa del archivo (offsets, Content-Length) se calcula
+    solo con stat(); el CRC32 de cada miembro viaja en su descriptor de
+    datos: se usa el guardado en la metadata si lo hay o se calcula
+    mientras se transmite. Las peticiones Range que empiezan a mitad del
+    archivo obtienen los CRC que faltan de la caché o leyendo el miembro.
+    """
+
+    def __init__(self):
+        self.chunk_size = CHUNK_SIZE
+        self.crc_cache = OrderedDict()
+        self.crc_cache_size = 4096
+        self.lock = threading.Lock()
+
+    def _crc_key(self, entry):
+        return entry["path"], entry["size"], entry["mtime_ns"]
+
+    def _cached_crc(self, entry):
+        with self.lock:
+            crc = self.crc_cache.get(self._crc_key(entry))
+            if crc is not None:
+                self.crc_cache.move_to_end(self._crc_key(entry))
+            return crc
+
+    def _store_crc(self, entry, crc):
+        with self.lock:
+            self.crc_cache[self._crc_key(entry)] = crc
+            self.crc_cache.move_to_end(self._crc_key(entry))
+            while len(self.crc_cache) > self.crc_cache_size:
+                self.crc_cache.popitem(last=False)
+
+    def _compute_crc(self, entry):
+        crc = self._cached_crc(entry)
+        if crc is not None:
+            return crc
+        crc = file_crc32(entry["path"])
+        self._store_crc(entry, crc)
+        return crc
+
+    def _dos_datetime(self, mtime):
+        t = time.localtime(mtime)
+        if t.tm_year < 1980:
+            return 0, (1 << 5) | 1
+        dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+        dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+        return dos_time, dos_date
+
+    def _local_header(self, entry):
+        if entry["zip64"]:
+            # Tamaños reales en el descriptor; el extra ZIP64 reserva los campos
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            sizes = ZIP64_LIMIT
+            version = 45
+        else:
+            extra = b''
+            sizes = 0
+            version = 20
+        return struct.pack(
+            '<4sHHHHHIIIHH', b'PK\x03\x04', version, ZIP_FLAGS, entry["method"],
+            entry["dos_time"], entry["dos_date"], 0, sizes, sizes,
+            len(entry["name"]), len(extra)
+        ) + entry["name"] + extra
+
+    def _descriptor_size(self, entry):
+        return 24 if entry["zip64"] else 16
+
+    def _descriptor(self, entry, crc):
+        if entry["zip64"]:
+            return struct.pack('<4sIQQ', b'PK\x07\x08', crc, entry["compressed_size"], entry["size"])
+        return struct.pack('<4sIII', b'PK\x07\x08', crc, entry["compressed_size"], entry["size"])
+
+    def _central_extra(self, entry):
+        fields = []
+        if entry["size"] >= ZIP64_LIMIT:
+            fields.append(entry["size"])
+        if entry["compressed_size"] >= ZIP64_LIMIT:
+            fields.append(entry["compressed_size"])
+        if entry["offset"] >= ZIP64_LIMIT:
+            fields.append(entry["offset"])
+        if not fields:
+            return b''
+        return struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields)
+
+    def _central_entry(self, entry, crc):
+        extra = self._central_extra(entry)
+        size = min(entry["size"], ZIP64_LIMIT)
+        compressed_size = min(entry["compressed_size"], ZIP64_LIMIT)
+        offset = ZIP64_LIMIT if entry["offset"] >= ZIP64_LIMIT else entry["offset"]
+        version = 45 if extra else 20
+        return struct.pack(
+            '<4sHHHHHHIIIHHHHHII', b'PK\x01\x02', (3 << 8) | version, version,
+            entry.get("flags", ZIP_FLAGS), entry["method"],
+            entry["dos_time"], entry["dos_date"], crc, compressed_size, size,
+            len(entry["name"]), len(extra), 0, 0, 0, 0o100644 << 16, offset
+        ) + entry["name"] + extra
+
+    def _central_entry_size(self, entry):
+        return 46 + len(entry["name"]) + len(self._central_extra(entry))
+
+    def _end_records(self, count, cd_offset, cd_size):
+        records = b''
+        if count >= ZIP_FILECOUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            zip64_end_offset = cd_offset + cd_size
+            records += struct.pack('<4sQHHIIQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                                   count, count, cd_size, cd_offset)
+            records += struct.pack('<4sIQI', b'PK\x06\x07', 0, zip64_end_offset, 1)
+        records += struct.pack(
+            '<4sHHHHIIH', b'PK\x05\x06', 0, 0,
+            min(count, ZIP_FILECOUNT_LIMIT), min(count, ZIP_FILECOUNT_LIMIT),
+            min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0
+        )
+        return records
+
+    def entry_from_zipinfo(self, info):
+        """Entrada de un miembro STORED ya escrito en un ZIP existente (solo para el directorio central)"""
+        dos_time = (info.date_time[3] << 11) | (info.date_time[4] << 5) | (info.date_time[5] // 2)
+        dos_date = ((info.date_time[0] - 1980) << 9) | (info.date_time[1] << 5) | info.date_time[2]
+        flags = info.flag_bits
+        if flags & 0x0800:
+            name = info.filename.encode('utf-8')
+        else:
+            # Mantener la codificación (cp437) y los flags del encabezado local
+            name = info.filename.encode('cp437')
+        return {
+            "name": name,
+            "path": None,
+            "size": info.file_size,
+            "compressed_size": info.compress_size,
+            "method": info.compress_type,
+            "mtime_ns": None,
+            "dos_time": dos_time,
+            "dos_date": dos_date,
+            "offset": info.header_offset,
+            "zip64": max(info.file_size, info.compress_size) >= ZIP64_LIMIT,
+            "crc": info.CRC,
+            "flags": flags
+        }
+
+    def _make_entry(self, member, offset):
+        """Entrada STORED de (nombre, ruta[, crc32]) situada en offset"""
+        arcname, path = member[0], member[1]
+        stat = os.stat(path)
+        dos_time, dos_date = self._dos_datetime(stat.st_mtime)
+        return {
+            "name": arcname.encode('utf-8'),
+            "path": path,
+            "size": stat.st_size,
+            "compressed_size": stat.st_size,
+            "method": ZIP_STORED,
+            "mtime_ns": stat.st_mtime_ns,
+            "dos_time": dos_time,
+            "dos_date": dos_date,
+            "offset": offset,
+            "zip64": stat.st_size >= ZIP64_LIMIT,
+            "crc": member[2] if len(member) > 2 else None
+        }
+
+    def build_layout(self, files, base_offset=0, existing_entries=()):
+        """
+        files: lista de (nombre en el ZIP, ruta) o (nombre, ruta, crc32) si
+        el CRC ya se conoce. Devuelve la disposición del archivo: segmentos
+        (offset, longitud, tipo, dato) y tamaño total.
+
+        Para añadir miembros a un ZIP existente, base_offset es donde
+        empiezan los nuevos datos y existing_entries las entradas previas,
+        que se incluyen en el nuevo directorio central.
+        """
+        entries = []
+        segments = []
+        offset = base_offset
+        for member in files:
+            entry = self._make_entry(member, offset)
+            entries.append(entry)
+
+            header = self._local_header(entry)
+            segments.append((offset, len(header), "bytes", header))
+            offset += len(header)
+            segments.append((offset, entry["size"], "file", entry))
+            offset += entry["size"]
+            segments.append((offset, self._descriptor_size(entry), "descriptor", entry))
+            offset += self._descriptor_size(entry)
+
+        central_entries = list(existing_entries) + entries
+        cd_offset = offset
+        cd_size = sum(self._central_entry_size(entry) for entry in central_entries)
+        segments.append((offset, cd_size, "central", None))
+        offset += cd_size
+
+        end = self._end_records(len(central_entries), cd_offset, cd_size)
+        segments.append((offset, len(end), "bytes", end))
+        offset += len(end)
+
+        return {"entries": entries, "central_entries": central_entries, "segments": segments,
+                "start": base_offset, "size": offset}
+
+    def _iter_file(self, entry, start, end, crcs, chunk_size):
+        """Bytes [start, end) del miembro; si se lee completo y no se conoce su CRC, lo calcula"""
+        whole = start == 0 and end == entry["size"] and entry["crc"] is None
+        crc = 0
+        position = start
+        with open(entry["path"], 'rb') as f:
+            f.seek(start)
+            while position < end:
+                chunk = f.read(min(chunk_size, end - position))
+                if not chunk:
+                    raise IOError(f"{entry['path']} cambió durante la transmisión")
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                position += len(chunk)
+                yield chunk
+        if whole:
+            crcs[id(entry)] = crc
+            self._store_crc(entry, crc)
+
+    def _crc(self, entry, crcs):
+        if entry["crc"] is not None:
+            return entry["crc"]
+        crc = crcs.get(id(entry))
+        if crc is None:
+            crc = self._compute_crc(entry)
+            crcs[id(entry)] = crc
+        return crc
+
+    def iter_range(self, layout, start, end, chunk_size=None):
+        """Genera los bytes [start, end] (inclusivo) del ZIP"""
+        chunk_size = chunk_size or self.chunk_size
+        crcs = {}
+        stop = end + 1
+        for seg_offset, seg_length, kind, data in layout["segments"]:
+            seg_end = seg_offset + seg_length
+            if seg_end <= start or seg_length == 0:
+                continue
+            if seg_offset >= stop:
+                break
+            lo = max(start, seg_offset) - seg_offset
+            hi = min(stop, seg_end) - seg_offset
+
+            if kind == "bytes":
+                yield data[lo:hi]
+            elif kind == "file":
+                yield from self._iter_file(data, lo, hi, crcs, chunk_size)
+            elif kind == "descriptor":
+                yield self._descriptor(data, self._crc(data, crcs))[lo:hi]
+            elif kind == "central":
+                central = b''.join(
+                    self._central_entry(entry, self._crc(entry, crcs))
+                    for entry in layout["central_entries"]
+                )
+                yield central[lo:hi]
+
+    def write_archive(self, layout, out, chunk_size=1024 * 1024):
+        """Escribe el ZIP (desde layout["start"]) en out; con los CRC conocidos es solo E/S"""
+        for chunk in self.iter_range(layout, layout["start"], layout["size"] - 1, chunk_size):
+            out.write(chunk)
+        return layout["size"] - layout["start"]
+
+    def write_archive_sequential(self, members, out, compress=None, chunk_size=1024 * 1024):
+        """
+        Escribe un ZIP cuyos tamaños comprimidos no se conocen de antemano.
+        compress(índice, entrada) devuelve un iterador de bloques DEFLATE
+        crudos del miembro, o None para guardarlo sin comprimir. Los
+        miembros comprimidos necesitan su CRC32 en members. Devuelve
+        (bytes originales, bytes escritos).
+        """
+        entries = []
+        offset = 0
+        original = 0
+        crcs = {}
+        for index, member in enumerate(members):
+            entry = self._make_entry(member, offset)
+            blocks = compress(index, entry) if compress else None
+            if blocks is not None:
+                entry["method"] = ZIP_DEFLATED
+                # Tamaño comprimido desconocido: reservar ZIP64 como zipfile si podría desbordar
+                entry["zip64"] = entry["size"] * 1.05 >= ZIP64_LIMIT
+            else:
+                blocks = self._iter_file(entry, 0, entry["size"], crcs, chunk_size)
+
+            header = self._local_header(entry)
+            out.write(header)
+            compressed_size = 0
+            for block in blocks:
+                out.write(block)
+                compressed_size += len(block)
+            entry["compressed_size"] = compressed_size
+
+            out.write(self._descriptor(entry, self._crc(entry, crcs)))
+            offset += len(header) + compressed_size + self._descriptor_size(entry)
+            original += entry["size"]
+            entries.append(entry)
+
+        central = b''.join(self._central_entry(entry, self._crc(entry, crcs)) for entry in entries)
+        out.write(central)
+        end = self._end_records(len(entries), offset, len(central))
+        out.write(end)
+        return original, offset + len(central) + len(end)
+
+    def make_etag(self, layout):
+        digest = hashlib.sha1()
+        for entry in layout["entries"]:
+            digest.update(entry["name"] + b'\0')
+            digest.update(f'{entry["size"]}:{entry["mtime_ns"]}\0'.encode('ascii'))
+        return f'"zip-{digest.hexdigest()[:24]}"'
+
+    def build_response(self, files, download_name):
+        """Respuesta HTTP del ZIP con Content-Length exacto, Range e If-Range"""
+        layout = self.build_layout(files)
+        size = layout["size"]
+        # Solo el ETag (nombres, tamaños y mtimes) identifica el ZIP: borrar o
+        # renombrar un miembro no sube el mtime máximo, así que no hay
+        # validación por fecha (ni If-Modified-Since ni If-Range con fecha)
+        etag = self.make_etag(layout)
+
+        headers = {
+            "Content-Disposition": f"attachment; filename=\"{download_name}\"",
+            "X-Content-Type-Options": "nosniff",
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+        }
+
+        if streaming_service.is_not_modified(etag, None):
+            return Response(status=304, headers=headers)
+
+        ranges = None
+        if streaming_service.if_range_matches(request.headers.get("If-Range"), etag, None):
+            ranges = streaming_service.parse_range(request.headers.get("Range"), size)
+
+        if ranges == []:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+
+        # Varios rangos a la vez no aportan nada aquí: se responde el ZIP completo
+        if ranges and len(ranges) == 1:
+            status = 206
+            start, end = ranges[0]
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        else:
+            status = 200
+            start, end = 0, size - 1
+        headers["Content-Length"] = str(end - start + 1)
+
+        if request.method == "HEAD":
+            return Response(status=status, headers=headers, content_type="application/zip")
+
+        logger.debug(f"ZIP al vuelo: {len(layout['entries'])} archivos, bytes {start}-{end}/{size}")
+        return Response(self.iter_range(layout, start, end), status=status, headers=headers,
+                        content_type="application/zip", direct_passthrough=True)
+
+zip_stream_service = ZipStreamService()